@@ -3,3 +3,46 @@ from django.apps import AppConfig
 
 class MagiclinkConfig(AppConfig):
     name = 'magiclink'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core import checks
+        from django.db import transaction
+        from django.db.models.signals import post_delete, post_save
+
+        from .backends import invalidate_cached_user
+        from .models import MagicLinkUnsubscribe, unsubscribe_filter
+        from .ratelimit import check_rate_limit_cache
+        from .settings import check_settings
+
+        checks.register(check_settings)
+        checks.register(check_rate_limit_cache)
+
+        def invalidate_unsubscribe_filter(**kwargs):
+            # Other processes must not rebuild their filter before the change
+            # is visible to them
+            transaction.on_commit(unsubscribe_filter.invalidate)
+
+        post_save.connect(
+            invalidate_unsubscribe_filter,
+            sender=MagicLinkUnsubscribe,
+            dispatch_uid='magiclink_unsubscribe_saved',
+            weak=False,
+        )
+        post_delete.connect(
+            invalidate_unsubscribe_filter,
+            sender=MagicLinkUnsubscribe,
+            dispatch_uid='magiclink_unsubscribe_deleted',
+            weak=False,
+        )
+
+        post_save.connect(
+            invalidate_cached_user,
+            sender=settings.AUTH_USER_MODEL,
+            dispatch_uid='magiclink_user_saved',
+        )
+        post_delete.connect(
+            invalidate_cached_user,
+            sender=settings.AUTH_USER_MODEL,
+            dispatch_uid='magiclink_user_deleted',
+        )
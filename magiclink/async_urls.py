@@ -0,0 +1,15 @@
+from django.urls import path
+
+from .async_views import AsyncLogin, AsyncLoginVerify, AsyncSignup
+from .views import LoginCode, LoginSent, Logout
+
+app_name = "magiclink"
+
+urlpatterns = [
+    path('login/', AsyncLogin.as_view(), name='login'),
+    path('login/sent/', LoginSent.as_view(), name='login_sent'),
+    path('signup/', AsyncSignup.as_view(), name='signup'),
+    path('login/verify/', AsyncLoginVerify.as_view(), name='login_verify'),
+    path('login/code/', LoginCode.as_view(), name='login_code'),
+    path('logout/', Logout.as_view(), name='logout'),
+]
@@ -0,0 +1,211 @@
+"""
+Async versions of the login, login verify and signup views for sites served
+over ASGI. Database queries use Django's async ORM (Django 4.2+) and emails
+are sent without blocking the event loop. Include `magiclink.async_urls`
+instead of `magiclink.urls` to use them.
+"""
+import logging
+from inspect import isawaitable
+from typing import Optional
+
+import django
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate, login, logout
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest, HttpResponseRedirect
+from django.http.response import HttpResponseBase
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.cache import add_never_cache_headers
+from django.views.generic import View
+
+try:
+    from django.contrib.auth import aauthenticate
+except ImportError:  # pragma: no cover
+    # Django < 5.0
+    aauthenticate = sync_to_async(authenticate)
+
+from . import settings
+from .backends import (
+    get_request_magiclink, get_request_magiclink_error, has_request_magiclink,
+    set_request_magiclink
+)
+from .dispatch import adispatch_magiclink
+from .forms import LoginForm
+from .helpers import acreate_magiclink, aget_or_create_user
+from .models import MagicLink, MagicLinkError
+from .storage import get_storage
+from .views import Login, LoginVerify, Signup, login_sent_response
+
+if django.VERSION < (4, 2):
+    raise ImproperlyConfigured(
+        'magiclink.async_views and magiclink.async_urls need Django 4.2 or '
+        'later. Include magiclink.urls instead',
+    )
+
+log = logging.getLogger(__name__)
+
+
+def csrf_get_response(request: HttpRequest) -> HttpResponseBase:
+    # The middleware's process_view and process_response are called directly
+    raise NotImplementedError  # pragma: no cover
+
+
+csrf_middleware = CsrfViewMiddleware(csrf_get_response)
+
+
+# The async views override the sync dispatch and get methods of Django's
+# generic views, which django-stubs types as returning a response rather than
+# a coroutine
+class AsyncDispatchMixin(View):
+    """
+    Applies the CSRF protection and never_cache headers of the sync views.
+    Before Django 5.0 the csrf_protect and never_cache decorators only
+    support sync views
+    """
+    csrf_protect = False
+    never_cache = False
+
+    async def dispatch(  # type: ignore[override]
+        self,
+        request: HttpRequest,
+        *args: str,
+        **kwargs: str,
+    ) -> HttpResponseBase:
+        # View.dispatch skips the sync csrf_protect and never_cache
+        # decorators of the parent views
+        view = View.dispatch
+        if self.csrf_protect:
+            rejected = csrf_middleware.process_view(
+                request, view, args, kwargs,
+            )
+            if rejected:
+                return rejected
+
+        response = view(self, request, *args, **kwargs)
+        if isawaitable(response):
+            response = await response
+
+        if self.csrf_protect:
+            # The CSRF cookie is only known once the template is rendered
+            if hasattr(response, 'add_post_render_callback'):
+                response.add_post_render_callback(
+                    lambda response: csrf_middleware.process_response(
+                        request, response,
+                    )
+                )
+            else:
+                response = csrf_middleware.process_response(request, response)
+        if self.never_cache:
+            add_never_cache_headers(response)
+        return response
+
+
+class AsyncLogin(AsyncDispatchMixin, Login):
+    csrf_protect = True
+
+    async def get(self, request, *args, **kwargs):  # type: ignore[override]
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        # Sessions and form validation use the sync ORM
+        await sync_to_async(logout)(request)
+        context = self.get_context_data(**kwargs)
+        context['require_signup'] = settings.REQUIRE_SIGNUP
+        form = LoginForm(request.POST, request=request)
+        if not await sync_to_async(form.is_valid)():
+            context['login_form'] = form
+            return self.render_to_response(context)
+
+        email = form.cleaned_data['email']
+        if not settings.REQUIRE_SIGNUP:
+            await aget_or_create_user(email, request=request)
+
+        redirect_url = self.login_redirect_url(request.GET.get('next', ''))
+        try:
+            magiclink = await acreate_magiclink(
+                email, request, redirect_url=redirect_url
+            )
+        except MagicLinkError as e:
+            form.add_error('email', str(e))
+            context['login_form'] = form
+            return self.render_to_response(context)
+
+        await adispatch_magiclink(magiclink, request)
+        return login_sent_response(magiclink)
+
+
+class AsyncLoginVerify(AsyncDispatchMixin, LoginVerify):
+    never_cache = True
+
+    async def get(self, request, *args, **kwargs):  # type: ignore[override]
+        token = request.GET.get('token')
+        email = request.GET.get('email')
+        # Through AUTHENTICATION_BACKENDS like the sync view, so subclasses of
+        # MagicLinkBackend and user_login_failed work. Only Django 5.2+ calls
+        # the backend's aauthenticate, older versions run it in a thread
+        user = await aauthenticate(request, token=token, email=email)
+        if not user:
+            response = self.login_failed_redirect()
+            if response:
+                return response
+
+            magiclink = await self.aget_magiclink()
+            if not magiclink:
+                error = 'A magic link with that token could not be found'
+            else:
+                error = get_request_magiclink_error(request)
+                if not error:
+                    try:
+                        await magiclink.avalidate(request, email)
+                    except MagicLinkError as validation_error:
+                        error = str(validation_error)
+            return self.login_failed_response(error, **kwargs)
+
+        await sync_to_async(login)(request, user)
+        log.info(f'Login successful for {email}')
+        # login_complete_action may be overridden with sync code
+        return await sync_to_async(self.login_success_response)()
+
+    async def aget_magiclink(self) -> Optional[MagicLink]:
+        if not has_request_magiclink(self.request):
+            token = self.request.GET.get('token', '')
+            try:
+                magiclink = await get_storage().aget_by_token(token)
+            except MagicLink.DoesNotExist:
+                magiclink = None
+            set_request_magiclink(self.request, magiclink)
+        return get_request_magiclink(self.request)
+
+
+class AsyncSignup(AsyncDispatchMixin, Signup):
+    csrf_protect = True
+
+    async def get(self, request, *args, **kwargs):  # type: ignore[override]
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        await sync_to_async(logout)(request)
+        context = self.get_context_data(**kwargs)
+        form_name = request.POST.get('form_name')
+        SignupForm = self.get_signup_form_class(form_name)
+        if SignupForm is None:
+            return HttpResponseRedirect(self.request.path_info)
+
+        form = SignupForm(request.POST, request=request)
+        if not await sync_to_async(form.is_valid)():
+            context[form_name] = form
+            return self.render_to_response(context)
+
+        email = form.cleaned_data['email']
+        await aget_or_create_user(request=request, **self.user_details(form))
+        try:
+            magiclink = await acreate_magiclink(
+                email, request, redirect_url=self.signup_redirect_url(),
+            )
+        except MagicLinkError as e:
+            form.add_error('email', str(e))
+            context[form_name] = form
+            return self.render_to_response(context)
+
+        await adispatch_magiclink(magiclink, request)
+        return login_sent_response(magiclink)
@@ -1,55 +1,228 @@
 import logging
+from typing import Optional
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.http import HttpRequest
 
-from . import settings
+from . import metrics, settings
 from .models import MagicLink, MagicLinkError
+from .ratelimit import login_code_attempts
+from .storage import get_storage
 
-User = get_user_model()
 log = logging.getLogger(__name__)
 
 
 class MagicLinkBackend():
 
+    @metrics.measure('verify_seconds')
     def authenticate(
         self,
         request: HttpRequest,
         token: str = '',
         email: str = '',
+        code: str = '',
     ):
-        log.debug(f'MagicLink authenticate token: {token} - email: {email}')
+        if code and not token:
+            return self.authenticate_code(request, email, code)
 
-        if not token:
-            log.warning('Token missing from authentication')
+        if not self.has_credentials(token, email):
             return
 
-        if settings.VERIFY_INCLUDE_EMAIL and not email:
-            log.warning('Email address not supplied with token')
+        try:
+            magiclink = get_storage().get_by_token(token)
+        except MagicLink.DoesNotExist:
+            self.not_found(request, token)
+            return
+
+        if not self.usable(request, magiclink):
             return
 
         try:
-            magiclink = MagicLink.objects.get(token=token)
+            user = magiclink.validate(request, email)
+            magiclink.used(request)
+        except MagicLinkError as error:
+            self.failed(request, error)
+            return
+
+        log.info(f'{user} authenticated via MagicLink')
+        return user
+
+    @metrics.measure('verify_seconds')
+    async def aauthenticate(
+        self,
+        request: HttpRequest,
+        token: str = '',
+        email: str = '',
+        code: str = '',
+    ):
+        if code and not token:
+            return await sync_to_async(self.authenticate_code)(
+                request, email, code,
+            )
+
+        if not self.has_credentials(token, email):
+            return
+
+        try:
+            magiclink = await get_storage().aget_by_token(token)
         except MagicLink.DoesNotExist:
-            log.warning(f'MagicLink with token "{token}" not found')
+            self.not_found(request, token)
             return
 
-        if magiclink.disabled:
-            log.warning(f'MagicLink "{magiclink.pk}" is disabled')
+        if not self.usable(request, magiclink):
             return
 
         try:
-            user = magiclink.validate(request, email)
+            user = await magiclink.avalidate(request, email)
+            await magiclink.aused(request)
         except MagicLinkError as error:
-            log.warning(error)
+            self.failed(request, error)
             return
 
-        magiclink.used()
         log.info(f'{user} authenticated via MagicLink')
         return user
 
+    def authenticate_code(self, request: HttpRequest, email: str, code: str):
+        """
+        Log in with the numeric code from the email instead of the link. The
+        magic link is found by the email and code then validated and used the
+        same way as a token
+        """
+        if not settings.LOGIN_CODE:
+            return
+
+        if not email:
+            log.warning('Email address not supplied with code')
+            metrics.increment('verify_failures', reason='no_email')
+            return
+        if settings.EMAIL_IGNORE_CASE:
+            email = email.lower()
+
+        if not login_code_attempts.attempt(email):
+            set_request_magiclink(request, None)
+            self.failed(request, MagicLinkError(
+                'Too many incorrect login codes', reason='code_attempts',
+            ))
+            return
+
+        try:
+            magiclink = get_storage().get_by_code(email, code)
+        except MagicLink.DoesNotExist:
+            log.warning(f'MagicLink code for {email} not found')
+            metrics.increment('verify_failures', reason='not_found')
+            set_request_magiclink(request, None)
+            return
+
+        if not self.usable(request, magiclink):
+            return
+
+        try:
+            user = magiclink.validate(request, email)
+            magiclink.used(request)
+        except MagicLinkError as error:
+            self.failed(request, error)
+            return
+
+        login_code_attempts.reset(email)
+        log.info(f'{user} authenticated via MagicLink code')
+        return user
+
+    def has_credentials(self, token: str, email: str) -> bool:
+        log.debug(f'MagicLink authenticate token: {token} - email: {email}')
+
+        if not token:
+            log.warning('Token missing from authentication')
+            metrics.increment('verify_failures', reason='no_token')
+            return False
+
+        if settings.VERIFY_INCLUDE_EMAIL and not email:
+            log.warning('Email address not supplied with token')
+            metrics.increment('verify_failures', reason='no_email')
+            return False
+        return True
+
+    def not_found(self, request: HttpRequest, token: str) -> None:
+        log.warning(f'MagicLink with token "{token}" not found')
+        metrics.increment('verify_failures', reason='not_found')
+        set_request_magiclink(request, None)
+
+    def usable(self, request: HttpRequest, magiclink: MagicLink) -> bool:
+        # Keep the magic link on the request so LoginVerify does not need to
+        # look it up again
+        set_request_magiclink(request, magiclink)
+
+        if magiclink.disabled:
+            log.warning(f'MagicLink "{magiclink.pk}" is disabled')
+            metrics.increment('verify_failures', reason='disabled')
+            return False
+        return True
+
+    def failed(self, request: HttpRequest, error: MagicLinkError) -> None:
+        log.warning(error)
+        reason = metrics.error_reason(error)
+        metrics.increment('verify_failures', reason=reason)
+        set_request_magiclink_error(request, str(error))
+
     def get_user(self, user_id):
+        # Called by AuthenticationMiddleware on every request so the user can
+        # be cached for MAGICLINK_USER_CACHE_TIMEOUT seconds
+        if settings.USER_CACHE_TIMEOUT:
+            user = cache.get(user_cache_key(user_id))
+            if user is not None:
+                return user
+
+        User = get_user_model()
         try:
-            return User.objects.get(pk=user_id)
+            user = User.objects.get(pk=user_id)
         except User.DoesNotExist:
             return
+
+        if settings.USER_CACHE_TIMEOUT:
+            cache.set(
+                user_cache_key(user_id), user, settings.USER_CACHE_TIMEOUT,
+            )
+        return user
+
+
+def set_request_magiclink(
+    request: HttpRequest,
+    magiclink: Optional[MagicLink],
+) -> None:
+    """
+    Keep the magic link resolved by MagicLinkBackend on the request (None if
+    it was not found) so the views do not need to look it up again
+    """
+    setattr(request, 'magiclink', magiclink)
+    setattr(request, 'magiclink_error', '')
+
+
+def set_request_magiclink_error(request: HttpRequest, error: str) -> None:
+    setattr(request, 'magiclink_error', error)
+
+
+def has_request_magiclink(request: HttpRequest) -> bool:
+    return hasattr(request, 'magiclink')
+
+
+def get_request_magiclink(request: HttpRequest) -> Optional[MagicLink]:
+    magiclink: Optional[MagicLink] = getattr(request, 'magiclink', None)
+    return magiclink
+
+
+def get_request_magiclink_error(request: HttpRequest) -> str:
+    error: str = getattr(request, 'magiclink_error', '')
+    return error
+
+
+def user_cache_key(user_id) -> str:
+    return f'magiclink:user:{user_id}'
+
+
+def invalidate_cached_user(instance, **kwargs) -> None:
+    # Sent on every user save (e.g. update_last_login) so only touch the
+    # cache when users are cached
+    if not settings.USER_CACHE_TIMEOUT:
+        return
+    cache.delete(user_cache_key(instance.pk))
@@ -0,0 +1,130 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from . import settings
+from .models import MagicLink
+
+log = logging.getLogger(__name__)
+
+
+class SendBackend():
+    """
+    Base class for sending magic link emails. Subclasses decide when and
+    where `deliver` is called
+    """
+
+    def send(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def deliver(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        error: Optional[Exception] = None
+        try:
+            magiclink.send(request)
+        except Exception as exc:
+            error = exc
+            log.exception(f'Sending magic link to {magiclink.email} failed')
+        report_result(magiclink, error)
+
+    async def asend(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        """
+        Called by the async views. By default `send` is run in a worker
+        thread
+        """
+        await sync_to_async(self.send, thread_sensitive=False)(
+            magiclink, request,
+        )
+
+
+class SyncSendBackend(SendBackend):
+
+    def send(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        self.deliver(magiclink, request)
+
+    async def asend(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        error: Optional[Exception] = None
+        try:
+            await magiclink.asend(request)
+        except Exception as exc:
+            error = exc
+            log.exception(f'Sending magic link to {magiclink.email} failed')
+        await sync_to_async(report_result)(magiclink, error)
+
+
+class ThreadPoolSendBackend(SendBackend):
+    """
+    Sends emails from a bounded pool of worker threads. If the queue is full
+    the email is sent in the calling thread
+    """
+
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.SEND_THREADS,
+            thread_name_prefix='magiclink-send',
+        )
+        self.slots = threading.BoundedSemaphore(settings.SEND_QUEUE_SIZE)
+
+    def send(self, magiclink: MagicLink, request: HttpRequest) -> None:
+        if not self.slots.acquire(blocking=False):
+            log.warning('Magic link send queue is full, sending inline')
+            self.deliver(magiclink, request)
+            return
+        self.executor.submit(self.deliver_in_thread, magiclink, request)
+
+    def deliver_in_thread(
+        self,
+        magiclink: MagicLink,
+        request: HttpRequest,
+    ) -> None:
+        close_old_connections()
+        try:
+            self.deliver(magiclink, request)
+        finally:
+            self.slots.release()
+            close_old_connections()
+
+
+@lru_cache(maxsize=None)
+def load_send_backend(path: str) -> SendBackend:
+    return import_string(path)()
+
+
+def get_send_backend() -> SendBackend:
+    return load_send_backend(settings.SEND_BACKEND)
+
+
+def report_result(magiclink: MagicLink, error: Optional[Exception]) -> None:
+    if not settings.SEND_RESULT_HOOK:
+        return
+    try:
+        import_string(settings.SEND_RESULT_HOOK)(magiclink, error)
+    except Exception:
+        log.exception('Magic link send result hook failed')
+
+
+def dispatch_magiclink(magiclink: MagicLink, request: HttpRequest) -> None:
+    """
+    Send the magic link email using MAGICLINK_SEND_BACKEND once the current
+    transaction (if any) has been committed
+    """
+    transaction.on_commit(
+        lambda: get_send_backend().send(magiclink, request)
+    )
+
+
+async def adispatch_magiclink(
+    magiclink: MagicLink,
+    request: HttpRequest,
+) -> None:
+    """
+    Send the magic link email from an async view. Async views run in
+    autocommit mode so there is no transaction to wait for
+    """
+    await get_send_backend().asend(magiclink, request)
@@ -0,0 +1,76 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.loader import get_template
+from django.utils.autoreload import file_changed
+
+from . import settings
+
+Context = Dict[str, object]
+
+
+class EmailRenderer():
+    """
+    Loads and compiles the magic link email templates once and pre-builds the
+    parts of the context which only depend on settings
+    """
+
+    def __init__(self) -> None:
+        self.key = self.settings_key()
+        self.text_template = get_template(settings.EMAIL_TEMPLATE_NAME_TEXT)
+        self.html_template = get_template(settings.EMAIL_TEMPLATE_NAME_HTML)
+        self.static_context: Context = {
+            'subject': settings.EMAIL_SUBJECT,
+            'require_same_ip': settings.REQUIRE_SAME_IP,
+            'require_same_browser': settings.REQUIRE_SAME_BROWSER,
+            'token_uses': settings.TOKEN_USES,
+            'style': settings.EMAIL_STYLES,
+        }
+
+    @staticmethod
+    def settings_key() -> Tuple[object, ...]:
+        return (
+            settings.EMAIL_TEMPLATE_NAME_TEXT,
+            settings.EMAIL_TEMPLATE_NAME_HTML,
+            settings.EMAIL_SUBJECT,
+            settings.REQUIRE_SAME_IP,
+            settings.REQUIRE_SAME_BROWSER,
+            settings.TOKEN_USES,
+            id(settings.EMAIL_STYLES),
+        )
+
+    def render(self, context: Context) -> Tuple[str, str]:
+        """
+        Returns the plain text and HTML email bodies. `context` only needs the
+        values which are different for each magic link
+        """
+        full_context = {**self.static_context, **context}
+        plain = self.text_template.render(full_context)
+        html = self.html_template.render(full_context)
+        return plain, html
+
+
+_renderer: Optional[EmailRenderer] = None
+_lock = threading.Lock()
+
+
+def get_email_renderer() -> EmailRenderer:
+    global _renderer
+    renderer = _renderer
+    if renderer is None or renderer.key != EmailRenderer.settings_key():
+        with _lock:
+            renderer = _renderer = EmailRenderer()
+    return renderer
+
+
+@receiver(setting_changed)
+@receiver(file_changed)
+def reset_email_renderer(**kwargs: object) -> None:
+    """
+    Drop the cached templates so they are loaded again on the next email.
+    Called when settings are overridden or a file changes under runserver
+    """
+    global _renderer
+    _renderer = None
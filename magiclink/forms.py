@@ -6,8 +6,7 @@ from django.core.exceptions import ValidationError
 
 from . import settings
 from .models import MagicLinkUnsubscribe
-
-User = get_user_model()
+from .users import get_user
 
 
 class AntiSpam(forms.Form):
@@ -58,6 +57,9 @@ class AntiSpam(forms.Form):
         return load_time
 
     def __init__(self, *args, **kwargs):
+        # The request is used to share the user lookup with the rest of the
+        # login flow
+        self.request = kwargs.pop('request', None)
         super().__init__(*args, **kwargs)
         self.fields['load_time'].initial = time()
         if not settings.ANTISPAM_FORMS:
@@ -78,9 +80,8 @@ class LoginForm(AntiSpam):
         if settings.EMAIL_IGNORE_CASE:
             email = email.lower()
 
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
+        user = get_user(email, self.request)
+        if user is None:
             if settings.REQUIRE_SIGNUP:
                 error = 'We could not find a user with that email address'
                 raise forms.ValidationError(error)
@@ -90,16 +91,32 @@ class LoginForm(AntiSpam):
                 raise forms.ValidationError('This user has been deactivated')
 
         if not settings.IGNORE_UNSUBSCRIBE_IF_USER:
-            try:
-                MagicLinkUnsubscribe.objects.get(email=email)
+            if MagicLinkUnsubscribe.objects.is_unsubscribed(email):
                 error = 'Email address is on the unsubscribe list'
                 raise forms.ValidationError(error)
-            except MagicLinkUnsubscribe.DoesNotExist:
-                pass
 
         return email
 
 
+class LoginCodeForm(forms.Form):
+    email = forms.EmailField(
+        widget=forms.EmailInput(attrs={'placeholder': 'Enter your email'})
+    )
+    code = forms.CharField(
+        max_length=20,
+        widget=forms.TextInput(attrs={
+            'autocomplete': 'one-time-code', 'inputmode': 'numeric',
+            'placeholder': 'Enter the code from the email',
+        }),
+    )
+
+    def clean_code(self) -> str:
+        code = self.cleaned_data['code'].replace(' ', '')
+        if not code.isdigit():
+            raise forms.ValidationError('The code should only contain numbers')
+        return code
+
+
 class SignupFormEmailOnly(AntiSpam):
     form_name = forms.CharField(
         initial='SignupFormEmailOnly', widget=forms.HiddenInput()
@@ -114,23 +131,19 @@ class SignupFormEmailOnly(AntiSpam):
         if settings.EMAIL_IGNORE_CASE:
             email = email.lower()
 
-        try:
-            MagicLinkUnsubscribe.objects.get(email=email)
+        if MagicLinkUnsubscribe.objects.is_unsubscribed(email):
             error = 'Email address is on the unsubscribe list'
             raise forms.ValidationError(error)
-        except MagicLinkUnsubscribe.DoesNotExist:
-            pass
 
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
+        user = get_user(email, self.request)
+        if user is None:
             return email
-        else:
-            error = 'Email address is already linked to an account'
-            is_active = getattr(user, 'is_active', True)
-            if not settings.IGNORE_IS_ACTIVE_FLAG and not is_active:
-                error = 'This user has been deactivated'
-            raise forms.ValidationError(error)
+
+        error = 'Email address is already linked to an account'
+        is_active = getattr(user, 'is_active', True)
+        if not settings.IGNORE_IS_ACTIVE_FLAG and not is_active:
+            error = 'This user has been deactivated'
+        raise forms.ValidationError(error)
 
 
 class SignupForm(SignupFormEmailOnly):
@@ -154,7 +167,7 @@ class SignupFormWithUsername(SignupFormEmailOnly):
 
     def clean_username(self) -> str:
         username = self.cleaned_data['username']
-        users = User.objects.filter(username=username)
+        users = get_user_model().objects.filter(username=username)
         if users:
             raise forms.ValidationError(
                 'username is already linked to an account'
@@ -1,16 +1,28 @@
+import logging
+import time
 from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
 from uuid import uuid4
 
 from django.conf import settings as djsettings
 from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.base import BaseEmailBackend
 from django.db.utils import IntegrityError
 from django.http import HttpRequest
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
-from . import settings
-from .models import MagicLink, MagicLinkError
-from .utils import get_client_ip, get_url_path
+from . import metrics, settings
+from .models import MagicLink, MagicLinkError, MagicLinkUnsubscribe
+from .ratelimit import get_rate_limiter
+from .signals import asend_signal, magiclink_created, send_signal
+from .storage import get_storage
+from .tokens import generate_code, generate_token, hash_code, hash_verifier
+from .users import aget_user, get_user, remember_user
+from .utils import chunked, get_client_ip, get_url_path
+
+log = logging.getLogger(__name__)
 
 
 def create_magiclink(
@@ -18,18 +30,57 @@ def create_magiclink(
     request: HttpRequest,
     redirect_url: str = '',
 ) -> MagicLink:
+    start = time.perf_counter()
     if settings.EMAIL_IGNORE_CASE:
         email = email.lower()
 
-    limit = timezone.now() - timedelta(seconds=settings.LOGIN_REQUEST_TIME_LIMIT)  # NOQA: E501
-    over_limit = MagicLink.objects.filter(email=email, created__gte=limit)
-    if over_limit:
-        raise MagicLinkError('Too many magic login requests')
+    limiter = get_rate_limiter()
+    if limiter and not limiter.allow(email, request):
+        metrics.increment('rate_limited')
+        raise MagicLinkError(
+            'Too many magic login requests', reason='rate_limited',
+        )
+
+    magic_link = build_magiclink(email, request, redirect_url)
+    if not settings.STATELESS:
+        get_storage().add(magic_link)
+    metrics.increment('links_created')
+    send_signal(magiclink_created, magic_link, request, start)
+    return magic_link
+
 
-    if settings.ONE_TOKEN_PER_USER:
-        magic_links = MagicLink.objects.filter(email=email, disabled=False)
-        magic_links.update(disabled=True)
+async def acreate_magiclink(
+    email: str,
+    request: HttpRequest,
+    redirect_url: str = '',
+) -> MagicLink:
+    start = time.perf_counter()
+    if settings.EMAIL_IGNORE_CASE:
+        email = email.lower()
+
+    limiter = get_rate_limiter()
+    if limiter and not await limiter.aallow(email, request):
+        metrics.increment('rate_limited')
+        raise MagicLinkError(
+            'Too many magic login requests', reason='rate_limited',
+        )
+
+    magic_link = build_magiclink(email, request, redirect_url)
+    if not settings.STATELESS:
+        await get_storage().aadd(magic_link)
+    metrics.increment('links_created')
+    await asend_signal(magiclink_created, magic_link, request, start)
+    return magic_link
 
+
+def build_magiclink(
+    email: str,
+    request: HttpRequest,
+    redirect_url: str = '',
+) -> MagicLink:
+    """
+    Returns an unsaved magic link (or a stateless magic link) for the email
+    """
     if not redirect_url:
         redirect_url = get_url_path(djsettings.LOGIN_REDIRECT_URL)
 
@@ -40,35 +91,246 @@ def create_magiclink(
             client_ip = client_ip[:client_ip.rfind('.')+1] + '0'
 
     expiry = timezone.now() + timedelta(seconds=settings.AUTH_TIMEOUT)
-    magic_link = MagicLink.objects.create(
+    if settings.STATELESS:
+        return MagicLink.objects.build_stateless(
+            email=email,
+            expiry=expiry,
+            redirect_url=redirect_url,
+            cookie_value=str(uuid4()),
+            ip_address=client_ip,
+        )
+
+    selector, verifier = generate_token()
+    magic_link = MagicLink(
         email=email,
-        token=get_random_string(length=settings.TOKEN_LENGTH),
+        token=selector,
+        verifier_hash=hash_verifier(verifier),
         expiry=expiry,
         redirect_url=redirect_url,
         cookie_value=str(uuid4()),
         ip_address=client_ip,
     )
+    magic_link.verifier = verifier
+    if settings.LOGIN_CODE:
+        magic_link.code = generate_code()
+        magic_link.code_hash = hash_code(email, magic_link.code)
     return magic_link
 
 
+def create_magiclinks(
+    emails: Iterable[str],
+    request: HttpRequest,
+    redirect_url: str = '',
+    batch_size: int = 500,
+) -> List[MagicLink]:
+    """
+    Create magic links for many existing users at once (e.g. for an invite
+    campaign). Users and the unsubscribe list are looked up a batch at a time
+    and the magic links are saved with bulk_create. Emails without a user or
+    on the unsubscribe list are skipped. The request time limit is not
+    applied.
+    """
+    User = get_user_model()
+
+    if not redirect_url:
+        redirect_url = get_url_path(djsettings.LOGIN_REDIRECT_URL)
+
+    seen = set()
+    magic_links: List[MagicLink] = []
+    for batch in chunked(emails, batch_size):
+        if settings.EMAIL_IGNORE_CASE:
+            batch = [email.lower() for email in batch]
+        batch = [
+            email for email in dict.fromkeys(batch) if email not in seen
+        ]
+        seen.update(batch)
+
+        found = set(
+            User.objects.filter(email__in=batch)
+            .values_list('email', flat=True)
+        )
+        if not settings.IGNORE_UNSUBSCRIBE_IF_USER:
+            found -= set(
+                MagicLinkUnsubscribe.objects.filter(email__in=found)
+                .values_list('email', flat=True)
+            )
+        batch = [email for email in batch if email in found]
+        if not batch:
+            continue
+
+        expiry = timezone.now() + timedelta(seconds=settings.AUTH_TIMEOUT)
+        if settings.STATELESS:
+            magic_links.extend(
+                MagicLink.objects.build_stateless(
+                    email=email,
+                    expiry=expiry,
+                    redirect_url=redirect_url,
+                    cookie_value=str(uuid4()),
+                )
+                for email in batch
+            )
+            continue
+
+        new_links = []
+        for email in batch:
+            selector, verifier = generate_token()
+            magic_link = MagicLink(
+                email=email,
+                token=selector,
+                verifier_hash=hash_verifier(verifier),
+                expiry=expiry,
+                redirect_url=redirect_url,
+                cookie_value=str(uuid4()),
+                created=timezone.now(),
+            )
+            magic_link.verifier = verifier
+            new_links.append(magic_link)
+        get_storage().add_many(new_links)
+        magic_links.extend(new_links)
+
+    metrics.increment('links_created', len(magic_links))
+    return magic_links
+
+
+def send_magiclinks(
+    magic_links: Iterable[MagicLink],
+    request: HttpRequest,
+    batch_size: int = 500,
+    connection: Optional[BaseEmailBackend] = None,
+    domain: str = '',
+) -> int:
+    """
+    Send the emails for many magic links over a single email connection.
+    If a connection is passed in the caller is responsible for closing it.
+    The links use `domain` instead of the current site when it is given.
+    Magic links whose user was deleted or changed email address since the
+    link was created are skipped. Returns the number of emails sent
+    """
+    User = get_user_model()
+
+    close_connection = connection is None
+    if connection is None:
+        from .mail import get_mail_connection
+        connection = get_mail_connection()
+
+    sent = 0
+    connection.open()
+    try:
+        for batch in chunked(magic_links, batch_size):
+            emails = [magic_link.email for magic_link in batch]
+            users = {
+                user.email: user
+                for user in User.objects.filter(email__in=emails)
+            }
+            messages = []
+            for magic_link in batch:
+                user = users.get(magic_link.email)
+                if user is None:
+                    log.warning(
+                        f'Not sending magic link to {magic_link.email}, '
+                        'no user has that email address'
+                    )
+                    continue
+                plain, html = magic_link.render_email(request, user, domain)
+                message = EmailMultiAlternatives(
+                    subject=settings.EMAIL_SUBJECT,
+                    body=plain,
+                    from_email=djsettings.DEFAULT_FROM_EMAIL,
+                    to=[user.email],
+                    connection=connection,
+                )
+                message.attach_alternative(html, 'text/html')
+                messages.append(message)
+            sent += connection.send_messages(messages) or 0
+    finally:
+        if close_connection:
+            connection.close()
+    return sent
+
+
 def get_or_create_user(
     email: str,
     username: str = '',
     first_name: str = '',
-    last_name: str = ''
+    last_name: str = '',
+    request: Optional[HttpRequest] = None,
 ):
     User = get_user_model()
 
     if settings.EMAIL_IGNORE_CASE:
         email = email.lower()
 
-    try:
-        user = User.objects.get(email=email)
-    except User.DoesNotExist:
-        pass
+    existing_user = get_user(email, request)
+    if existing_user is not None:
+        return existing_user
+
+    user_details, random_username = new_user_details(
+        email, username, first_name, last_name,
+    )
+    if random_username:
+        # Set a random username if we need to set a username and
+        # EMAIL_AS_USERNAME is False
+        created = False
+        while not created:
+            user_details['username'] = get_random_string(length=10)
+            try:
+                user = User.objects.create(**user_details)
+                created = True
+            except IntegrityError:  # pragma: no cover
+                pass
+    else:
+        user = User.objects.create(**user_details)
+
+    remember_user(user, request)
+    return user
+
+
+async def aget_or_create_user(
+    email: str,
+    username: str = '',
+    first_name: str = '',
+    last_name: str = '',
+    request: Optional[HttpRequest] = None,
+):
+    User = get_user_model()
+
+    if settings.EMAIL_IGNORE_CASE:
+        email = email.lower()
+
+    existing_user = await aget_user(email, request)
+    if existing_user is not None:
+        return existing_user
+
+    user_details, random_username = new_user_details(
+        email, username, first_name, last_name,
+    )
+    if random_username:
+        created = False
+        while not created:
+            user_details['username'] = get_random_string(length=10)
+            try:
+                user = await User.objects.acreate(**user_details)
+                created = True
+            except IntegrityError:  # pragma: no cover
+                pass
     else:
-        return user
+        user = await User.objects.acreate(**user_details)
+
+    remember_user(user, request)
+    return user
+
 
+def new_user_details(
+    email: str,
+    username: str = '',
+    first_name: str = '',
+    last_name: str = '',
+) -> Tuple[Dict[str, str], bool]:
+    """
+    Returns the fields for a new user and whether a random username needs
+    to be generated
+    """
+    User = get_user_model()
     user_fields = [field.name for field in User._meta.get_fields()]
 
     if not username and settings.EMAIL_AS_USERNAME:
@@ -85,19 +347,7 @@ def get_or_create_user(
         user_details['name'] = f'{first_name} {last_name}'.strip()
 
     if 'username' in user_fields and not username:
-        # Set a random username if we need to set a username and
-        # EMAIL_AS_USERNAME is False
-        created = False
-        while not created:
-            user_details['username'] = get_random_string(length=10)
-            try:
-                user = User.objects.create(**user_details)
-                created = True
-            except IntegrityError:  # pragma: no cover
-                pass
-    else:
-        if 'username' in user_fields:
-            user_details['username'] = username
-        user = User.objects.create(**user_details)
-
-    return user
+        return user_details, True
+    if 'username' in user_fields:
+        user_details['username'] = username
+    return user_details, False
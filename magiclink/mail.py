@@ -0,0 +1,180 @@
+import smtplib
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import EmailMessage
+
+from . import settings
+
+
+def get_mail_connection(
+    fail_silently: bool = False,
+    **kwargs: object,
+) -> BaseEmailBackend:
+    """
+    Returns a connection to the MAGICLINK_EMAIL_BACKEND, falling back to
+    Django's EMAIL_BACKEND
+    """
+    return get_connection(
+        settings.EMAIL_BACKEND or None, fail_silently=fail_silently, **kwargs,
+    )
+
+
+class SMTPConnectionPool():
+    """
+    A thread safe pool of idle SMTP connections. The most recently used
+    connection is handed out first so the others can expire
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.idle: List[Tuple[smtplib.SMTP, float, float]] = []
+        self.opened = 0
+
+    def acquire(
+        self,
+        max_age: float,
+        keepalive: float,
+    ) -> Optional[Tuple[smtplib.SMTP, float]]:
+        """
+        Returns an idle connection and the time it was opened
+        """
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection, created, last_used = self.idle.pop()
+
+            now = time.monotonic()
+            if now - created >= max_age:
+                self.quit(connection)
+                continue
+            if now - last_used >= keepalive:
+                # Check the server has not dropped an idle connection
+                try:
+                    status = connection.noop()[0]
+                except (smtplib.SMTPException, OSError):
+                    status = None
+                if status != 250:
+                    self.quit(connection)
+                    continue
+            return connection, created
+
+    def release(
+        self,
+        connection: smtplib.SMTP,
+        created: float,
+        max_age: float,
+        size: int,
+    ) -> None:
+        now = time.monotonic()
+        with self.lock:
+            if now - created < max_age and len(self.idle) < size:
+                self.idle.append((connection, created, now))
+                return
+        self.quit(connection)
+
+    def record_open(self) -> None:
+        with self.lock:
+            self.opened += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _, _ in idle:
+            self.quit(connection)
+
+    @staticmethod
+    def quit(connection: smtplib.SMTP) -> None:
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+
+_pools: Dict[Tuple[object, ...], SMTPConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+class PooledSMTPEmailBackend(SMTPEmailBackend):
+    """
+    SMTP email backend which keeps connections open between emails. Each
+    connection is reused until it is MAGICLINK_SMTP_MAX_AGE seconds old and
+    is checked with a NOOP if it has been idle for MAGICLINK_SMTP_KEEPALIVE
+    seconds. At most MAGICLINK_SMTP_POOL_SIZE idle connections are kept.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        max_age: Optional[float] = None,
+        keepalive: Optional[float] = None,
+        **kwargs: object,
+    ) -> None:
+        super().__init__(**kwargs)  # type: ignore
+        if pool_size is None:
+            pool_size = settings.SMTP_POOL_SIZE
+        if max_age is None:
+            max_age = settings.SMTP_MAX_AGE
+        if keepalive is None:
+            keepalive = settings.SMTP_KEEPALIVE
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.keepalive = keepalive
+        self.created = 0.0
+
+    @property
+    def pool(self) -> SMTPConnectionPool:
+        key = (
+            self.host, self.port, self.username, self.use_tls, self.use_ssl,
+        )
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = SMTPConnectionPool()
+            return _pools[key]
+
+    def open(self) -> Optional[bool]:
+        if self.connection:
+            return False
+
+        pooled = self.pool.acquire(self.max_age, self.keepalive)
+        if pooled:
+            self.connection, self.created = pooled
+            return True
+
+        opened = super().open()
+        if self.connection:
+            self.created = time.monotonic()
+            self.pool.record_open()
+        return opened
+
+    def close(self) -> None:
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        self.pool.release(
+            connection, self.created, self.max_age, self.pool_size,
+        )
+
+    def discard(self) -> None:
+        if self.connection is not None:
+            SMTPConnectionPool.quit(self.connection)
+        self.connection = None
+
+    # _send is private to Django's SMTP backend so it's missing from the
+    # type stubs
+    def _send(self, email_message: EmailMessage) -> bool:
+        try:
+            return super()._send(email_message)  # type: ignore[misc]
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server dropped the connection. Retry once on a new one
+            self.discard()
+            if not super().open():
+                return False
+            self.created = time.monotonic()
+            self.pool.record_open()
+            return super()._send(email_message)  # type: ignore[misc]
@@ -1,24 +1,85 @@
+import time
 from datetime import timedelta
 
 from django.core.management.base import BaseCommand
+from django.db.models import Max, Min, Model, QuerySet
 from django.utils import timezone
 
 from ... import settings
-from ...models import MagicLink
+from ...models import MagicLink, MagicLinkConsumed
 
 
 class Command(BaseCommand):
     help = 'Delete disabled Magic Links'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of primary keys covered by each delete',
+        )
+        parser.add_argument(
+            '--sleep-between-batches', type=float, default=0,
+            help='Seconds to wait between each batch',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count the magic links which would be deleted',
+        )
+
     def handle(self, *args, **options):
+        self.batch_size = max(1, options['batch_size'])
+        self.sleep = options['sleep_between_batches']
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+
         limit = timezone.now() - timedelta(seconds=settings.LOGIN_REQUEST_TIME_LIMIT)  # NOQA: E501
         week_before = limit - timedelta(days=7)
 
-        for magic_links in MagicLink.objects.filter(expiry__lte=week_before):
-            magic_links.disable()
+        # Magic links which expired over a week ago are removed along with
+        # any which have been disabled
+        magic_links = (
+            MagicLink.objects.filter(disabled=True)
+            | MagicLink.objects.expired(before=week_before)
+        )
+        self.delete_in_batches(magic_links, 'magic links')
+
+        consumed = MagicLinkConsumed.objects.filter(expiry__lte=timezone.now())
+        self.delete_in_batches(consumed, 'consumed stateless magic links')
+
+    def delete_in_batches(self, queryset: QuerySet[Model], name: str) -> int:
+        """
+        Walk the primary key range in windows of batch_size so each
+        statement is short and nothing is loaded into memory
+        """
+        manager = queryset.model._default_manager
+        pks = manager.aggregate(low=Min('pk'), high=Max('pk'))
+        if pks['low'] is None:
+            self.stdout.write(f'Deleted 0 {name}')
+            return 0
+
+        action = 'Would delete' if self.dry_run else 'Deleted'
+        start = time.monotonic()
+        total = 0
+        for low in range(pks['low'], pks['high'] + 1, self.batch_size):
+            high = low + self.batch_size - 1
+            batch = queryset.filter(pk__gte=low, pk__lte=high)
+            if self.dry_run:
+                total += batch.count()
+            else:
+                total += batch.delete()[0]
 
-        disabled_links = MagicLink.objects.filter(disabled=True)
-        self.stdout.write(f'Deleting {disabled_links.count()} magic links')
+            if self.verbosity >= 2:
+                rate = total / max(time.monotonic() - start, 1e-6)
+                self.stdout.write(
+                    f'{action} {total} {name} up to pk {high} '
+                    f'({rate:.0f} rows/s)'
+                )
+            if self.sleep and high < pks['high']:
+                time.sleep(self.sleep)
 
-        for magic_link in MagicLink.objects.filter(disabled=True):
-            magic_link.delete()
+        elapsed = time.monotonic() - start
+        rate = total / max(elapsed, 1e-6)
+        self.stdout.write(
+            f'{action} {total} {name} in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        )
+        return total
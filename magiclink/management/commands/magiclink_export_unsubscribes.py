@@ -0,0 +1,68 @@
+import csv
+import json
+import time
+from typing import TextIO, Union
+
+from django.core.management.base import BaseCommand, OutputWrapper
+
+from ...models import MagicLinkUnsubscribe
+from .magiclink_import_unsubscribes import guess_format
+
+
+class Command(BaseCommand):
+    help = 'Write the unsubscribe list to a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='CSV or NDJSON file to write ("-" for stdout)',
+        )
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='File format. Guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Number of rows fetched from the database at a time',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        start = time.monotonic()
+        written = 0
+
+        emails = (
+            MagicLinkUnsubscribe.objects.order_by('pk')
+            .values_list('email', flat=True)
+            .iterator(chunk_size=max(1, options['chunk_size']))
+        )
+
+        stream: Union[OutputWrapper, TextIO]
+        if path == '-':
+            stream = self.stdout
+        else:
+            stream = open(path, 'w', encoding='utf-8', newline='')
+        try:
+            if file_format == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow(['email'])
+                for email in emails:
+                    writer.writerow([email])
+                    written += 1
+            else:
+                for email in emails:
+                    stream.write(json.dumps({'email': email}) + '\n')
+                    written += 1
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+
+        elapsed = time.monotonic() - start
+        rate = written / max(elapsed, 1e-6)
+        # Keep stdout clean when the export is written to it
+        output = self.stderr if path == '-' else self.stdout
+        output.write(
+            f'Exported {written} email addresses in {elapsed:.2f}s '
+            f'({rate:.0f} rows/s)'
+        )
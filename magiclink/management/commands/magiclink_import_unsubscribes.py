@@ -0,0 +1,130 @@
+import csv
+import json
+import sys
+import time
+from typing import IO, Iterator
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from ... import settings
+from ...models import MagicLinkUnsubscribe, unsubscribe_filter
+from ...utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Import email addresses into the unsubscribe list'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='CSV or NDJSON file to import ("-" for stdin)',
+        )
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='File format. Guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of email addresses inserted at a time',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        batch_size = max(1, options['batch_size'])
+        start = time.monotonic()
+        read = invalid = imported = 0
+
+        if path == '-':
+            stream = sys.stdin
+        else:
+            stream = open(path, encoding='utf-8', newline='')
+        try:
+            emails = read_emails(stream, file_format)
+            for batch in chunked(emails, batch_size):
+                read += len(batch)
+                valid = [email for email in batch if is_valid_email(email)]
+                invalid += len(batch) - len(valid)
+                if settings.EMAIL_IGNORE_CASE:
+                    valid = [email.lower() for email in valid]
+                valid = list(dict.fromkeys(valid))
+                existing = set(
+                    MagicLinkUnsubscribe.objects.filter(email__in=valid)
+                    .values_list('email', flat=True)
+                )
+                new = [email for email in valid if email not in existing]
+                # Rows added by someone else since the lookup are skipped by
+                # the unique index
+                MagicLinkUnsubscribe.objects.bulk_create(
+                    [MagicLinkUnsubscribe(email=email) for email in new],
+                    ignore_conflicts=True,
+                )
+                imported += len(new)
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'Imported {read} rows')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # bulk_create does not send post_save
+        transaction.on_commit(unsubscribe_filter.invalidate)
+
+        elapsed = time.monotonic() - start
+        rate = read / max(elapsed, 1e-6)
+        self.stdout.write(
+            f'Read {read} rows and imported {imported} new email addresses '
+            f'in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        )
+        if invalid:
+            self.stdout.write(f'Skipped {invalid} invalid email addresses')
+
+
+def is_valid_email(email: str) -> bool:
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def guess_format(path: str) -> str:
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if path.endswith('.csv') or path == '-':
+        return 'csv'
+    raise CommandError('Unknown file format. Use --format csv or ndjson')
+
+
+def read_emails(stream: IO[str], file_format: str) -> Iterator[str]:
+    if file_format == 'ndjson':
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                email = json.loads(line)['email']
+            except (ValueError, KeyError, TypeError):
+                raise CommandError(f'Invalid JSON on line {line_number}')
+            email = email.strip()
+            if email:
+                yield email
+        return
+
+    # CSV files use the "email" column if there is a header row, otherwise
+    # the first column
+    rows = csv.reader(stream)
+    column = 0
+    for row_number, row in enumerate(rows):
+        if not row:
+            continue
+        if row_number == 0:
+            header = [value.strip().lower() for value in row]
+            if 'email' in header:
+                column = header.index('email')
+                continue
+        email = row[column].strip()
+        if email:
+            yield email
@@ -0,0 +1,120 @@
+import sys
+import time
+from typing import IO, Iterator
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest
+
+from ... import settings
+from ...helpers import create_magiclinks, send_magiclinks
+from ...mail import get_mail_connection
+from ...utils import chunked
+
+
+class InviteRequest(HttpRequest):
+    """
+    Stand in request used to build the magic link URLs outside of a view
+    """
+
+    def __init__(self, domain: str, secure: bool) -> None:
+        super().__init__()
+        self.secure = secure
+        self.META['SERVER_NAME'] = domain
+        self.META['SERVER_PORT'] = '443' if secure else '80'
+
+    def _get_scheme(self) -> str:
+        return 'https' if self.secure else 'http'
+
+
+class Command(BaseCommand):
+    help = 'Create and send magic links to the email addresses in a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File with one email address per line ("-" for stdin)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of magic links created and sent at a time',
+        )
+        parser.add_argument(
+            '--domain', required=True,
+            help='Domain used to build the magic link URLs (used instead '
+                 'of the current site when django.contrib.sites is '
+                 'installed)',
+        )
+        parser.add_argument(
+            '--https', action='store_true',
+            help='Use https for the magic link URLs',
+        )
+        parser.add_argument(
+            '--redirect-url', default='',
+            help='Where to send the user after logging in',
+        )
+
+    def handle(self, *args, **options):
+        # Invites are not requested from the recipient's browser or IP
+        # address so the links could never be used
+        if settings.REQUIRE_SAME_IP or settings.REQUIRE_SAME_BROWSER:
+            raise CommandError(
+                'Invite magic links can only be used when '
+                'MAGICLINK_REQUIRE_SAME_IP and MAGICLINK_REQUIRE_SAME_BROWSER '
+                'are both False'
+            )
+
+        request = InviteRequest(options['domain'], options['https'])
+
+        batch_size = max(1, options['batch_size'])
+        start = time.monotonic()
+        read = created = sent = 0
+
+        connection = get_mail_connection()
+        connection.open()
+        try:
+            emails_in_file = self.read_emails(options['path'])
+            for emails in chunked(emails_in_file, batch_size):
+                read += len(emails)
+                magic_links = create_magiclinks(
+                    emails,
+                    request,
+                    redirect_url=options['redirect_url'],
+                    batch_size=batch_size,
+                )
+                created += len(magic_links)
+                sent += send_magiclinks(
+                    magic_links,
+                    request,
+                    batch_size=batch_size,
+                    connection=connection,
+                    domain=options['domain'],
+                )
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'Sent {sent} of {read} emails read')
+        finally:
+            connection.close()
+
+        elapsed = time.monotonic() - start
+        rate = sent / max(elapsed, 1e-6)
+        self.stdout.write(
+            f'Read {read} emails, created {created} magic links and sent '
+            f'{sent} emails in {elapsed:.2f}s ({rate:.0f} emails/s)'
+        )
+        if created > sent:
+            self.stdout.write(
+                f'Skipped {created - sent} magic links whose user no longer '
+                'exists'
+            )
+
+    def read_emails(self, path: str) -> Iterator[str]:
+        if path == '-':
+            yield from self.parse(sys.stdin)
+            return
+        with open(path, encoding='utf-8') as stream:
+            yield from self.parse(stream)
+
+    def parse(self, stream: IO[str]) -> Iterator[str]:
+        for line in stream:
+            email = line.strip()
+            if email and not email.startswith('#'):
+                yield email
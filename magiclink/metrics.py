@@ -0,0 +1,245 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache, wraps
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, cast
+
+from django.http import Http404, HttpRequest, HttpResponse
+from django.utils.module_loading import import_string
+
+from . import settings
+
+Labels = Tuple[Tuple[str, str], ...]
+F = TypeVar('F', bound=Callable[..., object])
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+
+
+class MetricsSink():
+    """
+    Base class for recording magic link metrics. Counters are incremented
+    with `increment` and latencies (in seconds) are recorded with `observe`
+    """
+
+    def increment(
+        self,
+        name: str,
+        labels: Dict[str, str],
+        value: int = 1,
+    ) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Dict[str, str],
+    ) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+
+class Histogram():
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[int]:
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class InMemoryMetrics(MetricsSink):
+    """
+    Keeps counters and latency histograms in the process. Useful in tests
+    and as the base for exporters
+    """
+
+    buckets = DEFAULT_BUCKETS
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters: Dict[Tuple[str, Labels], int] = {}
+            self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def increment(
+        self,
+        name: str,
+        labels: Dict[str, str],
+        value: int = 1,
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Dict[str, str],
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def counter(self, name: str, **labels: str) -> int:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+
+class PrometheusMetrics(InMemoryMetrics):
+    """
+    In memory metrics which can be rendered in the Prometheus text format.
+    Expose them with `magiclink.metrics.prometheus_view`. Each process keeps
+    its own metrics
+    """
+
+    namespace = 'magiclink'
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        previous = ''
+        for (name, labels), value in counters:
+            metric = f'{self.namespace}_{name}_total'
+            if metric != previous:
+                lines.append(f'# TYPE {metric} counter')
+                previous = metric
+            lines.append(f'{metric}{format_labels(labels)} {value}')
+
+        for (name, labels), histogram in histograms:
+            metric = f'{self.namespace}_{name}'
+            if metric != previous:
+                lines.append(f'# TYPE {metric} histogram')
+                previous = metric
+            bounds = [repr(bucket) for bucket in histogram.buckets] + ['+Inf']
+            counts = histogram.cumulative_counts() + [histogram.count]
+            for bound, count in zip(bounds, counts):
+                bucket_labels = format_labels(labels + (('le', bound),))
+                lines.append(f'{metric}_bucket{bucket_labels} {count}')
+            lines.append(
+                f'{metric}_sum{format_labels(labels)} {histogram.sum!r}')
+            lines.append(
+                f'{metric}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    values = ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in labels
+    )
+    return f'{{{values}}}'
+
+
+def escape_label(value: str) -> str:
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+@lru_cache(maxsize=None)
+def load_metrics(path: str) -> MetricsSink:
+    return import_string(path)()
+
+
+def get_metrics() -> Optional[MetricsSink]:
+    if not settings.METRICS:
+        return None
+    return load_metrics(settings.METRICS)
+
+
+def increment(name: str, value: int = 1, **labels: str) -> None:
+    sink = get_metrics()
+    if sink is not None:
+        sink.increment(name, labels, value)
+
+
+def error_reason(error: Exception) -> str:
+    return getattr(error, 'reason', '') or type(error).__name__
+
+
+def measure(histogram: str, failures: str = '') -> Callable[[F], F]:
+    """
+    Decorator recording how long each call takes. When `failures` is set,
+    calls which raise are also counted, labelled with the error reason.
+    Works with sync and async functions
+    """
+    def decorator(func: F) -> F:
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                sink = get_metrics()
+                if sink is None:
+                    return await func(*args, **kwargs)
+
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as error:
+                    if failures:
+                        sink.increment(failures, {
+                            'reason': error_reason(error),
+                        })
+                    raise
+                finally:
+                    sink.observe(histogram, time.perf_counter() - start, {})
+            return cast(F, async_wrapper)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = get_metrics()
+            if sink is None:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                if failures:
+                    sink.increment(failures, {'reason': error_reason(error)})
+                raise
+            finally:
+                sink.observe(histogram, time.perf_counter() - start, {})
+        return cast(F, wrapper)
+    return decorator
+
+
+def prometheus_view(request: HttpRequest) -> HttpResponse:
+    sink = get_metrics()
+    if not isinstance(sink, PrometheusMetrics):
+        raise Http404()
+    return HttpResponse(
+        sink.render(), content_type='text/plain; version=0.0.4',
+    )
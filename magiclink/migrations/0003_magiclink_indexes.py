@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0002_magiclinkunsubscribe'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='magiclink',
+            name='token',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='magiclink',
+            index=models.Index(fields=['email', 'created'], name='magiclink_m_email_83e032_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='magiclink',
+            index=models.Index(fields=['expiry'], name='magiclink_m_expiry_b2f500_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0003_magiclink_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='magiclink',
+            name='verifier_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
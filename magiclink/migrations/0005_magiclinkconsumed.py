@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0004_magiclink_verifier_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MagicLinkConsumed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_id', models.CharField(max_length=16, unique=True)),
+                ('times_used', models.IntegerField(default=1)),
+                ('expiry', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:49
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_unsubscribes(apps, schema_editor):
+    MagicLinkUnsubscribe = apps.get_model('magiclink', 'MagicLinkUnsubscribe')
+    duplicates = (
+        MagicLinkUnsubscribe.objects.values('email')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        MagicLinkUnsubscribe.objects.filter(
+            email=duplicate['email'],
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0005_magiclinkconsumed'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_unsubscribes, migrations.RunPython.noop,
+        ),
+        migrations.AlterField(
+            model_name='magiclinkunsubscribe',
+            name='email',
+            field=models.EmailField(max_length=254, unique=True),
+        ),
+    ]
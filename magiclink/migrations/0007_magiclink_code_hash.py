@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0006_magiclinkunsubscribe_email_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='magiclink',
+            name='code_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='magiclink',
+            index=models.Index(fields=['email', 'code_hash'], name='magiclink_m_email_bc7440_idx'),
+        ),
+    ]
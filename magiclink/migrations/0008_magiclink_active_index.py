@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magiclink', '0007_magiclink_code_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='magiclink',
+            index=models.Index(condition=models.Q(('disabled', False)), fields=['email', 'expiry'], name='magiclink_active_idx'),
+        ),
+    ]
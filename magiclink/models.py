@@ -1,29 +1,179 @@
+import time
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from typing import Dict, Iterable, Optional, Tuple
 from urllib.parse import urlencode, urljoin
 
+from asgiref.sync import sync_to_async
 from django.conf import settings as djsettings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
-from django.contrib.sites.shortcuts import get_current_site
+from django.core import signing
 from django.core.mail import send_mail
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Q, When
 from django.http import HttpRequest
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
-from . import settings
+from . import metrics, settings
+from .signals import (
+    asend_signal, magiclink_consumed, magiclink_failed, magiclink_sent,
+    magiclink_validated, send_signal
+)
+from .tokens import (
+    generate_token_id, hash_code, hash_verifier, is_signed_token, join_token,
+    sign_token, split_token, unsign_token
+)
+from .unsubscribe import VersionedBloomFilter
+from .users import aget_user, get_user
 from .utils import get_client_ip
 
-User = get_user_model()
-
 
 class MagicLinkError(Exception):
-    pass
+    """
+    Raised when a magic link can not be created, sent or used. `reason` is a
+    short machine readable code (e.g. 'expired') used for metrics
+    """
+
+    def __init__(self, message: str = '', reason: str = '') -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+class MagicLinkQuerySet(models.QuerySet['MagicLink']):
+    """
+    Filters which line up with the indexes. Most of the table is disabled or
+    expired links, so queries for usable links filter on `disabled=False`
+    to use the partial index which only covers those rows
+    """
+
+    def active(self) -> 'MagicLinkQuerySet':
+        return self.filter(disabled=False, expiry__gt=timezone.now())
+
+    def expired(
+        self,
+        before: Optional[datetime] = None,
+    ) -> 'MagicLinkQuerySet':
+        return self.filter(expiry__lte=before or timezone.now())
+
+    def for_email(self, email: str) -> 'MagicLinkQuerySet':
+        return self.filter(email=email)
+
+    def disable_all(self) -> int:
+        return self.filter(disabled=False).update(disabled=True)
+
+    async def adisable_all(self) -> int:
+        return await self.filter(disabled=False).aupdate(disabled=True)
+
+
+_MagicLinkManagerBase = models.Manager.from_queryset(MagicLinkQuerySet)
+
+
+class MagicLinkManager(_MagicLinkManagerBase['MagicLink']):
+
+    def get_by_token(self, token: str) -> 'MagicLink':
+        if not token:
+            raise self.model.DoesNotExist('No token supplied')
+
+        if is_signed_token(token):
+            return self.get_by_signed_token(token)
+
+        selector, verifier = split_token(token)
+        if not verifier:
+            # Plain text token created before the selector / verifier split
+            if not settings.ALLOW_LEGACY_TOKENS:
+                raise self.model.DoesNotExist('Legacy tokens are disabled')
+            return self.get(token=token, verifier_hash='')
+
+        magiclink = self.get(token=selector)
+        self._check_verifier(magiclink, verifier)
+        return magiclink
+
+    async def aget_by_token(self, token: str) -> 'MagicLink':
+        if not token:
+            raise self.model.DoesNotExist('No token supplied')
+
+        if is_signed_token(token):
+            return self.get_by_signed_token(token)
+
+        selector, verifier = split_token(token)
+        if not verifier:
+            if not settings.ALLOW_LEGACY_TOKENS:
+                raise self.model.DoesNotExist('Legacy tokens are disabled')
+            return await self.aget(token=token, verifier_hash='')
+
+        magiclink = await self.aget(token=selector)
+        self._check_verifier(magiclink, verifier)
+        return magiclink
+
+    def _check_verifier(self, magiclink: 'MagicLink', verifier: str) -> None:
+        verifier_hash = hash_verifier(verifier)
+        if not constant_time_compare(verifier_hash, magiclink.verifier_hash):
+            raise self.model.DoesNotExist('Token verifier does not match')
+
+    def get_by_code(self, email: str, code: str) -> 'MagicLink':
+        """
+        Returns the newest magic link for the (already normalised) email with
+        the login code in a single lookup on the (email, code_hash) index
+        """
+        magiclink = self.filter(
+            email=email, code_hash=hash_code(email, code),
+        ).order_by('-created').first()
+        if magiclink is None:
+            raise self.model.DoesNotExist('No magic link with that code')
+        return magiclink
+
+    def build_stateless(self, **fields: object) -> 'MagicLink':
+        """
+        Returns an unsaved MagicLink with a signed token which carries all of
+        the details needed to validate it
+        """
+        magiclink = self.model(created=timezone.now(), **fields)
+        magiclink.token_id = generate_token_id()
+        magiclink.token = sign_token({
+            'id': magiclink.token_id,
+            'e': magiclink.email,
+            'x': int(magiclink.expiry.timestamp()),
+            'r': magiclink.redirect_url,
+            'c': magiclink.cookie_value,
+            'i': magiclink.ip_address,
+        })
+        return magiclink
+
+    def get_by_signed_token(self, token: str) -> 'MagicLink':
+        if not settings.STATELESS:
+            raise self.model.DoesNotExist('Stateless tokens are disabled')
+
+        try:
+            payload = unsign_token(token)
+        except signing.BadSignature:
+            raise self.model.DoesNotExist('Token signature is not valid')
+
+        timestamp = int(payload['x'] or 0)
+        expiry = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        if not djsettings.USE_TZ:
+            expiry = timezone.make_naive(expiry)
+        magiclink = self.model(
+            email=str(payload['e']),
+            token=token,
+            expiry=expiry,
+            redirect_url=str(payload['r']),
+            cookie_value=str(payload['c']),
+            ip_address=payload['i'],
+        )
+        magiclink.token_id = str(payload['id'])
+        return magiclink
 
 
 class MagicLink(models.Model):
     email = models.EmailField()
-    token = models.TextField()
+    # For links created with a selector / verifier token the token field
+    # holds the selector. Older links hold the full plain text token
+    token = models.CharField(max_length=255, unique=True)
+    verifier_hash = models.CharField(max_length=64, blank=True)
+    code_hash = models.CharField(max_length=64, blank=True)
     expiry = models.DateTimeField()
     redirect_url = models.TextField()
     disabled = models.BooleanField(default=False)
@@ -32,65 +182,254 @@ class MagicLink(models.Model):
     ip_address = models.GenericIPAddressField(null=True)
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = MagicLinkManager()
+
+    # The raw verifier is never stored. It is only available on the instance
+    # returned by create_magiclink so the link can be generated and sent
+    verifier = ''
+    # Like the verifier, the login code is only available when it's created
+    code = ''
+    # Set for stateless magic links which are never saved to the database
+    token_id = ''
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['email', 'created']),
+            # Only the links which can still be used (see MagicLinkQuerySet)
+            models.Index(
+                fields=['email', 'expiry'],
+                condition=Q(disabled=False),
+                name='magiclink_active_idx',
+            ),
+            models.Index(fields=['expiry']),
+            models.Index(fields=['email', 'code_hash']),
+        ]
+
     def __str__(self):
         return f'{self.email} - {self.expiry}'
 
-    def used(self) -> None:
+    @property
+    def url_token(self) -> str:
+        if not self.verifier_hash:
+            return self.token
+        if not self.verifier:
+            raise MagicLinkError(
+                'The magic link token is only available when it is created',
+                reason='token_unavailable',
+            )
+        return join_token(self.token, self.verifier)
+
+    @property
+    def cookie_name(self) -> str:
+        # Magic links kept in the cache have no primary key
+        return f'magiclink{self.token_id or self.pk or self.token}'
+
+    def used(self, request: Optional[HttpRequest] = None) -> None:
+        from .storage import get_storage
+
+        start = time.perf_counter()
+        try:
+            if self.token_id:
+                self._consume_stateless()
+            else:
+                self._mark_used(get_storage().use(self))
+        except MagicLinkError as error:
+            send_signal(
+                magiclink_failed, self, request, start,
+                error=error, stage='used',
+            )
+            raise
+        send_signal(magiclink_consumed, self, request, start)
+
+    async def aused(self, request: Optional[HttpRequest] = None) -> None:
+        from .storage import get_storage
+
+        start = time.perf_counter()
+        try:
+            if self.token_id:
+                await sync_to_async(self._consume_stateless)()
+            else:
+                self._mark_used(await get_storage().ause(self))
+        except MagicLinkError as error:
+            await asend_signal(
+                magiclink_failed, self, request, start,
+                error=error, stage='used',
+            )
+            raise
+        await asend_signal(magiclink_consumed, self, request, start)
+
+    def usable_queryset(self) -> MagicLinkQuerySet:
+        return MagicLink.objects.active().filter(
+            pk=self.pk, times_used__lt=settings.TOKEN_USES,
+        )
+
+    def use_fields(self) -> Dict[str, object]:
+        return {
+            'times_used': F('times_used') + 1,
+            'disabled': Case(
+                When(times_used__gte=settings.TOKEN_USES - 1, then=True),
+                default=False,
+            ),
+        }
+
+    def _mark_used(self, consumed: int) -> None:
+        if not consumed:
+            raise MagicLinkError(
+                'Magic link has been used too many times', reason='used',
+            )
         self.times_used += 1
         if self.times_used >= settings.TOKEN_USES:
             self.disabled = True
-        self.save()
 
     def disable(self) -> None:
+        from .storage import get_storage
+
+        self.times_used += 1
+        self.disabled = True
+        if self.token_id:
+            MagicLinkConsumed.objects.update_or_create(
+                token_id=self.token_id, defaults=self._consumed_fields(),
+            )
+            return
+        get_storage().disable(self)
+
+    async def adisable(self) -> None:
+        from .storage import get_storage
+
         self.times_used += 1
         self.disabled = True
-        self.save()
+        if self.token_id:
+            await MagicLinkConsumed.objects.aupdate_or_create(
+                token_id=self.token_id, defaults=self._consumed_fields(),
+            )
+            return
+        await get_storage().adisable(self)
+
+    def _consumed_fields(self) -> Dict[str, object]:
+        return {'times_used': settings.TOKEN_USES, 'expiry': self.expiry}
 
-    def generate_url(self, request: HttpRequest) -> str:
+    def _consume_stateless(self) -> None:
+        # The first use is a single insert. Only a reused token needs the
+        # conditional update
+        try:
+            with transaction.atomic():
+                MagicLinkConsumed.objects.create(
+                    token_id=self.token_id, expiry=self.expiry,
+                )
+        except IntegrityError:
+            consumed = MagicLinkConsumed.objects.filter(
+                token_id=self.token_id,
+                times_used__lt=settings.TOKEN_USES,
+            ).update(times_used=F('times_used') + 1)
+            if not consumed:
+                raise MagicLinkError(
+                    'Magic link has been used too many times', reason='used',
+                )
+        self.times_used += 1
+
+    def generate_url(self, request: HttpRequest, domain: str = '') -> str:
+        """
+        The domain defaults to the current site (or the request's host when
+        django.contrib.sites is not installed)
+        """
         url_path = reverse(settings.LOGIN_VERIFY_URL)
 
-        params = {'token': self.token}
+        params = {'token': self.url_token}
         if settings.VERIFY_INCLUDE_EMAIL:
             params['email'] = self.email
         query = urlencode(params)
 
         url_path = f'{url_path}?{query}'
-        domain = get_current_site(request).domain
+        if not domain:
+            from django.contrib.sites.shortcuts import get_current_site
+            domain = get_current_site(request).domain
         scheme = request.is_secure() and 'https' or 'http'
         url = urljoin(f'{scheme}://{domain}', url_path)
         return url
 
-    def send(self, request: HttpRequest) -> None:
-        user = User.objects.get(email=self.email)
-
-        if not settings.IGNORE_UNSUBSCRIBE_IF_USER:
-            try:
-                MagicLinkUnsubscribe.objects.get(email=self.email)
-                raise MagicLinkError(
-                    'Email address is on the unsubscribe list')
-            except MagicLinkUnsubscribe.DoesNotExist:
-                pass
+    def render_email(
+        self,
+        request: HttpRequest,
+        user: AbstractUser,
+        domain: str = '',
+    ) -> Tuple[str, str]:
+        from .emails import get_email_renderer
 
         context = {
-            'subject': settings.EMAIL_SUBJECT,
             'user': user,
-            'magiclink': self.generate_url(request),
+            'magiclink': self.generate_url(request, domain),
             'expiry': self.expiry,
             'ip_address': self.ip_address,
             'created': self.created,
-            'require_same_ip': settings.REQUIRE_SAME_IP,
-            'require_same_browser': settings.REQUIRE_SAME_BROWSER,
-            'token_uses': settings.TOKEN_USES,
-            'style': settings.EMAIL_STYLES,
         }
-        plain = render_to_string(settings.EMAIL_TEMPLATE_NAME_TEXT, context)
-        html = render_to_string(settings.EMAIL_TEMPLATE_NAME_HTML, context)
+        if self.code:
+            context['code'] = self.code
+        return get_email_renderer().render(context)
+
+    @metrics.measure('send_seconds', failures='send_failures')
+    def send(self, request: HttpRequest) -> None:
+        start = time.perf_counter()
+        user = get_user(self.email, request)
+        if user is None:
+            raise get_user_model().DoesNotExist(
+                f'No user with the email {self.email}'
+            )
+
+        if not settings.IGNORE_UNSUBSCRIBE_IF_USER:
+            if MagicLinkUnsubscribe.objects.is_unsubscribed(self.email):
+                error = MagicLinkError(
+                    'Email address is on the unsubscribe list',
+                    reason='unsubscribed',
+                )
+                send_signal(
+                    magiclink_failed, self, request, start,
+                    error=error, stage='send',
+                )
+                raise error
+
+        self._deliver(request, user)
+        send_signal(magiclink_sent, self, request, start)
+
+    @metrics.measure('send_seconds', failures='send_failures')
+    async def asend(self, request: HttpRequest) -> None:
+        start = time.perf_counter()
+        user = await aget_user(self.email, request)
+        if user is None:
+            raise get_user_model().DoesNotExist(
+                f'No user with the email {self.email}'
+            )
+
+        if not settings.IGNORE_UNSUBSCRIBE_IF_USER:
+            unsubscribes = MagicLinkUnsubscribe.objects
+            if await unsubscribes.ais_unsubscribed(self.email):
+                error = MagicLinkError(
+                    'Email address is on the unsubscribe list',
+                    reason='unsubscribed',
+                )
+                await asend_signal(
+                    magiclink_failed, self, request, start,
+                    error=error, stage='send',
+                )
+                raise error
+
+        # Email backends are blocking so send from a worker thread
+        await sync_to_async(self._deliver, thread_sensitive=False)(
+            request, user,
+        )
+        await asend_signal(magiclink_sent, self, request, start)
+
+    def _deliver(self, request: HttpRequest, user: AbstractUser) -> None:
+        # The pooled SMTP backend imports smtplib, only load it to send
+        from .mail import get_mail_connection
+
+        plain, html = self.render_email(request, user)
         send_mail(
             subject=settings.EMAIL_SUBJECT,
             message=plain,
             recipient_list=[user.email],
             from_email=djsettings.DEFAULT_FROM_EMAIL,
             html_message=html,
+            connection=get_mail_connection(),
         )
 
     def validate(
@@ -98,50 +437,161 @@ class MagicLink(models.Model):
         request: HttpRequest,
         email: str = '',
     ) -> AbstractUser:
+        start = time.perf_counter()
+        try:
+            self._check_email(email)
+            error = self._request_error(request)
+            if not error:
+                user = self._require_user(get_user(self.email, request))
+                error = self._user_error(user)
+            if error:
+                self.disable()
+                raise error
+        except MagicLinkError as error:
+            send_signal(
+                magiclink_failed, self, request, start,
+                error=error, stage='validate',
+            )
+            raise
+        send_signal(magiclink_validated, self, request, start, user=user)
+        return user
+
+    async def avalidate(
+        self,
+        request: HttpRequest,
+        email: str = '',
+    ) -> AbstractUser:
+        start = time.perf_counter()
+        try:
+            self._check_email(email)
+            error = self._request_error(request)
+            if not error:
+                user = self._require_user(await aget_user(self.email, request))
+                error = self._user_error(user)
+            if error:
+                await self.adisable()
+                raise error
+        except MagicLinkError as error:
+            await asend_signal(
+                magiclink_failed, self, request, start,
+                error=error, stage='validate',
+            )
+            raise
+        await asend_signal(
+            magiclink_validated, self, request, start, user=user,
+        )
+        return user
+
+    def _check_email(self, email: str) -> None:
         if settings.EMAIL_IGNORE_CASE and email:
             email = email.lower()
 
         if settings.VERIFY_INCLUDE_EMAIL and self.email != email:
-            raise MagicLinkError('Email address does not match')
+            raise MagicLinkError(
+                'Email address does not match', reason='email_mismatch',
+            )
 
+    def _request_error(self, request: HttpRequest) -> Optional[MagicLinkError]:
+        """
+        Returns why the request can not use the magic link, or None if it
+        can. The magic link is disabled by the caller
+        """
         if timezone.now() > self.expiry:
-            self.disable()
-            raise MagicLinkError('Magic link has expired')
+            return MagicLinkError('Magic link has expired', reason='expired')
 
         if settings.REQUIRE_SAME_IP:
             client_ip = get_client_ip(request)
             if client_ip and settings.ANONYMIZE_IP:
                 client_ip = client_ip[:client_ip.rfind('.')+1] + '0'
             if self.ip_address != client_ip:
-                self.disable()
-                raise MagicLinkError('IP address is different from the IP '
-                                     'address used to request the magic link')
+                return MagicLinkError(
+                    'IP address is different from the IP address used to '
+                    'request the magic link',
+                    reason='ip_address',
+                )
 
         if settings.REQUIRE_SAME_BROWSER:
-            cookie_name = f'magiclink{self.pk}'
-            if self.cookie_value != request.COOKIES.get(cookie_name):
-                self.disable()
-                raise MagicLinkError('Browser is different from the browser '
-                                     'used to request the magic link')
+            if self.cookie_value != request.COOKIES.get(self.cookie_name):
+                return MagicLinkError(
+                    'Browser is different from the browser used to request '
+                    'the magic link',
+                    reason='browser',
+                )
 
         if self.times_used >= settings.TOKEN_USES:
-            self.disable()
-            raise MagicLinkError('Magic link has been used too many times')
+            return MagicLinkError(
+                'Magic link has been used too many times', reason='used',
+            )
+        return None
+
+    def _require_user(self, user: Optional[AbstractUser]) -> AbstractUser:
+        if user is None:
+            raise get_user_model().DoesNotExist(
+                f'No user with the email {self.email}'
+            )
+        return user
 
-        user = User.objects.get(email=self.email)
+    def _user_error(self, user: AbstractUser) -> Optional[MagicLinkError]:
+        is_active = getattr(user, 'is_active', True)
+        if not settings.IGNORE_IS_ACTIVE_FLAG and not is_active:
+            return MagicLinkError(
+                'This user has been deactivated', reason='inactive',
+            )
 
         if not settings.ALLOW_SUPERUSER_LOGIN and user.is_superuser:
-            self.disable()
-            raise MagicLinkError(
-                'You can not login to a super user account using a magic link')
+            return MagicLinkError(
+                'You can not login to a super user account using a magic '
+                'link',
+                reason='superuser',
+            )
 
         if not settings.ALLOW_STAFF_LOGIN and user.is_staff:
-            self.disable()
-            raise MagicLinkError(
-                'You can not login to a staff account using a magic link')
+            return MagicLinkError(
+                'You can not login to a staff account using a magic link',
+                reason='staff',
+            )
+        return None
 
-        return user
+
+def load_unsubscribed_emails() -> Tuple[int, Iterable[str]]:
+    emails = MagicLinkUnsubscribe.objects.values_list('email', flat=True)
+    return emails.count(), emails.iterator(chunk_size=2000)
+
+
+unsubscribe_filter = VersionedBloomFilter(
+    'magiclink:unsubscribe:version', load_unsubscribed_emails,
+)
+
+
+class MagicLinkUnsubscribeManager(models.Manager['MagicLinkUnsubscribe']):
+
+    def is_unsubscribed(self, email: str) -> bool:
+        # Most addresses are not unsubscribed. With the filter enabled they
+        # are answered without a query
+        if settings.UNSUBSCRIBE_FILTER and email not in unsubscribe_filter:
+            return False
+        return self.filter(email=email).exists()
+
+    async def ais_unsubscribed(self, email: str) -> bool:
+        if settings.UNSUBSCRIBE_FILTER:
+            # Rebuilding the filter queries the database
+            email_filter = await sync_to_async(unsubscribe_filter.get_filter)()
+            if email not in email_filter:
+                return False
+        return await self.filter(email=email).aexists()
 
 
 class MagicLinkUnsubscribe(models.Model):
-    email = models.EmailField()
+    email = models.EmailField(unique=True)
+
+    objects = MagicLinkUnsubscribeManager()
+
+
+class MagicLinkConsumed(models.Model):
+    """
+    Records the use of a stateless magic link. Rows can be deleted once the
+    magic link has expired
+    """
+    token_id = models.CharField(max_length=16, unique=True)
+    times_used = models.IntegerField(default=1)
+    expiry = models.DateTimeField(db_index=True)
@@ -0,0 +1,181 @@
+import hashlib
+import time
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from . import settings
+from .utils import get_client_ip
+
+# Each window is split into this many buckets. A request is forgotten at
+# most window / WINDOW_BUCKETS seconds early
+WINDOW_BUCKETS = 10
+
+
+class RateLimiter():
+    """
+    Base class for limiting how often magic links can be requested.
+    `allow` is called before anything is read from or written to the database
+    """
+
+    def allow(self, email: str, request: HttpRequest) -> bool:
+        raise NotImplementedError  # pragma: no cover
+
+    async def aallow(self, email: str, request: HttpRequest) -> bool:
+        return await sync_to_async(self.allow)(email, request)
+
+
+class CacheRateLimiter(RateLimiter):
+    """
+    Sliding window rate limiter stored in the Django cache. Requests are
+    limited per email address, per client IP address and across all
+    requests. Counters are updated with the cache's atomic `incr` so the
+    cache must be shared between processes (e.g. Redis or Memcached)
+    """
+
+    key_prefix = 'magiclink:ratelimit'
+
+    def allow(self, email: str, request: HttpRequest) -> bool:
+        limits = [
+            ('email', email, settings.RATE_LIMIT_EMAIL,
+             settings.LOGIN_REQUEST_TIME_LIMIT),
+            ('ip', get_client_ip(request) or '', settings.RATE_LIMIT_IP,
+             settings.RATE_LIMIT_WINDOW),
+            ('global', '', settings.RATE_LIMIT_GLOBAL,
+             settings.RATE_LIMIT_WINDOW),
+        ]
+
+        counted: List[str] = []
+        now = time.time()
+        for scope, value, limit, window in limits:
+            if limit <= 0 or window <= 0:
+                continue
+            key, keys = self.bucket_keys(scope, value, window, now)
+            counted.append(key)
+            total = self.incr(key, window)
+            cached = self.cache.get_many([k for k in keys if k != key])
+            total += sum(cached.values())
+            if total > limit:
+                # Rejected requests do not count towards any limit
+                for key in counted:
+                    self.decr(key)
+                return False
+        return True
+
+    @property
+    def cache(self):
+        return caches[settings.RATE_LIMIT_CACHE]
+
+    def bucket_keys(
+        self,
+        scope: str,
+        value: str,
+        window: int,
+        now: float,
+    ) -> Tuple[str, List[str]]:
+        """
+        Returns the key for the current bucket and the keys of every bucket
+        in the window ending now
+        """
+        digest = hashlib.sha256(value.encode()).hexdigest()[:32]
+        size = window / WINDOW_BUCKETS
+        current = int(now // size)
+        keys = [
+            f'{self.key_prefix}:{scope}:{digest}:{window}:{bucket}'
+            for bucket in range(current - WINDOW_BUCKETS + 1, current + 1)
+        ]
+        return keys[-1], keys
+
+    def incr(self, key: str, window: int) -> int:
+        self.cache.add(key, 0, timeout=window + 1)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # The key expired between add and incr
+            self.cache.add(key, 1, timeout=window + 1)
+            return 1
+
+    def decr(self, key: str) -> None:
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            pass
+
+
+class LoginCodeAttempts():
+    """
+    Counts login code attempts per email address in the rate limit cache.
+    Each attempt is counted with the cache's atomic `incr` before the code is
+    checked, so concurrent guesses can not get past the limit, and a correct
+    code resets the count. Once MAGICLINK_LOGIN_CODE_ATTEMPTS incorrect codes
+    have been tried no code is accepted for the email until AUTH_TIMEOUT
+    seconds after the first attempt
+    """
+
+    key_prefix = 'magiclink:codeattempts'
+
+    @property
+    def cache(self):
+        return caches[settings.RATE_LIMIT_CACHE]
+
+    def key(self, email: str) -> str:
+        digest = hashlib.sha256(email.encode()).hexdigest()[:32]
+        return f'{self.key_prefix}:{digest}'
+
+    def attempt(self, email: str) -> bool:
+        """
+        Counts an attempt and returns whether it is within the limit
+        """
+        key = self.key(email)
+        self.cache.add(key, 0, timeout=settings.AUTH_TIMEOUT)
+        try:
+            attempts = self.cache.incr(key)
+        except ValueError:
+            # The key expired between add and incr
+            self.cache.add(key, 1, timeout=settings.AUTH_TIMEOUT)
+            attempts = 1
+        return attempts <= settings.LOGIN_CODE_ATTEMPTS
+
+    def reset(self, email: str) -> None:
+        self.cache.delete(self.key(email))
+
+
+login_code_attempts = LoginCodeAttempts()
+
+
+@lru_cache(maxsize=None)
+def load_rate_limiter(path: str) -> RateLimiter:
+    return import_string(path)()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    if not settings.RATE_LIMITER:
+        return None
+    return load_rate_limiter(settings.RATE_LIMITER)
+
+
+def check_rate_limit_cache(**kwargs) -> List[checks.CheckMessage]:
+    """
+    System check warning when the rate limits are kept in a cache which is
+    not shared between processes, so each worker has its own limits
+    """
+    limiter = get_rate_limiter()
+    if not isinstance(limiter, CacheRateLimiter):
+        return []
+    if not isinstance(limiter.cache, (LocMemCache, DummyCache)):
+        return []
+    return [checks.Warning(
+        f'The "{settings.RATE_LIMIT_CACHE}" cache used for rate limiting is '
+        'not shared between processes, so each process applies its own '
+        'limits to login requests and login codes',
+        hint='Set MAGICLINK_RATE_LIMIT_CACHE to a cache such as Redis or '
+             'Memcached',
+        id='magiclink.W001',
+    )]
@@ -1,122 +1,232 @@
 # flake8: noqa: E501
+"""
+The MAGICLINK_ settings. Each one is read from the Django settings and
+validated the first time it's used, then cached as a module attribute until
+a setting is changed (e.g. by override_settings), so importing magiclink
+doesn't read any settings.
+"""
 import warnings
+from typing import Any, Callable, Dict, List, Tuple
 
 from django.conf import settings
+from django.core import checks
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
-LOGIN_SENT_REDIRECT = getattr(settings, 'MAGICLINK_LOGIN_SENT_REDIRECT', 'magiclink:login_sent')
-
-LOGIN_TEMPLATE_NAME = getattr(settings, 'MAGICLINK_LOGIN_TEMPLATE_NAME', 'magiclink/login.html')
-LOGIN_SENT_TEMPLATE_NAME = getattr(settings, 'MAGICLINK_LOGIN_SENT_TEMPLATE_NAME', 'magiclink/login_sent.html')
-LOGIN_FAILED_TEMPLATE_NAME = getattr(settings, 'MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME', 'magiclink/login_failed.html')
-# If LOGIN_FAILED_REDIRECT has a value the user will be redirected to this
-# URL instead of being shown the LOGIN_FAILED_TEMPLATE
-LOGIN_FAILED_REDIRECT = getattr(settings, 'MAGICLINK_LOGIN_FAILED_REDIRECT', '')
-
-# If this setting is set to False a user account will be created the first time
-# a user requests a login link.
-REQUIRE_SIGNUP = getattr(settings, 'MAGICLINK_REQUIRE_SIGNUP', True)
-if not isinstance(REQUIRE_SIGNUP, bool):
-    raise ImproperlyConfigured('"MAGICLINK_REQUIRE_SIGNUP" must be a boolean')
-SIGNUP_LOGIN_REDIRECT = getattr(settings, 'MAGICLINK_SIGNUP_LOGIN_REDIRECT', '')
-
-SIGNUP_TEMPLATE_NAME = getattr(settings, 'MAGICLINK_SIGNUP_TEMPLATE_NAME', 'magiclink/signup.html')
-
-try:
-    TOKEN_LENGTH = int(getattr(settings, 'MAGICLINK_TOKEN_LENGTH', 50))
-except ValueError:
-    raise ImproperlyConfigured('"MAGICLINK_TOKEN_LENGTH" must be an integer')
-else:
-    if TOKEN_LENGTH < 20:
-        warning = ('Shorter MAGICLINK_TOKEN_LENGTH values make your login more'
-                   'sussptable to brute force attacks')
-        warnings.warn(warning, RuntimeWarning)
 
-try:
-    # In seconds
-    AUTH_TIMEOUT = int(getattr(settings, 'MAGICLINK_AUTH_TIMEOUT', 300))
-except ValueError:
-    raise ImproperlyConfigured('"MAGICLINK_AUTH_TIMEOUT" must be an integer')
+def _value(name: str, value: Any) -> Any:
+    return value
 
-try:
-    TOKEN_USES = int(getattr(settings, 'MAGICLINK_TOKEN_USES', 1))
-except ValueError:
-    raise ImproperlyConfigured('"MAGICLINK_TOKEN_USES" must be an integer')
 
-EMAIL_IGNORE_CASE = getattr(settings, 'MAGICLINK_EMAIL_IGNORE_CASE', True)
-if not isinstance(EMAIL_IGNORE_CASE, bool):
-    raise ImproperlyConfigured('"MAGICLINK_EMAIL_IGNORE_CASE" must be a boolean')
+def _boolean(name: str, value: Any) -> bool:
+    if not isinstance(value, bool):
+        raise ImproperlyConfigured(f'"{name}" must be a boolean')
+    return value
 
-EMAIL_AS_USERNAME = getattr(settings, 'MAGICLINK_EMAIL_AS_USERNAME', True)
-if not isinstance(EMAIL_AS_USERNAME, bool):
-    raise ImproperlyConfigured('"MAGICLINK_EMAIL_AS_USERNAME" must be a boolean')
 
-ALLOW_SUPERUSER_LOGIN = getattr(settings, 'MAGICLINK_ALLOW_SUPERUSER_LOGIN', True)
-if not isinstance(ALLOW_SUPERUSER_LOGIN, bool):
-    raise ImproperlyConfigured('"MAGICLINK_ALLOW_SUPERUSER_LOGIN" must be a boolean')
+def _integer(name: str, value: Any) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ImproperlyConfigured(f'"{name}" must be an integer')
 
-ALLOW_STAFF_LOGIN = getattr(settings, 'MAGICLINK_ALLOW_STAFF_LOGIN', True)
-if not isinstance(ALLOW_STAFF_LOGIN, bool):
-    raise ImproperlyConfigured('"MAGICLINK_ALLOW_STAFF_LOGIN" must be a boolean')
 
-IGNORE_IS_ACTIVE_FLAG = getattr(settings, 'MAGICLINK_IGNORE_IS_ACTIVE_FLAG', False)
-if not isinstance(IGNORE_IS_ACTIVE_FLAG, bool):
-    raise ImproperlyConfigured('"MAGICLINK_IGNORE_IS_ACTIVE_FLAG" must be a boolean')
+def _float(name: str, value: Any) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        raise ImproperlyConfigured(f'"{name}" must be a float')
 
-VERIFY_INCLUDE_EMAIL = getattr(settings, 'MAGICLINK_VERIFY_INCLUDE_EMAIL', True)
-if not isinstance(VERIFY_INCLUDE_EMAIL, bool):
-    raise ImproperlyConfigured('"MAGICLINK_VERIFY_INCLUDE_EMAIL" must be a boolean')
 
-REQUIRE_SAME_BROWSER = getattr(settings, 'MAGICLINK_REQUIRE_SAME_BROWSER', True)
-if not isinstance(REQUIRE_SAME_BROWSER, bool):
-    raise ImproperlyConfigured('"MAGICLINK_REQUIRE_SAME_BROWSER" must be a boolean')
+def _token_length(name: str, value: Any) -> int:
+    value = _integer(name, value)
+    if value < 20:
+        warning = ('Shorter MAGICLINK_TOKEN_LENGTH values make your login more'
+                   'sussptable to brute force attacks')
+        warnings.warn(warning, RuntimeWarning)
+    if value > 255:
+        raise ImproperlyConfigured(f'"{name}" must be 255 or less')
+    return value
 
-REQUIRE_SAME_IP = getattr(settings, 'MAGICLINK_REQUIRE_SAME_IP', True)
-if not isinstance(REQUIRE_SAME_IP, bool):
-    raise ImproperlyConfigured('"MAGICLINK_REQUIRE_SAME_IP" must be a boolean')
 
-ANONYMIZE_IP = getattr(settings, 'MAGICLINK_ANONYMIZE_IP', True)
-if not isinstance(ANONYMIZE_IP, bool):
-    raise ImproperlyConfigured('"MAGICLINK_ANONYMIZE_IP" must be a boolean')
+def _email_styles(name: str, value: Any) -> Any:
+    if value and not isinstance(value, dict):
+        raise ImproperlyConfigured(f'"{name}" must be a dict')
+    return value
 
-ONE_TOKEN_PER_USER = getattr(settings, 'MAGICLINK_ONE_TOKEN_PER_USER', True)
-if not isinstance(ONE_TOKEN_PER_USER, bool):
-    raise ImproperlyConfigured('"MAGICLINK_ONE_TOKEN_PER_USER" must be a boolean')
 
-try:
-    LOGIN_REQUEST_TIME_LIMIT = int(getattr(settings, 'MAGICLINK_LOGIN_REQUEST_TIME_LIMIT', 30))  # In seconds
-except ValueError:
-    raise ImproperlyConfigured('"MAGICLINK_LOGIN_REQUEST_TIME_LIMIT" must be an integer')
+def _optional_float(name: str, value: Any) -> Any:
+    return value if value is None else _float(name, value)
 
 
-EMAIL_STYLES = {
+EMAIL_STYLES_DEFAULT = {
     'logo_url': '',
     'background_color': '#ffffff',
     'main_text_color': '#000000',
     'button_background_color': '#0078be',
     'button_text_color': '#ffffff',
 }
-EMAIL_STYLES = getattr(settings, 'MAGICLINK_EMAIL_STYLES', EMAIL_STYLES)
-if EMAIL_STYLES and not isinstance(EMAIL_STYLES, dict):
-    raise ImproperlyConfigured('"MAGICLINK_EMAIL_STYLES" must be a dict')
 
-EMAIL_SUBJECT = getattr(settings, 'MAGICLINK_EMAIL_SUBJECT', 'Your login magic link')
-EMAIL_TEMPLATE_NAME_TEXT = getattr(settings, 'MAGICLINK_EMAIL_TEMPLATE_NAME_TEXT', 'magiclink/login_email.txt')
-EMAIL_TEMPLATE_NAME_HTML = getattr(settings, 'MAGICLINK_EMAIL_TEMPLATE_NAME_HTML', 'magiclink/login_email.html')
+# The validator and default for each setting. The Django setting has a
+# MAGICLINK_ prefix
+SETTINGS: Dict[str, Tuple[Callable[[str, Any], Any], Any]] = {
+    'LOGIN_SENT_REDIRECT': (_value, 'magiclink:login_sent'),
+
+    'LOGIN_TEMPLATE_NAME': (_value, 'magiclink/login.html'),
+    'LOGIN_SENT_TEMPLATE_NAME': (_value, 'magiclink/login_sent.html'),
+    'LOGIN_FAILED_TEMPLATE_NAME': (_value, 'magiclink/login_failed.html'),
+    # If LOGIN_FAILED_REDIRECT has a value the user will be redirected to this
+    # URL instead of being shown the LOGIN_FAILED_TEMPLATE
+    'LOGIN_FAILED_REDIRECT': (_value, ''),
+
+    # If this setting is set to False a user account will be created the first
+    # time a user requests a login link.
+    'REQUIRE_SIGNUP': (_boolean, True),
+    'SIGNUP_LOGIN_REDIRECT': (_value, ''),
+
+    'SIGNUP_TEMPLATE_NAME': (_value, 'magiclink/signup.html'),
+
+    'TOKEN_LENGTH': (_token_length, 50),
+
+    # Accept plain text tokens issued before tokens were split into a selector
+    # and a hashed verifier. Can be turned off once all older links have expired
+    'ALLOW_LEGACY_TOKENS': (_boolean, True),
+
+    # Issue signed tokens which carry the magic link details instead of saving
+    # a MagicLink to the database. Only a small record is written when it's used
+    'STATELESS': (_boolean, False),
+
+    'AUTH_TIMEOUT': (_integer, 300),  # In seconds
+
+    # Also email a short numeric code which can be entered on the login sent
+    # page instead of following the link. Not available with STATELESS
+    'LOGIN_CODE': (_boolean, False),
+    'LOGIN_CODE_LENGTH': (_integer, 6),
+    # Incorrect codes allowed per email address every AUTH_TIMEOUT seconds
+    'LOGIN_CODE_ATTEMPTS': (_integer, 5),
+
+    'TOKEN_USES': (_integer, 1),
+
+    # Dotted path to the class which stores magic links. Use
+    # 'magiclink.storage.CacheStorage' to keep them in STORAGE_CACHE instead
+    # of the database
+    'STORAGE': (_value, 'magiclink.storage.DatabaseStorage'),
+    'STORAGE_CACHE': (_value, 'default'),
+
+    'EMAIL_IGNORE_CASE': (_boolean, True),
+    'EMAIL_AS_USERNAME': (_boolean, True),
+    'ALLOW_SUPERUSER_LOGIN': (_boolean, True),
+    'ALLOW_STAFF_LOGIN': (_boolean, True),
+    'IGNORE_IS_ACTIVE_FLAG': (_boolean, False),
+    'VERIFY_INCLUDE_EMAIL': (_boolean, True),
+    'REQUIRE_SAME_BROWSER': (_boolean, True),
+    'REQUIRE_SAME_IP': (_boolean, True),
+    'ANONYMIZE_IP': (_boolean, True),
+    'ONE_TOKEN_PER_USER': (_boolean, True),
+
+    'LOGIN_REQUEST_TIME_LIMIT': (_integer, 30),  # In seconds
+
+    # Dotted path to the class used to rate limit login requests. Set to '' to
+    # disable rate limiting. See magiclink.ratelimit.CacheRateLimiter
+    'RATE_LIMITER': (_value, 'magiclink.ratelimit.CacheRateLimiter'),
+    'RATE_LIMIT_CACHE': (_value, 'default'),
+    # Requests per email address every LOGIN_REQUEST_TIME_LIMIT seconds
+    'RATE_LIMIT_EMAIL': (_integer, 1),
+    # Requests per client IP address every RATE_LIMIT_WINDOW seconds (0 = no limit)
+    'RATE_LIMIT_IP': (_integer, 0),
+    # Requests in total every RATE_LIMIT_WINDOW seconds (0 = no limit)
+    'RATE_LIMIT_GLOBAL': (_integer, 0),
+    'RATE_LIMIT_WINDOW': (_integer, 60),  # In seconds
+
+    'EMAIL_STYLES': (_email_styles, EMAIL_STYLES_DEFAULT),
+    'EMAIL_SUBJECT': (_value, 'Your login magic link'),
+    'EMAIL_TEMPLATE_NAME_TEXT': (_value, 'magiclink/login_email.txt'),
+    'EMAIL_TEMPLATE_NAME_HTML': (_value, 'magiclink/login_email.html'),
+
+    # Dotted path to the class used to send magic link emails. Use
+    # 'magiclink.dispatch.ThreadPoolSendBackend' to send from background threads
+    'SEND_BACKEND': (_value, 'magiclink.dispatch.SyncSendBackend'),
+    'SEND_THREADS': (_integer, 4),
+    'SEND_QUEUE_SIZE': (_integer, 100),
+    # Dotted path to a callable which is passed the MagicLink and the exception
+    # raised while sending (or None if the email was sent)
+    'SEND_RESULT_HOOK': (_value, ''),
+
+    # Dotted path to the email backend used for magic link emails. Defaults to
+    # Django's EMAIL_BACKEND. See magiclink.mail.PooledSMTPEmailBackend
+    'EMAIL_BACKEND': (_value, ''),
+    'SMTP_POOL_SIZE': (_integer, 4),
+    'SMTP_MAX_AGE': (_float, 300),  # In seconds
+    'SMTP_KEEPALIVE': (_float, 30),  # In seconds
+
+    'ANTISPAM_FORMS': (_boolean, False),
+    'ANTISPAM_FIELD_TIME': (_optional_float, 1),
+
+    'LOGIN_VERIFY_URL': (_value, 'magiclink:login_verify'),
+
+    'IGNORE_UNSUBSCRIBE_IF_USER': (_boolean, False),
+
+    # Keep a Bloom filter of unsubscribed email addresses in each process so
+    # most unsubscribe checks do not query the database
+    'UNSUBSCRIBE_FILTER': (_boolean, False),
+
+    # Cache users loaded by MagicLinkBackend.get_user (0 = no caching)
+    'USER_CACHE_TIMEOUT': (_integer, 0),  # In seconds
+
+    # Dotted path to the class used to record metrics (e.g.
+    # 'magiclink.metrics.PrometheusMetrics'). Set to '' to disable metrics
+    'METRICS': (_value, ''),
+}
 
 
-ANTISPAM_FORMS = getattr(settings, 'MAGICLINK_ANTISPAM_FORMS', False)
-if not isinstance(ANTISPAM_FORMS, bool):
-    raise ImproperlyConfigured('"MAGICLINK_ANTISPAM_FORMS" must be a boolean')
-ANTISPAM_FIELD_TIME = getattr(settings, 'MAGICLINK_ANTISPAM_FIELD_TIME', 1)
-if ANTISPAM_FIELD_TIME is not None:
+def __getattr__(name: str) -> Any:
     try:
-        ANTISPAM_FIELD_TIME = float(ANTISPAM_FIELD_TIME)
-    except ValueError:
-        raise ImproperlyConfigured('"MAGICLINK_ANTISPAM_FIELD_TIME" must be a float')
+        validator, default = SETTINGS[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    setting = f'MAGICLINK_{name}'
+    value = validator(setting, getattr(settings, setting, default))
+    # Later lookups find the attribute without calling __getattr__
+    globals()[name] = value
+    return value
+
+
+def validate() -> None:
+    """
+    Read every setting so a bad value raises ImproperlyConfigured now rather
+    than when it's first used
+    """
+    for name in SETTINGS:
+        __getattr__(name)
+
+
+def check_settings(**kwargs) -> List[checks.Error]:
+    """
+    System check reporting bad settings when the project starts (e.g. by
+    runserver or manage.py check) now that they are read lazily
+    """
+    try:
+        validate()
+    except ImproperlyConfigured as error:
+        return [checks.Error(str(error), id='magiclink.E001')]
+    return []
+
+
+def clear_cache() -> None:
+    for name in SETTINGS:
+        globals().pop(name, None)
+
+
+@receiver(setting_changed)
+def reset_settings(*, setting: str, **kwargs) -> None:
+    """
+    Drop the cached values so override_settings (or assigning to
+    django.conf.settings in tests) takes effect
+    """
+    if setting.startswith('MAGICLINK_'):
+        clear_cache()
 
-LOGIN_VERIFY_URL = getattr(settings, 'MAGICLINK_LOGIN_VERIFY_URL', 'magiclink:login_verify')
 
-IGNORE_UNSUBSCRIBE_IF_USER = getattr(settings, 'MAGICLINK_IGNORE_UNSUBSCRIBE_IF_USER', False)
-if not isinstance(IGNORE_UNSUBSCRIBE_IF_USER, bool):
-    raise ImproperlyConfigured('"MAGICLINK_IGNORE_UNSUBSCRIBE_IF_USER" must be a boolean')
\ No newline at end of file
+# reload() runs the module again, dropping values cached (or assigned) before
+clear_cache()
@@ -0,0 +1,71 @@
+"""
+Signals sent during the life of a magic link. Every signal is sent with the
+MagicLink class as the sender and the keyword arguments `magiclink`,
+`request` and `elapsed` (the time the stage took in seconds).
+
+* magiclink_created - by create_magiclink once the link is saved
+* magiclink_sent - by MagicLink.send once the email is sent
+* magiclink_validated - by MagicLink.validate, also with the `user`
+* magiclink_failed - when send, validate or used raise a MagicLinkError,
+  also with the `error` and the `stage` ('send', 'validate' or 'used')
+* magiclink_consumed - by MagicLink.used once a use has been recorded
+"""
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.dispatch import Signal
+from django.http import HttpRequest
+
+magiclink_created = Signal()
+magiclink_sent = Signal()
+magiclink_validated = Signal()
+magiclink_failed = Signal()
+magiclink_consumed = Signal()
+
+
+def send_signal(
+    signal: Signal,
+    magiclink: object,
+    request: Optional[HttpRequest],
+    start: float,
+    **kwargs: object,
+) -> None:
+    """
+    Send `signal` for a stage which started at `start` (time.perf_counter).
+    Nothing is done for signals without receivers
+    """
+    if not signal.receivers:
+        return
+    _send(signal, magiclink, request, time.perf_counter() - start, **kwargs)
+
+
+async def asend_signal(
+    signal: Signal,
+    magiclink: object,
+    request: Optional[HttpRequest],
+    start: float,
+    **kwargs: object,
+) -> None:
+    if not signal.receivers:
+        return
+    # Receivers are sync and may use the ORM
+    await sync_to_async(_send)(
+        signal, magiclink, request, time.perf_counter() - start, **kwargs,
+    )
+
+
+def _send(
+    signal: Signal,
+    magiclink: object,
+    request: Optional[HttpRequest],
+    elapsed: float,
+    **kwargs: object,
+) -> None:
+    signal.send(
+        sender=type(magiclink),
+        magiclink=magiclink,
+        request=request,
+        elapsed=elapsed,
+        **kwargs,
+    )
@@ -0,0 +1,240 @@
+import hashlib
+from datetime import timedelta
+from functools import lru_cache
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from . import settings
+from .models import MagicLink
+from .tokens import hash_code, hash_verifier, is_signed_token, split_token
+
+
+class MagicLinkStorage():
+    """
+    Base class for where magic links are kept between being created and
+    used. Stateless magic links are never stored so they do not use it
+    """
+
+    def add(self, magiclink: MagicLink) -> None:
+        """
+        Store a new magic link, disabling the email's earlier links when
+        MAGICLINK_ONE_TOKEN_PER_USER is set
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def add_many(self, magiclinks: List[MagicLink]) -> None:
+        for magiclink in magiclinks:
+            self.add(magiclink)
+
+    def get_by_token(self, token: str) -> MagicLink:
+        """
+        Returns the magic link for a URL token or raises
+        MagicLink.DoesNotExist
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def get_by_code(self, email: str, code: str) -> MagicLink:
+        raise NotImplementedError  # pragma: no cover
+
+    def use(self, magiclink: MagicLink) -> bool:
+        """
+        Atomically count a use of the magic link. Returns False if it is
+        disabled, expired or has already been used TOKEN_USES times
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def disable(self, magiclink: MagicLink) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    async def aadd(self, magiclink: MagicLink) -> None:
+        await sync_to_async(self.add)(magiclink)
+
+    async def aget_by_token(self, token: str) -> MagicLink:
+        return await sync_to_async(self.get_by_token)(token)
+
+    async def ause(self, magiclink: MagicLink) -> bool:
+        return await sync_to_async(self.use)(magiclink)
+
+    async def adisable(self, magiclink: MagicLink) -> None:
+        await sync_to_async(self.disable)(magiclink)
+
+
+class DatabaseStorage(MagicLinkStorage):
+    """
+    Saves each magic link as a MagicLink row, keeping an audit trail until
+    the magiclink_clear_logins command removes them
+    """
+
+    def add(self, magiclink: MagicLink) -> None:
+        if settings.ONE_TOKEN_PER_USER:
+            # Expired links are disabled too so they leave the partial index
+            MagicLink.objects.for_email(magiclink.email).disable_all()
+        magiclink.save()
+
+    def add_many(self, magiclinks: List[MagicLink]) -> None:
+        if settings.ONE_TOKEN_PER_USER:
+            emails = [magiclink.email for magiclink in magiclinks]
+            MagicLink.objects.filter(email__in=emails).disable_all()
+        MagicLink.objects.bulk_create(magiclinks)
+
+    def get_by_token(self, token: str) -> MagicLink:
+        return MagicLink.objects.get_by_token(token)
+
+    def get_by_code(self, email: str, code: str) -> MagicLink:
+        return MagicLink.objects.get_by_code(email, code)
+
+    def use(self, magiclink: MagicLink) -> bool:
+        # A single conditional UPDATE so concurrent requests can not use the
+        # magic link more than TOKEN_USES times
+        usable = magiclink.usable_queryset()
+        return bool(usable.update(**magiclink.use_fields()))
+
+    def disable(self, magiclink: MagicLink) -> None:
+        magiclink.save()
+
+    async def aadd(self, magiclink: MagicLink) -> None:
+        if settings.ONE_TOKEN_PER_USER:
+            magic_links = MagicLink.objects.for_email(magiclink.email)
+            await magic_links.adisable_all()
+        await magiclink.asave()
+
+    async def aget_by_token(self, token: str) -> MagicLink:
+        return await MagicLink.objects.aget_by_token(token)
+
+    async def ause(self, magiclink: MagicLink) -> bool:
+        usable = magiclink.usable_queryset()
+        return bool(await usable.aupdate(**magiclink.use_fields()))
+
+    async def adisable(self, magiclink: MagicLink) -> None:
+        await magiclink.asave()
+
+
+class CacheStorage(MagicLinkStorage):
+    """
+    Keeps magic links in the MAGICLINK_STORAGE_CACHE cache instead of the
+    database. Each link expires from the cache with the link itself so
+    nothing has to be cleaned up, and uses are counted with the cache's
+    atomic `incr`. The cache must be shared between processes and
+    persistent enough to keep links for AUTH_TIMEOUT seconds (e.g. Redis
+    or Memcached). Legacy plain text tokens are not supported
+    """
+
+    key_prefix = 'magiclink:link'
+
+    @property
+    def cache(self):
+        return caches[settings.STORAGE_CACHE]
+
+    def key(self, kind: str, value: str) -> str:
+        return f'{self.key_prefix}:{kind}:{value}'
+
+    def email_key(self, email: str) -> str:
+        digest = hashlib.sha256(email.encode()).hexdigest()[:32]
+        return self.key('email', digest)
+
+    def timeout(self, magiclink: MagicLink) -> int:
+        remaining = magiclink.expiry - timezone.now()
+        return max(1, int(remaining / timedelta(seconds=1)) + 1)
+
+    def add(self, magiclink: MagicLink) -> None:
+        if not magiclink.created:
+            magiclink.created = timezone.now()
+        timeout = self.timeout(magiclink)
+        if settings.ONE_TOKEN_PER_USER:
+            email_key = self.email_key(magiclink.email)
+            previous = self.cache.get(email_key)
+            if previous:
+                self.disable_selector(previous)
+            self.cache.set(email_key, magiclink.token, timeout)
+
+        values = {
+            self.key('data', magiclink.token): self.serialize(magiclink),
+            self.key('uses', magiclink.token): 0,
+        }
+        if magiclink.code_hash:
+            code_key = self.key('code', magiclink.code_hash)
+            values[code_key] = magiclink.token
+        self.cache.set_many(values, timeout)
+
+    def get_by_token(self, token: str) -> MagicLink:
+        if not token:
+            raise MagicLink.DoesNotExist('No token supplied')
+
+        if is_signed_token(token):
+            return MagicLink.objects.get_by_signed_token(token)
+
+        selector, verifier = split_token(token)
+        if not verifier:
+            raise MagicLink.DoesNotExist('Legacy tokens are not cached')
+
+        magiclink = self.load(selector)
+        verifier_hash = hash_verifier(verifier)
+        if not constant_time_compare(verifier_hash, magiclink.verifier_hash):
+            raise MagicLink.DoesNotExist('Token verifier does not match')
+        return magiclink
+
+    def get_by_code(self, email: str, code: str) -> MagicLink:
+        selector = self.cache.get(self.key('code', hash_code(email, code)))
+        if not selector:
+            raise MagicLink.DoesNotExist('No magic link with that code')
+        return self.load(selector)
+
+    def use(self, magiclink: MagicLink) -> bool:
+        if timezone.now() > magiclink.expiry:
+            return False
+        try:
+            uses = self.cache.incr(self.key('uses', magiclink.token))
+        except ValueError:
+            # The magic link expired from the cache
+            return False
+        return uses <= settings.TOKEN_USES
+
+    def disable(self, magiclink: MagicLink) -> None:
+        self.disable_selector(magiclink.token)
+
+    def disable_selector(self, selector: str) -> None:
+        # Using up the remaining uses keeps the link until it expires so the
+        # reason a later login fails can still be shown
+        try:
+            self.cache.incr(self.key('uses', selector), settings.TOKEN_USES)
+        except ValueError:
+            pass
+
+    def load(self, selector: str) -> MagicLink:
+        data_key = self.key('data', selector)
+        uses_key = self.key('uses', selector)
+        values = self.cache.get_many([data_key, uses_key])
+        if data_key not in values:
+            raise MagicLink.DoesNotExist('Magic link not found in the cache')
+
+        magiclink = MagicLink(**values[data_key])
+        magiclink.times_used = values.get(uses_key, settings.TOKEN_USES)
+        magiclink.disabled = magiclink.times_used >= settings.TOKEN_USES
+        return magiclink
+
+    def serialize(self, magiclink: MagicLink) -> Dict[str, object]:
+        return {
+            'email': magiclink.email,
+            'token': magiclink.token,
+            'verifier_hash': magiclink.verifier_hash,
+            'code_hash': magiclink.code_hash,
+            'expiry': magiclink.expiry,
+            'redirect_url': magiclink.redirect_url,
+            'cookie_value': magiclink.cookie_value,
+            'ip_address': magiclink.ip_address,
+            'created': magiclink.created,
+        }
+
+
+@lru_cache(maxsize=None)
+def load_storage(path: str) -> MagicLinkStorage:
+    return import_string(path)()
+
+
+def get_storage() -> MagicLinkStorage:
+    return load_storage(settings.STORAGE)
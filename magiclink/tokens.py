@@ -0,0 +1,77 @@
+import hashlib
+import string
+from typing import Dict, Optional, Tuple, Union
+
+from django.core import signing
+from django.utils.crypto import get_random_string, salted_hmac
+
+from . import settings
+
+# Magic link tokens are made up of a short selector, which is stored and
+# indexed so it can be used to find the MagicLink, and a verifier which is
+# only ever stored as a hash
+SEPARATOR = '.'
+SELECTOR_LENGTH = 16
+
+# Stateless tokens are signed with django.core.signing and carry all of the
+# magic link details so they can be verified without a database lookup
+SIGNING_SALT = 'magiclink.tokens'
+SIGNING_SEPARATOR = ':'
+
+# Login codes are short, so unlike verifiers they are hashed with a key (the
+# SECRET_KEY) and can not be recovered from a copy of the database
+CODE_SALT = 'magiclink.tokens.code'
+
+Payload = Dict[str, Optional[Union[str, int]]]
+
+
+def generate_token() -> Tuple[str, str]:
+    selector = get_random_string(length=SELECTOR_LENGTH)
+    verifier = get_random_string(length=settings.TOKEN_LENGTH)
+    return selector, verifier
+
+
+def join_token(selector: str, verifier: str) -> str:
+    return f'{selector}{SEPARATOR}{verifier}'
+
+
+def split_token(token: str) -> Tuple[str, str]:
+    """
+    Returns the selector and verifier of a token. Tokens issued before the
+    selector / verifier split do not contain a separator so an empty
+    verifier is returned
+    """
+    selector, _, verifier = token.partition(SEPARATOR)
+    return selector, verifier
+
+
+def hash_verifier(verifier: str) -> str:
+    # The verifier is a long random string so a fast hash is sufficient
+    return hashlib.sha256(verifier.encode()).hexdigest()
+
+
+def generate_code() -> str:
+    return get_random_string(
+        length=settings.LOGIN_CODE_LENGTH, allowed_chars=string.digits,
+    )
+
+
+def hash_code(email: str, code: str) -> str:
+    value = f'{email}{SEPARATOR}{code}'
+    return salted_hmac(CODE_SALT, value, algorithm='sha256').hexdigest()
+
+
+def generate_token_id() -> str:
+    return get_random_string(length=SELECTOR_LENGTH)
+
+
+def is_signed_token(token: str) -> bool:
+    return SIGNING_SEPARATOR in token
+
+
+def sign_token(payload: Payload) -> str:
+    return signing.dumps(payload, salt=SIGNING_SALT, compress=True)
+
+
+def unsign_token(token: str) -> Payload:
+    return signing.loads(token, salt=SIGNING_SALT)
@@ -0,0 +1,84 @@
+import hashlib
+import math
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+from uuid import uuid4
+
+from django.core.cache import cache
+
+# Small filters are sized for this many values so they keep a low error
+# rate (about 1.2KB)
+MIN_CAPACITY = 1000
+
+
+class BloomFilter():
+    """
+    A fixed size set of strings which can return false positives but never
+    false negatives
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        capacity = max(capacity, 1)
+        self.size = max(8, int(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        ))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value: str) -> Iterable[int]:
+        digest = hashlib.sha256(value.encode()).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        for index in range(self.hash_count):
+            yield (first + index * second) % self.size
+
+    def add(self, value: str) -> None:
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self.positions(value)
+        )
+
+
+class VersionedBloomFilter():
+    """
+    An in process Bloom filter which is rebuilt whenever the version stored
+    in the Django cache changes. Call `invalidate` after the underlying data
+    changes so every process rebuilds its filter on the next lookup
+    """
+
+    def __init__(
+        self,
+        version_key: str,
+        load: Callable[[], Tuple[int, Iterable[str]]],
+    ) -> None:
+        self.version_key = version_key
+        self.load = load
+        self.lock = threading.Lock()
+        self.version: Optional[str] = None
+        self.filter: Optional[BloomFilter] = None
+
+    def __contains__(self, value: str) -> bool:
+        return value in self.get_filter()
+
+    def get_filter(self) -> BloomFilter:
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, timeout=None)
+            version = cache.get(self.version_key)
+
+        with self.lock:
+            if self.filter is None or self.version != version:
+                count, values = self.load()
+                bloom_filter = BloomFilter(max(count, MIN_CAPACITY))
+                for value in values:
+                    bloom_filter.add(value)
+                self.filter = bloom_filter
+                self.version = version
+            return self.filter
+
+    def invalidate(self) -> None:
+        cache.set(self.version_key, uuid4().hex, timeout=None)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import Login, LoginSent, LoginVerify, Logout, Signup
+from .views import Login, LoginCode, LoginSent, LoginVerify, Logout, Signup
 
 app_name = "magiclink"
 
@@ -9,5 +9,6 @@ urlpatterns = [
     path('login/sent/', LoginSent.as_view(), name='login_sent'),
     path('signup/', Signup.as_view(), name='signup'),
     path('login/verify/', LoginVerify.as_view(), name='login_verify'),
+    path('login/code/', LoginCode.as_view(), name='login_code'),
     path('logout/', Logout.as_view(), name='logout'),
 ]
@@ -0,0 +1,73 @@
+from typing import Dict, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AbstractUser
+from django.http import HttpRequest
+
+REQUEST_ATTRIBUTE = '_magiclink_users'
+
+
+def get_user(
+    email: str,
+    request: Optional[HttpRequest] = None,
+) -> Optional[AbstractUser]:
+    """
+    Returns the user with the email address or None if there isn't one.
+    When a request is passed the result is kept on the request so the
+    login form, helpers and MagicLink share a single query per request
+    """
+    users = _request_users(request)
+    if users is not None and email in users:
+        return users[email]
+
+    User = get_user_model()
+    try:
+        user = User.objects.get(email=email)
+    except User.DoesNotExist:
+        user = None
+
+    if users is not None:
+        users[email] = user
+    return user
+
+
+async def aget_user(
+    email: str,
+    request: Optional[HttpRequest] = None,
+) -> Optional[AbstractUser]:
+    users = _request_users(request)
+    if users is not None and email in users:
+        return users[email]
+
+    User = get_user_model()
+    try:
+        user = await User.objects.aget(email=email)
+    except User.DoesNotExist:
+        user = None
+
+    if users is not None:
+        users[email] = user
+    return user
+
+
+def remember_user(
+    user: AbstractUser,
+    request: Optional[HttpRequest] = None,
+) -> None:
+    """
+    Store a user (e.g. one which has just been created) for later lookups
+    in the same request
+    """
+    users = _request_users(request)
+    if users is not None:
+        users[user.email] = user
+
+
+def _request_users(
+    request: Optional[HttpRequest],
+) -> Optional[Dict[str, Optional[AbstractUser]]]:
+    if request is None:
+        return None
+    if not hasattr(request, REQUEST_ATTRIBUTE):
+        setattr(request, REQUEST_ATTRIBUTE, {})
+    return getattr(request, REQUEST_ATTRIBUTE)
@@ -1,7 +1,12 @@
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
 from django.http import HttpRequest
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 
+T = TypeVar('T')
+
 
 def get_client_ip(request: HttpRequest) -> str:
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -21,3 +26,12 @@ def get_url_path(url: str) -> str:
         return reverse(url)
     except NoReverseMatch:
         return url
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,12 +1,13 @@
 import logging
+from typing import Dict, List, Optional
 
 from django.conf import settings as django_settings
-from django.contrib.auth import authenticate, get_user_model, login, logout
+from django.contrib.auth import authenticate, login, logout
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import never_cache
 from django.views.generic import TemplateView
-from django.views.generic.base import RedirectView
+from django.views.generic.base import RedirectView, TemplateResponseMixin
 
 try:
     from django.utils.http import url_has_allowed_host_and_scheme as safe_url
@@ -16,21 +17,51 @@ except ImportError:  # pragma: no cover
 from django.views.decorators.csrf import csrf_protect
 
 from . import settings
+from .backends import (
+    get_request_magiclink, get_request_magiclink_error, has_request_magiclink,
+    set_request_magiclink
+)
+from .dispatch import dispatch_magiclink
 from .forms import (
-    LoginForm, SignupForm, SignupFormEmailOnly, SignupFormFull,
+    LoginCodeForm, LoginForm, SignupForm, SignupFormEmailOnly, SignupFormFull,
     SignupFormWithUsername
 )
 from .helpers import create_magiclink, get_or_create_user
 from .models import MagicLink, MagicLinkError
+from .storage import get_storage
 from .utils import get_url_path
 
-User = get_user_model()
 log = logging.getLogger(__name__)
 
 
+def login_sent_response(magiclink: MagicLink) -> HttpResponse:
+    sent_url = get_url_path(settings.LOGIN_SENT_REDIRECT)
+    response = HttpResponseRedirect(sent_url)
+    if settings.REQUIRE_SAME_BROWSER:
+        cookie_name = magiclink.cookie_name
+        response.set_cookie(cookie_name, magiclink.cookie_value)
+        log.info(f'Cookie {cookie_name} set for {magiclink.email}')
+    return response
+
+
+class SettingTemplateMixin(TemplateResponseMixin):
+    """
+    Renders the template named by the `template_setting` MAGICLINK_ setting,
+    read on each request so it can be overridden after the views are
+    imported. A template_name set on a subclass or passed to as_view() is
+    used instead
+    """
+    template_setting = ''
+
+    def get_template_names(self) -> List[str]:
+        if self.template_name:
+            return [self.template_name]
+        return [getattr(settings, self.template_setting)]
+
+
 @method_decorator(csrf_protect, name='dispatch')
-class Login(TemplateView):
-    template_name = settings.LOGIN_TEMPLATE_NAME
+class Login(SettingTemplateMixin, TemplateView):
+    template_setting = 'LOGIN_TEMPLATE_NAME'
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
@@ -42,14 +73,14 @@ class Login(TemplateView):
         logout(request)
         context = self.get_context_data(**kwargs)
         context['require_signup'] = settings.REQUIRE_SIGNUP
-        form = LoginForm(request.POST)
+        form = LoginForm(request.POST, request=request)
         if not form.is_valid():
             context['login_form'] = form
             return self.render_to_response(context)
 
         email = form.cleaned_data['email']
         if not settings.REQUIRE_SIGNUP:
-            get_or_create_user(email)
+            get_or_create_user(email, request=request)
 
         redirect_url = self.login_redirect_url(request.GET.get('next', ''))
         try:
@@ -61,15 +92,8 @@ class Login(TemplateView):
             context['login_form'] = form
             return self.render_to_response(context)
 
-        magiclink.send(request)
-
-        sent_url = get_url_path(settings.LOGIN_SENT_REDIRECT)
-        response = HttpResponseRedirect(sent_url)
-        if settings.REQUIRE_SAME_BROWSER:
-            cookie_name = f'magiclink{magiclink.pk}'
-            response.set_cookie(cookie_name, magiclink.cookie_value)
-            log.info(f'Cookie {cookie_name} set for {email}')
-        return response
+        dispatch_magiclink(magiclink, request)
+        return login_sent_response(magiclink)
 
     def login_redirect_url(self, next_url) -> str:
         redirect_url = ''
@@ -86,67 +110,151 @@ class Login(TemplateView):
         return redirect_url
 
 
-class LoginSent(TemplateView):
-    template_name = settings.LOGIN_SENT_TEMPLATE_NAME
+class LoginSent(SettingTemplateMixin, TemplateView):
+    template_setting = 'LOGIN_SENT_TEMPLATE_NAME'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Stateless magic links do not have a code
+        if settings.LOGIN_CODE and not settings.STATELESS:
+            context['login_code_form'] = LoginCodeForm()
+        return context
+
+
+@method_decorator(csrf_protect, name='dispatch')
+@method_decorator(never_cache, name='dispatch')
+class LoginCode(LoginSent):
+    """
+    Log in with the code from the email. A successful code redirects
+    straight to the magic link's redirect URL, otherwise the login sent page
+    is shown again with the error
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        if not settings.LOGIN_CODE or settings.STATELESS:
+            raise Http404()
+
+        form = LoginCodeForm(request.POST)
+        if form.is_valid():
+            user = authenticate(
+                request,
+                email=form.cleaned_data['email'],
+                code=form.cleaned_data['code'],
+            )
+            if user:
+                login(request, user)
+                log.info(f'Login with code successful for {user.email}')
+                magiclink = get_request_magiclink(request)
+                return self.login_success_response(magiclink)
+
+            error = get_request_magiclink_error(request) or (
+                'That code is incorrect or has expired'
+            )
+            form.add_error(None, error)
+
+        context = self.get_context_data(**kwargs)
+        context['login_code_form'] = form
+        return self.render_to_response(context)
+
+    def login_success_response(
+        self,
+        magiclink: Optional[MagicLink],
+    ) -> HttpResponse:
+        if magiclink is None:
+            redirect_url = get_url_path(django_settings.LOGIN_REDIRECT_URL)
+            return HttpResponseRedirect(redirect_url)
+
+        response = HttpResponseRedirect(magiclink.redirect_url)
+        if settings.REQUIRE_SAME_BROWSER:
+            response.delete_cookie(magiclink.cookie_name)
+        return response
 
 
 @method_decorator(never_cache, name='dispatch')
-class LoginVerify(TemplateView):
-    template_name = settings.LOGIN_FAILED_TEMPLATE_NAME
+class LoginVerify(SettingTemplateMixin, TemplateView):
+    template_setting = 'LOGIN_FAILED_TEMPLATE_NAME'
 
     def get(self, request, *args, **kwargs):
         token = request.GET.get('token')
         email = request.GET.get('email')
         user = authenticate(request, token=token, email=email)
         if not user:
-            if settings.LOGIN_FAILED_REDIRECT:
-                redirect_url = get_url_path(settings.LOGIN_FAILED_REDIRECT)
-                return HttpResponseRedirect(redirect_url)
-
-            if not settings.LOGIN_FAILED_TEMPLATE_NAME:
-                raise Http404()
+            response = self.login_failed_redirect()
+            if response:
+                return response
 
-            context = self.get_context_data(**kwargs)
-            # The below settings are left in for backward compatibility
-            context['ONE_TOKEN_PER_USER'] = settings.ONE_TOKEN_PER_USER
-            context['REQUIRE_SAME_BROWSER'] = settings.REQUIRE_SAME_BROWSER
-            context['REQUIRE_SAME_IP'] = settings.REQUIRE_SAME_IP
-            context['ALLOW_SUPERUSER_LOGIN'] = settings.ALLOW_SUPERUSER_LOGIN  # NOQA: E501
-            context['ALLOW_STAFF_LOGIN'] = settings.ALLOW_STAFF_LOGIN
-
-            try:
-                magiclink = MagicLink.objects.get(token=token)
-            except MagicLink.DoesNotExist:
+            magiclink = self.get_magiclink()
+            if not magiclink:
                 error = 'A magic link with that token could not be found'
-                context['login_error'] = error
-                return self.render_to_response(context)
-
-            try:
-                magiclink.validate(request, email)
-            except MagicLinkError as error:
-                context['login_error'] = str(error)
-
-            return self.render_to_response(context)
+            else:
+                error = get_request_magiclink_error(request)
+                if not error:
+                    try:
+                        magiclink.validate(request, email)
+                    except MagicLinkError as validation_error:
+                        error = str(validation_error)
+            return self.login_failed_response(error, **kwargs)
 
         login(request, user)
         log.info(f'Login successful for {email}')
+        return self.login_success_response()
+
+    def login_failed_redirect(self) -> Optional[HttpResponse]:
+        if settings.LOGIN_FAILED_REDIRECT:
+            redirect_url = get_url_path(settings.LOGIN_FAILED_REDIRECT)
+            return HttpResponseRedirect(redirect_url)
 
+        if not self.template_name and not settings.LOGIN_FAILED_TEMPLATE_NAME:
+            raise Http404()
+        return None
+
+    def login_failed_response(self, error: str, **kwargs) -> HttpResponse:
+        context = self.get_context_data(**kwargs)
+        # The below settings are left in for backward compatibility
+        context['ONE_TOKEN_PER_USER'] = settings.ONE_TOKEN_PER_USER
+        context['REQUIRE_SAME_BROWSER'] = settings.REQUIRE_SAME_BROWSER
+        context['REQUIRE_SAME_IP'] = settings.REQUIRE_SAME_IP
+        context['ALLOW_SUPERUSER_LOGIN'] = settings.ALLOW_SUPERUSER_LOGIN
+        context['ALLOW_STAFF_LOGIN'] = settings.ALLOW_STAFF_LOGIN
+        if error:
+            context['login_error'] = error
+        return self.render_to_response(context)
+
+    def login_success_response(self) -> HttpResponse:
         response = self.login_complete_action()
-        if settings.REQUIRE_SAME_BROWSER:
-            magiclink = MagicLink.objects.get(token=token)
-            cookie_name = f'magiclink{magiclink.pk}'
+        magiclink = self.get_magiclink()
+        if settings.REQUIRE_SAME_BROWSER and magiclink:
+            cookie_name = magiclink.cookie_name
             response.delete_cookie(cookie_name, magiclink.cookie_value)
         return response
 
+    def get_magiclink(self) -> Optional[MagicLink]:
+        """
+        Returns the magic link resolved by MagicLinkBackend.authenticate,
+        only looking it up if another backend handled the request
+        """
+        if not has_request_magiclink(self.request):
+            token = self.request.GET.get('token', '')
+            try:
+                magiclink = get_storage().get_by_token(token)
+            except MagicLink.DoesNotExist:
+                magiclink = None
+            set_request_magiclink(self.request, magiclink)
+        return get_request_magiclink(self.request)
+
     def login_complete_action(self) -> HttpResponse:
-        token = self.request.GET.get('token')
-        magiclink = MagicLink.objects.get(token=token)
+        magiclink = self.get_magiclink()
+        if magiclink is None:
+            # Another authentication backend handled the token
+            redirect_url = get_url_path(django_settings.LOGIN_REDIRECT_URL)
+            return HttpResponseRedirect(redirect_url)
         return HttpResponseRedirect(magiclink.redirect_url)
 
 
 @method_decorator(csrf_protect, name='dispatch')
-class Signup(TemplateView):
-    template_name = settings.SIGNUP_TEMPLATE_NAME
+class Signup(SettingTemplateMixin, TemplateView):
+    template_setting = 'SIGNUP_TEMPLATE_NAME'
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
@@ -160,47 +268,54 @@ class Signup(TemplateView):
         logout(request)
         context = self.get_context_data(**kwargs)
         form_name = request.POST.get('form_name')
-        from_list = [
-            'SignupForm, SignupFormEmailOnly', 'SignupFormWithUsername',
-            'SignupFormFull',
-        ]
-        forms = __import__('magiclink.forms', fromlist=from_list)
-        try:
-            SignupForm = getattr(forms, form_name)
-        except AttributeError:
+        SignupForm = self.get_signup_form_class(form_name)
+        if SignupForm is None:
             return HttpResponseRedirect(self.request.path_info)
 
-        form = SignupForm(request.POST)
+        form = SignupForm(request.POST, request=request)
         if not form.is_valid():
             context[form_name] = form
             return self.render_to_response(context)
 
         email = form.cleaned_data['email']
+        get_or_create_user(request=request, **self.user_details(form))
+        try:
+            magiclink = create_magiclink(
+                email, request, redirect_url=self.signup_redirect_url(),
+            )
+        except MagicLinkError as e:
+            form.add_error('email', str(e))
+            context[form_name] = form
+            return self.render_to_response(context)
+
+        dispatch_magiclink(magiclink, request)
+        return login_sent_response(magiclink)
+
+    def get_signup_form_class(self, form_name: str):
+        from_list = [
+            'SignupForm, SignupFormEmailOnly', 'SignupFormWithUsername',
+            'SignupFormFull',
+        ]
+        forms = __import__('magiclink.forms', fromlist=from_list)
+        return getattr(forms, str(form_name), None)
+
+    def user_details(self, form) -> Dict[str, str]:
         full_name = form.cleaned_data.get('name', '')
         try:
             first_name, last_name = full_name.split(' ', 1)
         except ValueError:
             first_name = full_name
             last_name = ''
-
-        get_or_create_user(
-            email=email,
-            username=form.cleaned_data.get('username', ''),
-            first_name=first_name,
-            last_name=last_name
-        )
+        return {
+            'email': form.cleaned_data['email'],
+            'username': form.cleaned_data.get('username', ''),
+            'first_name': first_name,
+            'last_name': last_name,
+        }
+
+    def signup_redirect_url(self) -> str:
         default_signup_redirect = get_url_path(settings.SIGNUP_LOGIN_REDIRECT)
-        next_url = request.GET.get('next', default_signup_redirect)
-        magiclink = create_magiclink(email, request, redirect_url=next_url)
-        magiclink.send(request)
-
-        sent_url = get_url_path(settings.LOGIN_SENT_REDIRECT)
-        response = HttpResponseRedirect(sent_url)
-        if settings.REQUIRE_SAME_BROWSER:
-            cookie_name = f'magiclink{magiclink.pk}'
-            response.set_cookie(cookie_name, magiclink.cookie_value)
-            log.info(f'Cookie {cookie_name} set for {email}')
-        return response
+        return self.request.GET.get('next', default_signup_redirect)
 
 
 class Logout(RedirectView):
@@ -0,0 +1,6 @@
+from django.urls import include, path
+
+# Sites using the async views only include magiclink.async_urls
+urlpatterns = [
+    path('auth/', include('magiclink.async_urls', namespace='magiclink')),
+]
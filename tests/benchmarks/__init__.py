@@ -0,0 +1,45 @@
+"""
+Standalone benchmarks for django-magiclink.
+
+These are not collected by pytest. Run them as modules from the repository
+root, e.g. ``python -m tests.benchmarks.bench_verify``
+"""
+import os
+import statistics
+import time
+from typing import Callable, Dict, List
+
+
+def setup_django() -> None:
+    """
+    Configure Django with the test settings and create a fresh (in memory)
+    test database so benchmarks never touch the development database
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def timings(func: Callable[[], object], iterations: int) -> List[float]:
+    results = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        results.append(time.perf_counter() - start)
+    return results
+
+
+def summarise(results: List[float]) -> Dict[str, float]:
+    ordered = sorted(results)
+    p99_index = min(len(ordered) - 1, int(len(ordered) * 0.99))
+    return {
+        'p50_ms': statistics.median(ordered) * 1000,
+        'p99_ms': ordered[p99_index] * 1000,
+        'mean_ms': statistics.mean(ordered) * 1000,
+    }
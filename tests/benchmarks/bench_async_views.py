@@ -0,0 +1,93 @@
+"""
+Compare the throughput of the sync and async login views under uvicorn.
+Both URL sets are served by the same ASGI application so the only
+difference is the view classes. Requires uvicorn and httpx:
+
+    pip install uvicorn httpx
+    python -m tests.benchmarks.bench_async_views --concurrency 50
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from . import setup_django
+
+URL_PREFIXES = {'sync': '/auth/', 'async': '/async-auth/'}
+
+
+def start_server(port: int):
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    config = uvicorn.Config(
+        get_asgi_application(), port=port, log_level='warning',
+        lifespan='off',
+    )
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def login_requests(
+    base_url: str,
+    name: str,
+    total: int,
+    concurrency: int,
+) -> float:
+    import httpx
+
+    url = f'{URL_PREFIXES[name]}login/'
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        response = await client.get(url)
+        csrf_token = response.cookies['csrftoken']
+
+        async def post(index: int) -> None:
+            async with semaphore:
+                response = await client.post(
+                    url,
+                    data={'email': f'{name}{index}@example.com'},
+                    headers={'X-CSRFToken': csrf_token},
+                )
+                assert response.status_code == 302, response.status_code
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(index) for index in range(total)))
+        return total / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from magiclink import settings as mlsettings
+
+    # Every request logs in a new user so only the view work is measured
+    mlsettings.RATE_LIMITER = ''
+    mlsettings.REQUIRE_SIGNUP = False
+
+    server, thread = start_server(args.port)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        print(f'{"views":>10} {"requests/s":>12}')
+        for name in URL_PREFIXES:
+            throughput = asyncio.run(login_requests(
+                base_url, name, args.requests, args.concurrency,
+            ))
+            print(f'{name:>10} {throughput:>12.1f}')
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare rendering the magic link email with render_to_string (the previous
+approach) against the cached EmailRenderer.
+
+    python -m tests.benchmarks.bench_email_render --iterations 5000
+"""
+import argparse
+
+from . import setup_django, summarise, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.template.loader import render_to_string
+    from django.utils import timezone
+
+    from magiclink import settings
+    from magiclink.emails import get_email_renderer
+    from magiclink.helpers import get_or_create_user
+
+    user = get_or_create_user('bench@example.com')
+    now = timezone.now()
+    link_context = {
+        'user': user,
+        'magiclink': 'http://testserver/auth/login/verify/?token=abc.def',
+        'expiry': now,
+        'ip_address': '127.0.0.0',
+        'created': now,
+    }
+
+    def render_to_string_path():
+        context = {
+            'subject': settings.EMAIL_SUBJECT,
+            'require_same_ip': settings.REQUIRE_SAME_IP,
+            'require_same_browser': settings.REQUIRE_SAME_BROWSER,
+            'token_uses': settings.TOKEN_USES,
+            'style': settings.EMAIL_STYLES,
+            **link_context,
+        }
+        render_to_string(settings.EMAIL_TEMPLATE_NAME_TEXT, context)
+        render_to_string(settings.EMAIL_TEMPLATE_NAME_HTML, context)
+
+    def renderer_path():
+        get_email_renderer().render(link_context)
+
+    print(f'{"path":>18} {"p50 us":>10} {"p99 us":>10}')
+    for name, func in [
+        ('render_to_string', render_to_string_path),
+        ('EmailRenderer', renderer_path),
+    ]:
+        func()  # Warm up template loaders
+        result = summarise(timings(func, args.iterations))
+        p50, p99 = result['p50_ms'] * 1000, result['p99_ms'] * 1000
+        print(f'{name:>18} {p50:>10.1f} {p99:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
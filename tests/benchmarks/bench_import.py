@@ -0,0 +1,121 @@
+"""
+Measure the time spent importing django-magiclink when a worker starts, using
+``python -X importtime`` in fresh interpreters.
+
+Only modules imported because of magiclink count: Django, the test project and
+modules Django already imported during setup are excluded. Bytecode is cached
+by a first, untimed run as it would be on a deployed worker. The time is the
+median of several runs and the script exits with 1 when it is over --budget.
+
+    python -m tests.benchmarks.bench_import --budget 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# The modules a worker imports: the models (via django.setup()), the
+# authentication backend and the URLconf with the views and forms
+SCRIPT = """
+import django
+django.setup()
+import magiclink.backends
+import magiclink.urls
+"""
+
+
+def parse(output: str) -> List[Tuple[int, int, int, str]]:
+    """
+    Returns (depth, self us, cumulative us, module) for every line of
+    ``-X importtime`` output
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append(
+            (depth, int(self_us), int(cumulative_us), name.strip()),
+        )
+    return imports
+
+
+def magiclink_imports(
+    imports: List[Tuple[int, int, int, str]],
+) -> Tuple[int, Dict[str, int]]:
+    """
+    Returns the total cumulative time of the outermost magiclink modules and
+    the self time of every module imported while loading them
+    """
+    total = 0
+    modules: Dict[str, int] = {}
+    # Children are printed before their parents, walk backwards so each
+    # module's ancestors are on the stack
+    stack: List[Tuple[int, str]] = []
+    for depth, self_us, cumulative_us, name in reversed(imports):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        inside = any(parent.startswith('magiclink') for _, parent in stack)
+        if name.startswith('magiclink') and not inside:
+            total += cumulative_us
+        if name.startswith('magiclink') or inside:
+            modules[name] = self_us
+        stack.append((depth, name))
+    return total, modules
+
+
+def run() -> Tuple[int, Dict[str, int]]:
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return magiclink_imports(parse(result.stderr))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('--runs', type=int, default=9)
+    parser.add_argument('--budget', type=float, default=20.0,
+                        help='milliseconds')
+    parser.add_argument('--top', type=int, default=15,
+                        help='slowest modules to list')
+    args = parser.parse_args()
+
+    run()
+    totals = []
+    slowest: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        total, modules = run()
+        totals.append(total)
+        for name, self_us in modules.items():
+            slowest.setdefault(name, []).append(self_us)
+
+    median = statistics.median(totals) / 1000
+    print(f'magiclink import time: median {median:.1f}ms, '
+          f'min {min(totals) / 1000:.1f}ms, max {max(totals) / 1000:.1f}ms '
+          f'over {args.runs} runs')
+
+    print(f'\n{"module":>45} {"self ms":>9}')
+    ranked = sorted(
+        slowest.items(), key=lambda item: statistics.median(item[1]),
+        reverse=True,
+    )
+    for name, values in ranked[:args.top]:
+        print(f'{name:>45} {statistics.median(values) / 1000:>9.2f}')
+
+    if median > args.budget:
+        print(f'\nOver the {args.budget:g}ms budget')
+        sys.exit(1)
+    print(f'\nWithin the {args.budget:g}ms budget')
+
+
+if __name__ == '__main__':
+    main()
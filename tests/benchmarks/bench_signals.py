@@ -0,0 +1,76 @@
+"""
+Measure the cost of the magic link signals. Without receivers sending a
+signal should cost about as much as an empty function call, and
+MagicLink.validate should be as fast as with the signals patched out.
+
+    python -m tests.benchmarks.bench_signals --iterations 2000
+"""
+import argparse
+import timeit
+from unittest import mock
+
+from . import setup_django, summarise, timings
+
+
+def noop(*args, **kwargs) -> None:
+    pass
+
+
+def bench_send_signal(number: int) -> None:
+    from magiclink.models import MagicLink
+    from magiclink.signals import magiclink_validated, send_signal
+
+    magiclink = MagicLink()
+    calls = {
+        'empty function': lambda: noop(magiclink_validated, magiclink, None, 0),  # NOQA: E501
+        'send_signal': lambda: send_signal(magiclink_validated, magiclink, None, 0),  # NOQA: E501
+    }
+    print(f'{"call":>16} {"ns/call":>10}')
+    for name, call in calls.items():
+        seconds = min(timeit.repeat(call, number=number, repeat=5))
+        print(f'{name:>16} {seconds / number * 1e9:>10.1f}')
+
+
+def bench_validate(iterations: int) -> None:
+    from django.http import HttpRequest
+
+    from magiclink.helpers import create_magiclink, get_or_create_user
+    from magiclink.models import MagicLink
+    from magiclink.signals import magiclink_validated
+
+    user = get_or_create_user('bench@example.com')
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    magiclink = create_magiclink(user.email, request)
+    request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+
+    def validate():
+        magiclink.validate(request, user.email)
+
+    def receiver(**kwargs):
+        pass
+
+    print(f'\n{"validate":>16} {"p50 ms":>10} {"p99 ms":>10}')
+    with mock.patch('magiclink.models.send_signal', noop):
+        results = [('signals removed', summarise(timings(validate, iterations)))]  # NOQA: E501
+    results.append(('no receivers', summarise(timings(validate, iterations))))
+    magiclink_validated.connect(receiver, sender=MagicLink)
+    results.append(('one receiver', summarise(timings(validate, iterations))))
+    magiclink_validated.disconnect(receiver, sender=MagicLink)
+
+    for name, result in results:
+        print(f'{name:>16} {result["p50_ms"]:>10.3f} {result["p99_ms"]:>10.3f}')  # NOQA: E501
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_django()
+    bench_send_signal(args.iterations * 100)
+    bench_validate(args.iterations)
+
+
+if __name__ == '__main__':
+    main()
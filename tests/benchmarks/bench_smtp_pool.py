@@ -0,0 +1,53 @@
+"""
+Count the SMTP connections opened and the time taken to send emails with
+Django's SMTP backend against the PooledSMTPEmailBackend. Emails are sent to
+a local SMTP server one at a time, as the login view does.
+
+    python -m tests.benchmarks.bench_smtp_pool --emails 1000
+"""
+import argparse
+import time
+
+from ..smtp_server import SMTPServer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emails', type=int, default=1000)
+    args = parser.parse_args()
+
+    from django.conf import settings
+    settings.configure(EMAIL_HOST='127.0.0.1')
+
+    from django.core.mail import EmailMessage
+    from django.core.mail.backends.smtp import EmailBackend
+
+    from magiclink.mail import PooledSMTPEmailBackend
+
+    print(f'{"backend":>24} {"connections":>12} {"per 1,000":>10} {"s":>8}')
+    for name, backend_class in [
+        ('EmailBackend', EmailBackend),
+        ('PooledSMTPEmailBackend', PooledSMTPEmailBackend),
+    ]:
+        server = SMTPServer().start()
+        start = time.perf_counter()
+        for index in range(args.emails):
+            connection = backend_class(port=server.port)
+            EmailMessage(
+                'Subject', 'Body', 'from@example.com',
+                [f'user{index}@example.com'], connection=connection,
+            ).send()
+        elapsed = time.perf_counter() - start
+        if backend_class is PooledSMTPEmailBackend:
+            PooledSMTPEmailBackend(port=server.port).pool.clear()
+        server.stop()
+
+        per_thousand = server.connections * 1000 / args.emails
+        print(
+            f'{name:>24} {server.connections:>12} {per_thousand:>10.1f} '
+            f'{elapsed:>8.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
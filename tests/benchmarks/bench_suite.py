@@ -0,0 +1,293 @@
+"""
+Benchmark the hot paths of django-magiclink at several MagicLink table sizes
+on SQLite and compare the results against a saved JSON baseline.
+
+For each case the p50 / p99 latency, the queries per call and the peak
+memory allocated while running the case are reported.
+
+    # Save a baseline (e.g. on the last release)
+    python -m tests.benchmarks.bench_suite --save
+    # Compare a later run against it, exiting with 1 on a regression
+    python -m tests.benchmarks.bench_suite --check
+
+Baselines are only comparable when run on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tracemalloc
+from typing import Callable, Dict, List
+
+from . import setup_django, summarise, timings
+from .bench_verify import seed
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Cases are given the table size and the number of calls to prepare for and
+# return a function which runs one call
+Case = Callable[[int, int], Callable[[], None]]
+
+
+def make_request():
+    from django.http import HttpRequest
+
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    request.META['SERVER_NAME'] = '127.0.0.1'
+    request.META['SERVER_PORT'] = 80
+    return request
+
+
+def make_links(size: int, count: int, name: str) -> List[object]:
+    from magiclink.helpers import create_magiclink, get_or_create_user
+
+    links = []
+    for index in range(count):
+        email = f'{name}{size}-{index}@example.com'
+        get_or_create_user(email)
+        links.append(create_magiclink(email, make_request()))
+    return links
+
+
+def create_case(size: int, count: int) -> Callable[[], None]:
+    from magiclink.helpers import create_magiclink
+
+    emails = [f'create{size}-{index}@example.com' for index in range(count)]
+
+    def create():
+        create_magiclink(emails.pop(), make_request())
+    return create
+
+
+def generate_url_case(size: int, count: int) -> Callable[[], None]:
+    magiclink = make_links(size, 1, 'url')[0]
+    request = make_request()
+
+    def generate_url():
+        magiclink.generate_url(request)
+    return generate_url
+
+
+def send_case(size: int, count: int) -> Callable[[], None]:
+    from django.core import mail
+
+    links = make_links(size, count, 'send')
+
+    def send():
+        mail.outbox = []
+        magiclink = links.pop()
+        magiclink.send(make_request())
+    return send
+
+
+def validate_case(size: int, count: int) -> Callable[[], None]:
+    links = make_links(size, count, 'validate')
+
+    def validate():
+        magiclink = links.pop()
+        request = make_request()
+        request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+        magiclink.validate(request, magiclink.email)
+    return validate
+
+
+def authenticate_case(size: int, count: int) -> Callable[[], None]:
+    from magiclink.backends import MagicLinkBackend
+
+    backend = MagicLinkBackend()
+    links = make_links(size, count, 'auth')
+
+    def authenticate():
+        magiclink = links.pop()
+        request = make_request()
+        request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+        user = backend.authenticate(
+            request, token=magiclink.url_token, email=magiclink.email,
+        )
+        assert user
+    return authenticate
+
+
+def login_verify_case(size: int, count: int) -> Callable[[], None]:
+    from urllib.parse import urlencode
+
+    from django.test import Client
+    from django.urls import reverse
+
+    from magiclink import settings
+
+    links = make_links(size, count, 'verify')
+    url = reverse(settings.LOGIN_VERIFY_URL)
+
+    def login_verify():
+        magiclink = links.pop()
+        client = Client()
+        client.cookies[magiclink.cookie_name] = magiclink.cookie_value
+        query = urlencode({
+            'token': magiclink.url_token, 'email': magiclink.email,
+        })
+        response = client.get(f'{url}?{query}')
+        assert response.status_code == 302, response.status_code
+    return login_verify
+
+
+CASES: Dict[str, Case] = {
+    'create_magiclink': create_case,
+    'generate_url': generate_url_case,
+    'send': send_case,
+    'validate': validate_case,
+    'authenticate': authenticate_case,
+    'login_verify': login_verify_case,
+}
+
+
+def measure(case: Case, size: int, iterations: int, samples: int) -> dict:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    result = summarise(timings(case(size, iterations), iterations))
+
+    # Queries and memory are measured in a separate, shorter run so the
+    # tracing does not skew the latencies
+    call = case(size, samples)
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(samples):
+            call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result['queries'] = len(queries.captured_queries) / samples
+    result['peak_kb'] = peak / 1024
+    return result
+
+
+def environment() -> Dict[str, str]:
+    import django
+
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, dict]],
+    baseline: Dict[str, Dict[str, dict]],
+    tolerance: float,
+) -> List[str]:
+    """
+    Returns a description of every result which is slower than the baseline
+    by more than `tolerance` (0.2 = 20%) or makes more queries
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            previous = baseline.get(name, {}).get(size)
+            if not previous:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                if result[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(
+                        f'{name} ({size} rows) {metric} '
+                        f'{previous[metric]:.3f} -> {result[metric]:.3f}'
+                    )
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f'{name} ({size} rows) queries '
+                    f'{previous["queries"]:g} -> {result["queries"]:g}'
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        '--sizes', nargs='+', type=int,
+        default=[1000, 10000, 100000, 1000000],
+    )
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument(
+        '--samples', type=int, default=20,
+        help='calls used to count queries and peak memory',
+    )
+    parser.add_argument('--cases', nargs='+', choices=list(CASES))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument(
+        '--save', action='store_true', help='save the results as baseline',
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='exit with 1 when a result regressed against the baseline',
+    )
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from magiclink import settings
+    from magiclink.models import MagicLink
+
+    # Every call uses a new email address, don't let the rate limit reject
+    # any of them
+    settings.RATE_LIMITER = ''
+
+    cases = args.cases or list(CASES)
+    results: Dict[str, Dict[str, dict]] = {name: {} for name in cases}
+    header = (
+        f'{"case":>18} {"rows":>9} {"p50 ms":>9} {"p99 ms":>9} '
+        f'{"queries":>8} {"peak KB":>9}'
+    )
+    print(header)
+    for size in sorted(args.sizes):
+        current = MagicLink.objects.count()
+        if size > current:
+            seed(size - current, current)
+        for name in cases:
+            result = measure(CASES[name], size, args.iterations, args.samples)
+            results[name][str(size)] = result
+            print(
+                f'{name:>18} {size:>9} {result["p50_ms"]:>9.3f} '
+                f'{result["p99_ms"]:>9.3f} {result["queries"]:>8g} '
+                f'{result["peak_kb"]:>9.1f}'
+            )
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(
+                {'environment': environment(), 'results': results},
+                baseline_file, indent=2, sort_keys=True,
+            )
+        print(f'\nBaseline saved to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'\nNo baseline at {args.baseline}, run with --save first')
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline['environment'] != environment():
+        print(f'\nBaseline environment differs: {baseline["environment"]}')
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if not regressions:
+        print('\nNo regressions against the baseline')
+        return
+
+    print('\nRegressions against the baseline:')
+    for regression in regressions:
+        print(f'  {regression}')
+    if args.check:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure how MagicLinkBackend.authenticate latency scales with the size of the
+MagicLink table. With the token indexed the latency should stay flat.
+
+    python -m tests.benchmarks.bench_verify --sizes 1000 10000 100000
+"""
+import argparse
+from datetime import timedelta
+
+from . import setup_django, summarise, timings
+
+
+def seed(count: int, start: int) -> None:
+    from django.utils import timezone
+
+    from magiclink.models import MagicLink
+
+    expired = timezone.now() - timedelta(days=1)
+    batch = []
+    for index in range(start, start + count):
+        batch.append(MagicLink(
+            email=f'seed{index % 1000}@example.com',
+            token=f'seed{index}',
+            expiry=expired,
+            redirect_url='',
+            disabled=True,
+        ))
+        if len(batch) >= 5000:
+            MagicLink.objects.bulk_create(batch)
+            batch = []
+    MagicLink.objects.bulk_create(batch)
+
+
+def bench(size: int, iterations: int) -> dict:
+    from django.http import HttpRequest
+
+    from magiclink.backends import MagicLinkBackend
+    from magiclink.helpers import create_magiclink, get_or_create_user
+
+    backend = MagicLinkBackend()
+    links = []
+    for index in range(iterations):
+        email = f'bench{size}-{index}@example.com'
+        get_or_create_user(email)
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '127.0.0.1'
+        links.append(create_magiclink(email, request))
+
+    def verify():
+        magiclink = links.pop()
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '127.0.0.1'
+        request.COOKIES[f'magiclink{magiclink.pk}'] = magiclink.cookie_value
+        user = backend.authenticate(
+            request, token=magiclink.url_token, email=magiclink.email,
+        )
+        assert user
+
+    return summarise(timings(verify, iterations))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+    )
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from magiclink.models import MagicLink
+
+    print(f'{"rows":>10} {"p50 ms":>10} {"p99 ms":>10}')
+    for size in sorted(args.sizes):
+        current = MagicLink.objects.count()
+        if size > current:
+            seed(size - current, current)
+        result = bench(size, args.iterations)
+        p50, p99 = result['p50_ms'], result['p99_ms']
+        print(f'{size:>10} {p50:>10.3f} {p99:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
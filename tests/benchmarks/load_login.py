@@ -0,0 +1,257 @@
+"""
+Generate login traffic from many processes to reproduce contention, e.g.
+ONE_TOKEN_PER_USER disabling links while others are inserted or lock waits
+on the MagicLink table.
+
+A threaded WSGI server (tests.benchmarks.load_server) is started with a file
+based SQLite database. Each worker process repeatedly POSTs to the login
+page, reads the magic link from the locmem outbox and GETs the verify URL.
+Throughput, tail latencies, errors by stage and the time write queries spent
+waiting for locks are reported.
+
+    python -m tests.benchmarks.load_login --workers 8 --flows 50 --users 20
+
+Fewer --users means more workers log in as the same user at once.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from http.cookiejar import CookieJar
+from typing import Dict, List, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import (
+    HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener, urlopen
+)
+
+SETTINGS = 'tests.benchmarks.load_settings'
+STAGES = ('login', 'outbox', 'verify')
+# The reason shown by the default login failed template
+LOGIN_ERROR = re.compile(rb'log you in due to:</p>\s*<p>(.*?)</p>', re.DOTALL)
+
+
+class NoRedirect(HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def prepare_database(path: str, users: int, journal_mode: str) -> None:
+    os.environ['DJANGO_SETTINGS_MODULE'] = SETTINGS
+    os.environ['MAGICLINK_LOAD_DB'] = path
+
+    import django
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connection
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    if journal_mode:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+
+    User = get_user_model()
+    User.objects.bulk_create([
+        User(username=f'load{index}', email=f'load{index}@example.com')
+        for index in range(users)
+    ])
+    connection.close()
+
+
+def start_server(path: str, port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ, DJANGO_SETTINGS_MODULE=SETTINGS, MAGICLINK_LOAD_DB=path,
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'tests.benchmarks.load_server',
+         '--port', str(port)],
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('The load server did not start')
+
+
+def run_flow(
+    opener,
+    base_url: str,
+    email: str,
+) -> Tuple[Dict[str, float], str]:
+    """
+    Returns the time taken by each stage and an error ('' if the login
+    succeeded)
+    """
+    times: Dict[str, float] = {}
+
+    def timed(stage, request):
+        start = time.perf_counter()
+        try:
+            response = opener.open(request, timeout=60)
+            status = response.status
+            body = response.read()
+        except HTTPError as error:
+            status = error.code
+            body = error.read()
+        finally:
+            times[stage] = time.perf_counter() - start
+        return status, body
+
+    cookies = {cookie.name: cookie.value for cookie in opener.cookie_jar}
+    status, _ = timed('login', Request(
+        f'{base_url}/auth/login/',
+        data=urlencode({'email': email}).encode(),
+        headers={'X-CSRFToken': cookies['csrftoken'], 'Referer': base_url},
+    ))
+    if status != 302:
+        return times, f'login {status}'
+
+    # The login response sets a magiclink<id> cookie for the new link
+    new_cookies = [
+        cookie.name for cookie in opener.cookie_jar
+        if cookie.name.startswith('magiclink') and cookie.name not in cookies
+    ]
+    if not new_cookies:
+        return times, 'login no cookie'
+    query = urlencode({'email': email, 'id': new_cookies[0][9:]})
+    status, body = timed(
+        'outbox', Request(f'{base_url}/__outbox__/?{query}'),
+    )
+    if status != 200:
+        return times, 'outbox no email'
+
+    link = urlsplit(body.decode())
+    status, body = timed(
+        'verify', Request(f'{base_url}{link.path}?{link.query}'),
+    )
+    if status != 302:
+        match = LOGIN_ERROR.search(body)
+        # Disabled links (e.g. by ONE_TOKEN_PER_USER) have no error message
+        reason = match and match.group(1).decode().strip() or 'link disabled'
+        return times, f'verify {status}: {reason}'
+    return times, ''
+
+
+def worker(args: Tuple[int, str, int, int]) -> dict:
+    worker_id, base_url, flows, users = args
+    cookie_jar = CookieJar()
+    opener = build_opener(HTTPCookieProcessor(cookie_jar), NoRedirect)
+    opener.cookie_jar = cookie_jar
+    # Fetch the CSRF cookie
+    opener.open(f'{base_url}/auth/login/', timeout=60).read()
+
+    results: Dict[str, list] = {stage: [] for stage in STAGES}
+    results['flow'] = []
+    errors: Counter = Counter()
+    for flow in range(flows):
+        email = f'load{(worker_id * flows + flow) % users}@example.com'
+        start = time.perf_counter()
+        try:
+            times, error = run_flow(opener, base_url, email)
+        except (URLError, OSError) as exception:
+            times, error = {}, f'connection {type(exception).__name__}'
+        for stage, value in times.items():
+            results[stage].append(value)
+        if error:
+            errors[error] += 1
+        else:
+            results['flow'].append(time.perf_counter() - start)
+    return {'times': results, 'errors': dict(errors)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--flows', type=int, default=50,
+                        help='logins per worker')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--journal-mode', default='',
+                        help='e.g. WAL to test SQLite write ahead logging')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='magiclink-load-')
+    path = os.path.join(directory, 'db.sqlite3')
+    prepare_database(path, args.users, args.journal_mode)
+    server = start_server(path, args.port)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.workers) as pool:
+            outcomes = pool.map(worker, [
+                (worker_id, base_url, args.flows, args.users)
+                for worker_id in range(args.workers)
+            ])
+        elapsed = time.perf_counter() - start
+        with urlopen(f'{base_url}/__stats__/', timeout=60) as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+
+    times: Dict[str, list] = {stage: [] for stage in STAGES + ('flow',)}
+    errors: Counter = Counter()
+    for outcome in outcomes:
+        for stage, values in outcome['times'].items():
+            times[stage].extend(values)
+        errors.update(outcome['errors'])
+
+    total = args.workers * args.flows
+    succeeded = len(times['flow'])
+    print(f'{total} logins from {args.workers} workers in {elapsed:.1f}s')
+    print(f'Throughput: {succeeded / elapsed:.1f} successful logins/s')
+
+    print(f'\n{"stage":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+          f'{"max ms":>9}')
+    for stage in STAGES + ('flow',):
+        values = times[stage]
+        print(
+            f'{stage:>8} {percentile(values, 0.5) * 1000:>9.1f} '
+            f'{percentile(values, 0.95) * 1000:>9.1f} '
+            f'{percentile(values, 0.99) * 1000:>9.1f} '
+            f'{(max(values) if values else 0) * 1000:>9.1f}'
+        )
+
+    print(f'\nErrors: {total - succeeded}')
+    for error, count in errors.most_common():
+        print(f'  {error}: {count}')
+
+    print(
+        f'\nWrite queries: {stats["writes"]}, '
+        f'p99 {stats["write_p99_ms"]:.1f}ms, '
+        f'max {stats["write_max_ms"]:.1f}ms'
+    )
+    print(
+        f'Lock waits: {stats["lock_waits"]} writes took over 10ms '
+        f'({stats["lock_wait_seconds"]:.2f}s), '
+        f'{stats["locked_errors"]} "database is locked" errors'
+    )
+
+
+if __name__ == '__main__':
+    main()
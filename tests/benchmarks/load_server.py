@@ -0,0 +1,144 @@
+"""
+Threaded WSGI server used by the load harness. Besides the site it serves:
+
+* /__outbox__/?email=...&id=... - pops the email for the magic link with the
+  id (the number in its cookie name)
+* /__stats__/ - how long write queries took, showing time spent waiting
+  for database locks
+
+Started by tests.benchmarks.load_login, or by hand with:
+
+    DJANGO_SETTINGS_MODULE=tests.benchmarks.load_settings \\
+        python -m tests.benchmarks.load_server --port 8766
+"""
+import argparse
+import html
+import json
+import re
+import threading
+import time
+from typing import List
+from urllib.parse import parse_qs
+
+from django.db import OperationalError
+
+# Write queries slower than this (in seconds) are counted as lock waits
+LOCK_WAIT = 0.01
+
+WRITE_QUERY = re.compile(r'^\s*(INSERT|UPDATE|DELETE)', re.IGNORECASE)
+LINK = re.compile(r'https?://\S+token=[^\s"<]+')
+
+
+class QueryStats():
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.write_times: List[float] = []
+        self.locked_errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not WRITE_QUERY.match(sql):
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if 'locked' in str(error):
+                with self.lock:
+                    self.locked_errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.write_times.append(time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        with self.lock:
+            times = sorted(self.write_times)
+            locked_errors = self.locked_errors
+        waits = [value for value in times if value > LOCK_WAIT]
+        return {
+            'writes': len(times),
+            'lock_waits': len(waits),
+            'lock_wait_seconds': sum(waits),
+            'write_p99_ms': times[int(len(times) * 0.99)] * 1000 if times else 0,  # NOQA: E501
+            'write_max_ms': times[-1] * 1000 if times else 0,
+            'locked_errors': locked_errors,
+        }
+
+
+def pop_link(email: str, selector: str) -> str:
+    from django.core import mail
+
+    outbox = getattr(mail, 'outbox', [])
+    # The locmem backend appends from many threads, list operations are
+    # atomic so scanning from the end is safe enough for the harness
+    for index in range(len(outbox) - 1, -1, -1):
+        message = outbox[index]
+        if email in message.to and f'token={selector}' in message.body:
+            del outbox[index]
+            match = LINK.search(message.body)
+            # The plain text email is autoescaped
+            return html.unescape(match.group(0)) if match else ''
+    return ''
+
+
+def application(stats: QueryStats):
+    from django.core.wsgi import get_wsgi_application
+
+    from magiclink.models import MagicLink
+    from magiclink.signals import magiclink_sent
+
+    site = get_wsgi_application()
+
+    # Emails are matched to magic links by their token selector so workers
+    # logging in as the same user get their own link
+    selectors = {}
+
+    def remember_selector(magiclink, **kwargs):
+        selectors[str(magiclink.pk)] = magiclink.token
+
+    magiclink_sent.connect(remember_selector, sender=MagicLink, weak=False)
+
+    def app(environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == '/__outbox__/':
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            selector = selectors.pop(query.get('id', [''])[0], None)
+            email = query.get('email', [''])[0]
+            body = pop_link(email, selector).encode() if selector else b''
+            status = '200 OK' if body else '404 Not Found'
+            start_response(status, [('Content-Type', 'text/plain')])
+            return [body]
+        if path == '/__stats__/':
+            body = json.dumps(stats.summary()).encode()
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return [body]
+        return site(environ, start_response)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+
+    from django.core.servers.basehttp import run
+    from django.db.backends.signals import connection_created
+
+    stats = QueryStats()
+
+    def track_queries(connection, **kwargs):
+        connection.execute_wrappers.append(stats)
+
+    connection_created.connect(track_queries, weak=False)
+    run('127.0.0.1', args.port, application(stats), threading=True)
+
+
+if __name__ == '__main__':
+    main()
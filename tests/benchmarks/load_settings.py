@@ -0,0 +1,34 @@
+"""
+Settings for the load harness (tests.benchmarks.load_login). The test
+settings with a file based SQLite database shared by the server threads and
+the locmem email backend so the harness can read the magic links.
+"""
+import os
+
+from tests.settings import *  # NOQA: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('MAGICLINK_LOAD_DB', '/tmp/magiclink-load.sqlite3'),  # NOQA: E501
+        # Seconds a connection waits for a lock before "database is locked"
+        'OPTIONS': {'timeout': 20},
+    }
+}
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# Many requests are made for the same users
+MAGICLINK_RATE_LIMITER = ''
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'null': {'class': 'logging.NullHandler'}},
+    'loggers': {
+        'django.server': {'handlers': ['null'], 'propagate': False},
+        'magiclink': {'handlers': ['null'], 'propagate': False},
+    },
+}
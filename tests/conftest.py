@@ -0,0 +1,10 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Rate limit counters are kept in the cache
+    cache.clear()
+    yield
+    cache.clear()
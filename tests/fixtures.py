@@ -1,3 +1,4 @@
+import django
 import pytest
 from django.contrib.auth import get_user_model
 
@@ -5,6 +6,11 @@ from magiclink.helpers import create_magiclink, get_or_create_user
 
 User = get_user_model()
 
+# The async views and helpers use the async ORM methods added in Django 4.2
+requires_async_orm = pytest.mark.skipif(
+    django.VERSION < (4, 2), reason='Needs Django 4.2+',
+)
+
 
 @pytest.fixture()
 def user():
@@ -0,0 +1,83 @@
+"""
+A minimal local SMTP server used to test and benchmark the pooled SMTP
+backend. It accepts every message and counts the connections opened.
+"""
+import socketserver
+import threading
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.sockets.append(self.connection)
+
+        self.reply(b'220 localhost ESMTP')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b'.\r\n':
+                    in_data = False
+                    with server.lock:
+                        server.messages += 1
+                    self.reply(b'250 OK')
+                continue
+
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply(b'250 localhost')
+            elif command == b'DATA':
+                in_data = True
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            else:
+                self.reply(b'250 OK')
+
+    def reply(self, message):
+        try:
+            self.wfile.write(message + b'\r\n')
+        except OSError:
+            pass
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.sockets = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.drop_connections()
+        self.server_close()
+
+    def drop_connections(self):
+        """
+        Close every open client connection as a server timeout would
+        """
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+                sock.close()
+            except OSError:
+                pass
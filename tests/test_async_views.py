@@ -0,0 +1,228 @@
+import re
+import sys
+from importlib import import_module, reload
+from urllib.parse import urlencode
+
+import django
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.http.cookie import SimpleCookie
+from django.test import AsyncClient
+from django.urls import reverse
+
+from magiclink.models import MagicLink
+
+from .fixtures import requires_async_orm, user  # NOQA: F401
+
+pytestmark = requires_async_orm
+
+User = get_user_model()
+
+
+def run(coroutine_function, *args, **kwargs):
+    return async_to_sync(coroutine_function)(*args, **kwargs)
+
+
+def verify_url(email):
+    # The raw token is only available from the email
+    token = re.search(r'token=([^&\s]+)', mail.outbox[-1].body).group(1)
+    url = reverse('magiclink_async:login_verify')
+    return f'{url}?{urlencode({"token": token, "email": email})}'
+
+
+@pytest.mark.django_db
+def test_async_login_get():
+    client = AsyncClient()
+    response = run(client.get, reverse('magiclink_async:login'))
+    assert response.status_code == 200
+    assert response.context_data['login_form']
+    # The CSRF cookie is set once the template has rendered
+    assert 'csrftoken' in response.cookies
+
+
+@pytest.mark.django_db
+def test_async_login_csrf(user):  # NOQA: F811
+    client = AsyncClient(enforce_csrf_checks=True)
+    response = run(
+        client.post, reverse('magiclink_async:login'), {'email': user.email},
+    )
+    assert response.status_code == 403
+    assert MagicLink.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_async_login_post(user, mocker):  # NOQA: F811
+    spy = mocker.spy(MagicLink, 'generate_url')
+    client = AsyncClient()
+    response = run(
+        client.post, reverse('magiclink_async:login'), {'email': user.email},
+    )
+    assert response.status_code == 302
+    assert response.url == reverse('magiclink:login_sent')
+
+    magiclink = MagicLink.objects.get(email=user.email)
+    assert response.cookies[magiclink.cookie_name].value == magiclink.cookie_value  # NOQA: E501
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == [user.email]
+    assert verify_url(user.email).split('?')[1] in spy.spy_return
+
+
+@pytest.mark.django_db
+def test_async_login_post_invalid():
+    client = AsyncClient()
+    response = run(
+        client.post, reverse('magiclink_async:login'), {'email': 'invalid'},
+    )
+    assert response.status_code == 200
+    error = ['Enter a valid email address.']
+    assert response.context_data['login_form'].errors['email'] == error
+
+
+@pytest.mark.django_db
+def test_async_login_too_many_requests(user):  # NOQA: F811
+    client = AsyncClient()
+    url = reverse('magiclink_async:login')
+    run(client.post, url, {'email': user.email})
+    response = run(client.post, url, {'email': user.email})
+    assert response.status_code == 200
+    error = ['Too many magic login requests']
+    assert response.context_data['login_form'].errors['email'] == error
+
+
+@pytest.mark.django_db
+def test_async_login_verify(user):  # NOQA: F811
+    client = AsyncClient()
+    run(client.post, reverse('magiclink_async:login'), {'email': user.email})
+    magiclink = MagicLink.objects.get(email=user.email)
+
+    client.cookies = SimpleCookie({magiclink.cookie_name: magiclink.cookie_value})  # NOQA: E501
+    response = run(client.get, verify_url(user.email))
+    assert response.status_code == 302
+    assert response.url == reverse('needs_login')
+    assert 'no-cache' in response['Cache-Control']
+    assert client.cookies[magiclink.cookie_name].value == ''
+
+    response = run(client.get, reverse('needs_login'))
+    assert response.status_code == 200
+
+    magiclink.refresh_from_db()
+    assert magiclink.times_used == 1
+    assert magiclink.disabled is True
+
+
+@pytest.mark.django_db
+def test_async_login_verify_failed(settings):
+    settings.MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME = 'magiclink/login_failed.html'  # NOQA: E501
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    client = AsyncClient()
+    url = reverse('magiclink_async:login_verify')
+    response = run(client.get, f'{url}?token=missing&email=a@example.com')
+    assert response.status_code == 200
+    error = 'A magic link with that token could not be found'
+    assert response.context_data['login_error'] == error
+
+
+@pytest.mark.django_db
+def test_async_login_verify_login_failed_signal(settings, mocker):
+    settings.MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME = 'magiclink/login_failed.html'  # NOQA: E501
+    receiver = mocker.Mock()
+    user_login_failed.connect(receiver)
+    try:
+        client = AsyncClient()
+        url = reverse('magiclink_async:login_verify')
+        run(client.get, f'{url}?token=missing&email=a@example.com')
+    finally:
+        user_login_failed.disconnect(receiver)
+    # Authenticated through AUTHENTICATION_BACKENDS like the sync view
+    receiver.assert_called_once()
+
+
+@pytest.mark.django_db
+def test_async_login_verify_failed_validation(settings, user):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME = 'magiclink/login_failed.html'  # NOQA: E501
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    client = AsyncClient()
+    run(client.post, reverse('magiclink_async:login'), {'email': user.email})
+
+    # A different browser without the cookie
+    response = run(AsyncClient().get, verify_url(user.email))
+    assert response.status_code == 200
+    assert response.context_data['login_error'].startswith('Browser')
+    assert MagicLink.objects.get(email=user.email).disabled is True
+
+
+@pytest.mark.django_db
+def test_async_signup():
+    client = AsyncClient()
+    data = {
+        'form_name': 'SignupForm',
+        'email': 'new@example.com',
+        'name': 'First Last',
+    }
+    response = run(client.post, reverse('magiclink_async:signup'), data)
+    assert response.status_code == 302
+    assert response.url == reverse('magiclink:login_sent')
+
+    new_user = User.objects.get(email='new@example.com')
+    assert new_user.first_name == 'First'
+    assert new_user.last_name == 'Last'
+    assert MagicLink.objects.filter(email='new@example.com').exists()
+    assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_async_signup_rate_limited(settings):
+    settings.MAGICLINK_RATE_LIMIT_IP = 1
+    client = AsyncClient()
+    url = reverse('magiclink_async:signup')
+    data = {'form_name': 'SignupFormEmailOnly', 'email': 'one@example.com'}
+    response = run(client.post, url, data)
+    assert response.status_code == 302
+
+    data['email'] = 'two@example.com'
+    response = run(client.post, url, data)
+    assert response.status_code == 200
+    error = ['Too many magic login requests']
+    form = response.context_data['SignupFormEmailOnly']
+    assert form.errors['email'] == error
+
+
+@pytest.mark.django_db
+def test_async_signup_bad_form_name():
+    client = AsyncClient()
+    url = reverse('magiclink_async:signup')
+    response = run(client.post, url, {'form_name': 'Missing'})
+    assert response.status_code == 302
+    assert response.url == url
+
+
+@pytest.mark.django_db
+@pytest.mark.urls('tests.async_urls')
+def test_async_urls_only(settings, user):  # NOQA: F811
+    # Every URL the templates reverse must be in magiclink.async_urls
+    settings.MAGICLINK_LOGIN_CODE = True
+    client = AsyncClient()
+    assert run(client.get, reverse('magiclink:login')).status_code == 200
+    assert run(client.get, reverse('magiclink:signup')).status_code == 200
+
+    url = reverse('magiclink:login')
+    response = run(client.post, url, {'email': user.email})
+    assert response.url == reverse('magiclink:login_sent')
+    response = run(client.get, response.url)
+    assert response.status_code == 200
+    assert reverse('magiclink:login_code') in response.content.decode()
+
+
+def test_async_views_old_django(monkeypatch):
+    monkeypatch.setattr(django, 'VERSION', (4, 1, 0, 'final', 0))
+    monkeypatch.delitem(sys.modules, 'magiclink.async_views')
+    with pytest.raises(ImproperlyConfigured):
+        import_module('magiclink.async_views')
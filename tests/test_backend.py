@@ -1,10 +1,20 @@
+import threading
+import time
+from importlib import reload
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError, connection
 from django.http import HttpRequest
 
 from magiclink.backends import MagicLinkBackend
-from magiclink.models import MagicLink
+from magiclink.models import MagicLink, MagicLinkConsumed
+
+from .fixtures import magic_link, requires_async_orm, user  # NOQA: F401
 
-from .fixtures import magic_link, user  # NOQA: F401
+User = get_user_model()
 
 
 @pytest.mark.django_db
@@ -23,7 +33,7 @@ def test_auth_backend(user, magic_link):  # NOQA: F811
     ml = magic_link(request)
     request.COOKIES[f'magiclink{ml.pk}'] = ml.cookie_value
     user = MagicLinkBackend().authenticate(
-        request=request, token=ml.token, email=user.email
+        request=request, token=ml.url_token, email=user.email
     )
     assert user
     ml = MagicLink.objects.get(token=ml.token)
@@ -31,6 +41,23 @@ def test_auth_backend(user, magic_link):  # NOQA: F811
     assert ml.disabled is True
 
 
+@requires_async_orm
+@pytest.mark.django_db
+def test_auth_backend_aauthenticate(user, magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[f'magiclink{ml.pk}'] = ml.cookie_value
+    aauthenticate = async_to_sync(MagicLinkBackend().aauthenticate)
+    token = ml.url_token
+    assert aauthenticate(request=request, token=token, email=user.email)
+    ml = MagicLink.objects.get(token=ml.token)
+    assert ml.times_used == 1
+    assert ml.disabled is True
+
+    result = aauthenticate(request=request, token=token, email=user.email)
+    assert result is None
+
+
 @pytest.mark.django_db
 def test_auth_backend_no_token(user, magic_link):  # NOQA: F811
     request = HttpRequest()
@@ -48,7 +75,7 @@ def test_auth_backend_disabled_token(user, magic_link):  # NOQA: F811
     ml.disabled = True
     ml.save()
     user = MagicLinkBackend().authenticate(
-        request=request, token=ml.token, email=user.email
+        request=request, token=ml.url_token, email=user.email
     )
     assert user is None
 
@@ -58,7 +85,7 @@ def test_auth_backend_no_email(user, magic_link):  # NOQA: F811
     request = HttpRequest()
     ml = magic_link(request)
     request.COOKIES[f'magiclink{ml.pk}'] = ml.cookie_value
-    user = MagicLinkBackend().authenticate(request=request, token=ml.token)
+    user = MagicLinkBackend().authenticate(request=request, token=ml.url_token)
     assert user is None
 
 
@@ -68,6 +95,199 @@ def test_auth_backend_invalid(user, magic_link):  # NOQA: F811
     ml = magic_link(request)
     request.COOKIES[f'magiclink{ml.pk}'] = ml.cookie_value
     user = MagicLinkBackend().authenticate(
-        request=request, token=ml.token, email='fake@email.com'
+        request=request, token=ml.url_token, email='fake@email.com'
     )
     assert user is None
+
+
+@pytest.mark.django_db
+def test_auth_backend_stateless(settings, user, magic_link):  # NOQA: F811
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+    assert MagicLinkBackend().authenticate(
+        request=request, token=ml.url_token, email=user.email
+    )
+    assert MagicLink.objects.count() == 0
+    assert MagicLinkConsumed.objects.get(token_id=ml.token_id).times_used == 1
+
+    # Stateless tokens are still single use
+    assert MagicLinkBackend().authenticate(
+        request=request, token=ml.url_token, email=user.email
+    ) is None
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_auth_backend_stateless_bad_signature(settings, user, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+    assert MagicLinkBackend().authenticate(
+        request=request, token=f'{ml.url_token}x', email=user.email
+    ) is None
+    assert MagicLinkConsumed.objects.count() == 0
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_auth_backend_stateless_disabled(settings, user, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+    assert MagicLinkBackend().authenticate(
+        request=request, token=ml.url_token, email=user.email
+    ) is None
+
+
+@pytest.mark.django_db
+def test_auth_backend_stateless_failed_validation(settings, user, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = 'bad_value'
+    assert MagicLinkBackend().authenticate(
+        request=request, token=ml.url_token, email=user.email
+    ) is None
+    consumed = MagicLinkConsumed.objects.get(token_id=ml.token_id)
+    assert consumed.times_used == mlsettings.TOKEN_USES
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_auth_backend_concurrent_verifies(settings, user, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_TOKEN_USES = 3
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    ml = magic_link(HttpRequest())
+    attempts = 12
+    barrier = threading.Barrier(attempts, timeout=10)
+    results = []
+
+    def verify():
+        request = HttpRequest()
+        request.COOKIES[ml.cookie_name] = ml.cookie_value
+        barrier.wait()
+        try:
+            # A lock which is never released fails the test, not hangs it
+            for _ in range(1000):
+                try:
+                    result = MagicLinkBackend().authenticate(
+                        request=request, token=ml.url_token, email=user.email,
+                    )
+                except OperationalError:
+                    # SQLite's shared in memory test database raises
+                    # instead of waiting for a table lock. Retry as a
+                    # client would
+                    time.sleep(0.001)
+                    continue
+                results.append(result)
+                break
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=verify) for _ in range(attempts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == attempts
+    assert len([result for result in results if result]) == 3
+    ml = MagicLink.objects.get(token=ml.token)
+    assert ml.times_used == 3
+    assert ml.disabled is True
+
+    settings.MAGICLINK_TOKEN_USES = 1
+    reload(mlsettings)
+
+
+@pytest.fixture
+def user_cache(settings):
+    settings.MAGICLINK_USER_CACHE_TIMEOUT = 60
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    yield
+    settings.MAGICLINK_USER_CACHE_TIMEOUT = 0
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_cached(user, user_cache, django_assert_num_queries):  # NOQA: F811,E501
+    backend = MagicLinkBackend()
+    with django_assert_num_queries(1):
+        assert backend.get_user(user.id) == user
+        assert backend.get_user(user.id) == user
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_cache_invalidated(user, user_cache):  # NOQA: F811,E501
+    backend = MagicLinkBackend()
+    assert backend.get_user(user.id).is_active
+
+    user.is_active = False
+    user.save()
+    assert not backend.get_user(user.id).is_active
+
+    user_id = user.id
+    user.delete()
+    assert backend.get_user(user_id) is None
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_cache_timeout(user, user_cache, freezer):  # NOQA: F811,E501
+    freezer.move_to('2000-01-01T00:00:00')
+    backend = MagicLinkBackend()
+    assert backend.get_user(user.id).is_active
+
+    # update() does not send post_save so the cached user is served until
+    # the timeout
+    User.objects.filter(pk=user.id).update(is_active=False)
+    assert backend.get_user(user.id).is_active
+    freezer.move_to('2000-01-01T00:01:01')
+    assert not backend.get_user(user.id).is_active
+
+
+@pytest.mark.django_db
+def test_auth_backend_user_saved_not_cached(user, mocker):  # NOQA: F811
+    delete = mocker.patch('magiclink.backends.cache.delete')
+    user.save()
+    user.delete()
+    delete.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_not_cached(user, django_assert_num_queries):  # NOQA: F811,E501
+    backend = MagicLinkBackend()
+    with django_assert_num_queries(2):
+        backend.get_user(user.id)
+        backend.get_user(user.id)
@@ -1,10 +1,11 @@
 from datetime import timedelta
+from io import StringIO
 
 import pytest
 from django.core.management import call_command
 from django.utils import timezone
 
-from magiclink.models import MagicLink
+from magiclink.models import MagicLink, MagicLinkConsumed
 
 
 @pytest.mark.django_db
@@ -13,7 +14,7 @@ def test_magiclink_clear_logins():
     for index in range(2):
         MagicLink.objects.create(
             email='test@example.com',
-            token='fake',
+            token=f'valid{index}',
             expiry=timezone.now(),
             redirect_url='',
         )
@@ -23,7 +24,7 @@ def test_magiclink_clear_logins():
     for index in range(2):
         MagicLink.objects.create(
             email='test@example.com',
-            token='fake',
+            token=f'expired{index}',
             expiry=two_weeks_ago,
             redirect_url='',
         )
@@ -32,7 +33,7 @@ def test_magiclink_clear_logins():
     for index in range(2):
         magic_link = MagicLink.objects.create(
             email='test@example.com',
-            token='fake',
+            token=f'disabled{index}',
             expiry=timezone.now(),
             redirect_url='',
         )
@@ -45,3 +46,72 @@ def test_magiclink_clear_logins():
     for link in all_magiclinks:
         assert not link.disabled
         assert link.expiry > timezone.now() - timedelta(days=6)
+
+
+@pytest.mark.django_db
+def test_magiclink_clear_logins_consumed():
+    MagicLinkConsumed.objects.create(
+        token_id='expired', expiry=timezone.now() - timedelta(seconds=1),
+    )
+    MagicLinkConsumed.objects.create(
+        token_id='valid', expiry=timezone.now() + timedelta(minutes=5),
+    )
+
+    call_command('magiclink_clear_logins')
+
+    assert list(
+        MagicLinkConsumed.objects.values_list('token_id', flat=True)
+    ) == ['valid']
+
+
+def create_links(count, **kwargs):
+    return MagicLink.objects.bulk_create([
+        MagicLink(
+            email='test@example.com',
+            token=f'token{index}',
+            expiry=timezone.now(),
+            redirect_url='',
+            **kwargs,
+        )
+        for index in range(count)
+    ])
+
+
+@pytest.mark.django_db
+def test_magiclink_clear_logins_batches(django_assert_num_queries):
+    create_links(25, disabled=True)
+    out = StringIO()
+
+    # One aggregate query plus one delete for each batch of 10 primary keys
+    # for both MagicLink and MagicLinkConsumed (which is empty)
+    with django_assert_num_queries(5):
+        call_command('magiclink_clear_logins', batch_size=10, stdout=out)
+
+    assert MagicLink.objects.count() == 0
+    assert 'Deleted 25 magic links' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_magiclink_clear_logins_dry_run():
+    create_links(5, disabled=True)
+    out = StringIO()
+
+    call_command('magiclink_clear_logins', dry_run=True, stdout=out)
+
+    assert MagicLink.objects.count() == 5
+    assert 'Would delete 5 magic links' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_magiclink_clear_logins_progress(mocker):
+    sleep = mocker.patch('magiclink.management.commands.magiclink_clear_logins.time.sleep')  # NOQA: E501
+    create_links(25, disabled=True)
+    out = StringIO()
+
+    call_command(
+        'magiclink_clear_logins', batch_size=10, sleep_between_batches=0.5,
+        verbosity=2, stdout=out,
+    )
+
+    assert sleep.call_count == 2
+    assert 'Deleted 10 magic links up to pk' in out.getvalue()
@@ -0,0 +1,136 @@
+import threading
+from importlib import reload
+
+import pytest
+from django.http import HttpRequest
+
+from magiclink.dispatch import (
+    SyncSendBackend, ThreadPoolSendBackend, dispatch_magiclink,
+    get_send_backend
+)
+from magiclink.models import MagicLink, MagicLinkError
+
+from .fixtures import magic_link, user  # NOQA: F401
+
+results = []
+
+
+def record_result(magiclink, error):
+    results.append((magiclink, error, threading.current_thread().name))
+
+
+@pytest.fixture
+def result_hook(settings):
+    settings.MAGICLINK_SEND_RESULT_HOOK = 'tests.test_dispatch.record_result'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    results.clear()
+    yield results
+
+    settings.MAGICLINK_SEND_RESULT_HOOK = ''
+    settings.MAGICLINK_SEND_BACKEND = 'magiclink.dispatch.SyncSendBackend'
+    reload(mlsettings)
+
+
+def test_get_send_backend_default():
+    assert isinstance(get_send_backend(), SyncSendBackend)
+
+
+@pytest.mark.django_db
+def test_dispatch_waits_for_commit(mocker, magic_link, django_capture_on_commit_callbacks):  # NOQA: F811,E501
+    send = mocker.patch.object(MagicLink, 'send')
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        dispatch_magiclink(ml, request)
+    send.assert_not_called()
+
+    callbacks[0]()
+    send.assert_called_once_with(request)
+
+
+@pytest.mark.django_db
+def test_sync_backend_reports_success(mocker, result_hook, magic_link):  # NOQA: F811,E501
+    mocker.patch.object(MagicLink, 'send')
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    SyncSendBackend().send(ml, request)
+    assert result_hook == [(ml, None, threading.current_thread().name)]
+
+
+@pytest.mark.django_db
+def test_sync_backend_reports_error(mocker, result_hook, magic_link):  # NOQA: F811,E501
+    error = MagicLinkError('Email address is on the unsubscribe list')
+    mocker.patch.object(MagicLink, 'send', side_effect=error)
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    SyncSendBackend().send(ml, request)
+    assert result_hook[0][1] is error
+
+
+@pytest.mark.django_db
+def test_hook_error_is_logged(mocker, settings, magic_link):  # NOQA: F811
+    settings.MAGICLINK_SEND_RESULT_HOOK = 'tests.test_dispatch.missing_hook'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    mocker.patch.object(MagicLink, 'send')
+    log = mocker.patch('magiclink.dispatch.log')
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    SyncSendBackend().send(ml, request)
+    log.exception.assert_called_once_with(
+        'Magic link send result hook failed'
+    )
+
+    settings.MAGICLINK_SEND_RESULT_HOOK = ''
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_thread_pool_backend(mocker, result_hook, magic_link):  # NOQA: F811
+    mocker.patch.object(MagicLink, 'send')
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    backend = ThreadPoolSendBackend()
+    backend.send(ml, request)
+    backend.executor.shutdown(wait=True)
+
+    assert len(result_hook) == 1
+    assert result_hook[0][0] == ml
+    assert result_hook[0][1] is None
+    assert result_hook[0][2].startswith('magiclink-send')
+
+
+@pytest.mark.django_db
+def test_thread_pool_backend_queue_full(mocker, settings, result_hook, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_SEND_QUEUE_SIZE = 1
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    release = threading.Event()
+
+    def send(request):
+        if threading.current_thread().name.startswith('magiclink-send'):
+            release.wait(5)
+
+    mocker.patch.object(MagicLink, 'send', side_effect=send)
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    backend = ThreadPoolSendBackend()
+    backend.send(ml, request)
+    backend.send(ml, request)  # Queue is full so this is sent inline
+    release.set()
+    backend.executor.shutdown(wait=True)
+
+    threads = [result[2] for result in result_hook]
+    assert threads[0] == threading.current_thread().name
+    assert threads[1].startswith('magiclink-send')
+
+    settings.MAGICLINK_SEND_QUEUE_SIZE = 100
+    reload(mlsettings)
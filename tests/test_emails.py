@@ -0,0 +1,64 @@
+from importlib import reload
+
+import pytest
+from django.template.loader import render_to_string
+
+from magiclink.emails import (
+    EmailRenderer, get_email_renderer, reset_email_renderer
+)
+
+from .fixtures import user  # NOQA: F401
+
+
+@pytest.mark.django_db
+def test_render_matches_render_to_string(user):  # NOQA: F811
+    from magiclink import settings as mlsettings
+
+    link_context = {
+        'user': user,
+        'magiclink': 'http://testserver/auth/login/verify/?token=abc',
+        'expiry': None,
+        'ip_address': '127.0.0.0',
+        'created': None,
+    }
+    context = {
+        'subject': mlsettings.EMAIL_SUBJECT,
+        'require_same_ip': mlsettings.REQUIRE_SAME_IP,
+        'require_same_browser': mlsettings.REQUIRE_SAME_BROWSER,
+        'token_uses': mlsettings.TOKEN_USES,
+        'style': mlsettings.EMAIL_STYLES,
+        **link_context,
+    }
+    plain, html = EmailRenderer().render(link_context)
+    assert plain == render_to_string(mlsettings.EMAIL_TEMPLATE_NAME_TEXT, context)  # NOQA: E501
+    assert html == render_to_string(mlsettings.EMAIL_TEMPLATE_NAME_HTML, context)  # NOQA: E501
+
+
+def test_get_email_renderer_cached():
+    assert get_email_renderer() is get_email_renderer()
+
+
+def test_reset_email_renderer():
+    renderer = get_email_renderer()
+    reset_email_renderer()
+    assert get_email_renderer() is not renderer
+
+
+def test_renderer_reset_on_setting_changed(settings):
+    renderer = get_email_renderer()
+    settings.MAGICLINK_EMAIL_SUBJECT = 'New subject'
+    assert get_email_renderer() is not renderer
+
+
+def test_renderer_reloaded_when_settings_change(settings):
+    renderer = get_email_renderer()
+    settings.MAGICLINK_EMAIL_SUBJECT = 'New subject'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    renderer = get_email_renderer()
+    assert renderer.static_context['subject'] == 'New subject'
+
+    del settings.MAGICLINK_EMAIL_SUBJECT
+    reload(mlsettings)
+    assert get_email_renderer().static_context['subject'] != 'New subject'
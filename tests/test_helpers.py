@@ -2,16 +2,22 @@ from datetime import timedelta
 from importlib import reload
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils import timezone
 
 from magiclink import settings as mlsettings
-from magiclink.helpers import create_magiclink, get_or_create_user
+from magiclink.helpers import (
+    acreate_magiclink, aget_or_create_user, create_magiclink,
+    get_or_create_user
+)
 from magiclink.models import MagicLink, MagicLinkError
+from magiclink.tokens import hash_verifier
 
-from .fixtures import user  # NOQA: F401
+from .fixtures import requires_async_orm, user  # NOQA: F401
 from .models import CustomUserEmailOnly, CustomUserFullName, CustomUserName
 
 User = get_user_model()
@@ -27,13 +33,24 @@ def test_create_magiclink(settings, freezer):
     request.META['REMOTE_ADDR'] = '127.0.0.1'
     magic_link = create_magiclink(email, request)
     assert magic_link.email == email
-    assert len(magic_link.token) == mlsettings.TOKEN_LENGTH
+    assert len(magic_link.verifier) == mlsettings.TOKEN_LENGTH
+    assert magic_link.verifier_hash == hash_verifier(magic_link.verifier)
     assert magic_link.expiry == expiry
     assert magic_link.redirect_url == reverse(settings.LOGIN_REDIRECT_URL)
     assert len(magic_link.cookie_value) == 36
     assert magic_link.ip_address == '127.0.0.0'  # Anonymize IP by default
 
 
+@requires_async_orm
+@pytest.mark.django_db
+def test_acreate_magiclink():
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    magic_link = async_to_sync(acreate_magiclink)('test@example.com', request)
+    assert MagicLink.objects.get(pk=magic_link.pk).email == 'test@example.com'
+    assert magic_link.verifier_hash == hash_verifier(magic_link.verifier)
+
+
 @pytest.mark.django_db
 def test_create_magiclink_require_same_ip_off_no_ip(settings):
     settings.MAGICLINK_REQUIRE_SAME_IP = False
@@ -114,6 +131,36 @@ def test_create_magiclink_login_request_time_limit():
         create_magiclink(email, request)
 
 
+@pytest.mark.django_db
+def test_create_magiclink_stateless(settings):
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    email = 'test@example.com'
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    magic_link = create_magiclink(email, request)
+    assert magic_link.pk is None
+    assert magic_link.token_id
+    assert MagicLink.objects.count() == 0
+
+    found = MagicLink.objects.get_by_token(magic_link.url_token)
+    assert found.token_id == magic_link.token_id
+    assert found.email == email
+    assert found.ip_address == '127.0.0.0'
+    assert found.cookie_value == magic_link.cookie_value
+    assert found.redirect_url == magic_link.redirect_url
+    assert found.expiry == magic_link.expiry.replace(microsecond=0)
+
+    with pytest.raises(MagicLinkError):
+        create_magiclink(email, request)
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
 @pytest.mark.django_db
 def test_get_or_create_user_exists(user):  # NOQA: F811
     usr = get_or_create_user(email=user.email)
@@ -121,6 +168,15 @@ def test_get_or_create_user_exists(user):  # NOQA: F811
     assert User.objects.count() == 1
 
 
+@requires_async_orm
+@pytest.mark.django_db
+def test_aget_or_create_user(user):  # NOQA: F811
+    assert async_to_sync(aget_or_create_user)(email=user.email) == user
+    new_user = async_to_sync(aget_or_create_user)(email='new@example.com')
+    assert new_user.email == 'new@example.com'
+    assert User.objects.count() == 2
+
+
 @pytest.mark.django_db
 def test_get_or_create_user_exists_ignore_case(settings, user):  # NOQA: F811
     settings.MAGICLINK_EMAIL_IGNORE_CASE = True
@@ -14,12 +14,13 @@ User = get_user_model()
 
 
 @pytest.mark.django_db
-def test_login_end_to_end(mocker, settings, client, user):  # NOQA: F811
+def test_login_end_to_end(mocker, settings, client, user, django_capture_on_commit_callbacks):  # NOQA: F811,E501
     spy = mocker.spy(MagicLink, 'generate_url')
 
     login_url = reverse('magiclink:login')
     data = {'email': user.email}
-    client.post(login_url, data, follow=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(login_url, data, follow=True)
     verify_url = spy.spy_return
     response = client.get(verify_url, follow=True)
     assert response.status_code == 200
@@ -54,13 +55,14 @@ def test_signup_require_signup_context(client):
 
 
 @pytest.mark.django_db
-def test_login_post(mocker, client, user, settings):  # NOQA: F811
+def test_login_post(mocker, client, user, settings, django_capture_on_commit_callbacks):  # NOQA: F811,E501
     from magiclink import settings as mlsettings
     send_mail = mocker.patch('magiclink.models.send_mail')
 
     url = reverse('magiclink:login')
     data = {'email': user.email}
-    response = client.post(url, data, enforce_csrf_checks=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(url, data, enforce_csrf_checks=True)
     assert response.status_code == 302
     assert response.url == reverse('magiclink:login_sent')
     usr = User.objects.get(email=user.email)
@@ -77,6 +79,7 @@ def test_login_post(mocker, client, user, settings):  # NOQA: F811
         recipient_list=[user.email],
         from_email=settings.DEFAULT_FROM_EMAIL,
         html_message=mocker.ANY,
+        connection=mocker.ANY,
     )
 
 
@@ -339,3 +342,27 @@ def test_login_pass_email_in_unsubscribe(settings, client, user):  # NOQA: F811,
     assert response.url == reverse('magiclink:login_sent')
     magiclink = MagicLink.objects.get(email=user.email)
     assert magiclink
+
+
+@pytest.mark.django_db
+def test_login_post_single_user_query(mocker, settings, client, user, django_assert_num_queries, django_capture_on_commit_callbacks):  # NOQA: F811,E501
+    settings.MAGICLINK_IGNORE_UNSUBSCRIBE_IF_USER = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    mocker.patch('magiclink.models.send_mail')
+    url = reverse('magiclink:login')
+    data = {'email': user.email}
+
+    # User, unsubscribe check (form), disable previous links, insert the
+    # magic link and the unsubscribe check when sending
+    with django_assert_num_queries(5) as queries:
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(url, data)
+    assert response.status_code == 302
+
+    user_queries = [
+        query['sql'] for query in queries.captured_queries
+        if query['sql'].startswith('SELECT')
+        and f'FROM "{User._meta.db_table}"' in query['sql']
+    ]
+    assert len(user_queries) == 1
@@ -0,0 +1,297 @@
+import threading
+import time
+from importlib import reload
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.http.cookie import SimpleCookie
+from django.urls import reverse
+
+from magiclink.backends import MagicLinkBackend, get_request_magiclink_error
+from magiclink.helpers import create_magiclink
+from magiclink.models import MagicLink
+from magiclink.tokens import hash_code
+
+from .fixtures import requires_async_orm, user  # NOQA: F401
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def login_code(settings):
+    settings.MAGICLINK_LOGIN_CODE = True
+    settings.MAGICLINK_RATE_LIMITER = ''
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def request_link(rf, client, email):
+    magiclink = create_magiclink(email, rf.get('/'))
+    client.cookies = SimpleCookie({
+        magiclink.cookie_name: magiclink.cookie_value,
+    })
+    return magiclink
+
+
+def post_code(client, email, code):
+    return client.post(
+        reverse('magiclink:login_code'), {'email': email, 'code': code},
+    )
+
+
+@pytest.mark.django_db
+def test_create_magiclink_code(rf, user):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    assert len(magiclink.code) == 6
+    assert magiclink.code.isdigit()
+
+    # Only the hash is stored
+    saved = MagicLink.objects.get(pk=magiclink.pk)
+    assert saved.code == ''
+    assert saved.code_hash == hash_code(user.email, magiclink.code)
+    assert magiclink.code not in saved.code_hash
+
+
+@pytest.mark.django_db
+def test_create_magiclink_code_disabled(settings, rf, user):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_CODE = False
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    assert magiclink.code == ''
+    assert magiclink.code_hash == ''
+
+
+@pytest.mark.django_db
+def test_code_in_email(rf, user):  # NOQA: F811
+    request = rf.get('/')
+    magiclink = create_magiclink(user.email, request)
+    plain, html = magiclink.render_email(request, user)
+    assert magiclink.code in plain
+    assert magiclink.code in html
+
+
+@pytest.mark.django_db
+def test_login_sent_code_form(client):
+    response = client.get(reverse('magiclink:login_sent'))
+    assert 'login_code_form' in response.context_data
+    assert reverse('magiclink:login_code') in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_login_code(rf, client, user):  # NOQA: F811
+    magiclink = request_link(rf, client, user.email)
+
+    response = post_code(client, user.email.upper(), magiclink.code)
+    assert response.status_code == 302
+    assert response.url == magiclink.redirect_url
+    assert client.cookies[magiclink.cookie_name].value == ''
+    assert client.get(reverse('needs_login')).status_code == 200
+
+    magiclink = MagicLink.objects.get(pk=magiclink.pk)
+    assert magiclink.times_used == 1
+    assert magiclink.disabled
+
+
+@pytest.mark.django_db
+def test_login_code_used(rf, client, user):  # NOQA: F811
+    magiclink = request_link(rf, client, user.email)
+    post_code(client, user.email, magiclink.code)
+    client.logout()
+    client.cookies[magiclink.cookie_name] = magiclink.cookie_value
+
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 200
+    errors = response.context_data['login_code_form'].non_field_errors()
+    assert errors == ['That code is incorrect or has expired']
+
+
+@pytest.mark.django_db
+def test_login_code_incorrect(rf, client, user):  # NOQA: F811
+    magiclink = request_link(rf, client, user.email)
+    code = '000000' if magiclink.code != '000000' else '111111'
+
+    response = post_code(client, user.email, code)
+    assert response.status_code == 200
+    errors = response.context_data['login_code_form'].non_field_errors()
+    assert errors == ['That code is incorrect or has expired']
+    # An incorrect code does not use up the magic link
+    assert not MagicLink.objects.get(pk=magiclink.pk).disabled
+
+
+@pytest.mark.django_db
+def test_login_code_attempts(settings, rf, client, user):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_CODE_ATTEMPTS = 3
+    magiclink = request_link(rf, client, user.email)
+    code = '000000' if magiclink.code != '000000' else '111111'
+
+    for _ in range(3):
+        post_code(client, user.email, code)
+
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 200
+    errors = response.context_data['login_code_form'].non_field_errors()
+    assert errors == ['Too many incorrect login codes']
+
+    # Other email addresses are not affected
+    other = User.objects.create(username='other', email='other@example.com')
+    other_link = request_link(rf, client, other.email)
+    response = post_code(client, other.email, other_link.code)
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_login_code_attempts_reset(settings, rf, client, user):  # NOQA: F811,E501
+    settings.MAGICLINK_LOGIN_CODE_ATTEMPTS = 2
+    magiclink = request_link(rf, client, user.email)
+    code = '000000' if magiclink.code != '000000' else '111111'
+
+    post_code(client, user.email, code)
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 302
+
+    client.logout()
+    magiclink = request_link(rf, client, user.email)
+    post_code(client, user.email, code)
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 302
+
+
+def test_login_code_attempts_concurrent(settings, mocker):
+    settings.MAGICLINK_LOGIN_CODE_ATTEMPTS = 3
+    attempts = 12
+    barrier = threading.Barrier(attempts, timeout=10)
+    errors = []
+
+    def get_by_code(email, code):
+        # Hold each guess between the attempt check and the answer so the
+        # guesses overlap
+        time.sleep(0.05)
+        raise MagicLink.DoesNotExist
+
+    lookup = mocker.patch(
+        'magiclink.storage.DatabaseStorage.get_by_code',
+        side_effect=get_by_code,
+    )
+
+    def guess():
+        request = HttpRequest()
+        barrier.wait()
+        MagicLinkBackend().authenticate(
+            request=request, email='test@example.com', code='000000',
+        )
+        errors.append(get_request_magiclink_error(request))
+
+    threads = [threading.Thread(target=guess) for _ in range(attempts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert lookup.call_count == 3
+    assert errors.count('Too many incorrect login codes') == attempts - 3
+
+
+@pytest.mark.django_db
+def test_login_code_validated(settings, rf, client, user):  # NOQA: F811
+    settings.MAGICLINK_ALLOW_STAFF_LOGIN = False
+    User.objects.filter(pk=user.pk).update(is_staff=True)
+    magiclink = request_link(rf, client, user.email)
+
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 200
+    errors = response.context_data['login_code_form'].non_field_errors()
+    assert errors == [
+        'You can not login to a staff account using a magic link',
+    ]
+    assert MagicLink.objects.get(pk=magiclink.pk).disabled
+
+
+@pytest.mark.django_db
+def test_login_code_different_browser(rf, client, user):  # NOQA: F811
+    magiclink = request_link(rf, client, user.email)
+    client.cookies = SimpleCookie()
+
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 200
+    errors = response.context_data['login_code_form'].non_field_errors()
+    assert errors == [
+        'Browser is different from the browser used to request the magic '
+        'link',
+    ]
+
+
+@pytest.mark.django_db
+def test_login_code_bad_form(client, user):  # NOQA: F811
+    response = post_code(client, user.email, 'abc')
+    assert response.status_code == 200
+    form = response.context_data['login_code_form']
+    assert form.errors['code'] == ['The code should only contain numbers']
+
+
+@pytest.mark.django_db
+def test_login_code_disabled(settings, client, user):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_CODE = False
+    response = post_code(client, user.email, '123456')
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_login_code_stateless(settings, client, user):  # NOQA: F811
+    settings.MAGICLINK_STATELESS = True
+    response = client.get(reverse('magiclink:login_sent'))
+    assert 'login_code_form' not in response.context_data
+
+    response = post_code(client, user.email, '123456')
+    assert response.status_code == 404
+
+
+@requires_async_orm
+@pytest.mark.django_db
+@pytest.mark.urls('tests.async_urls')
+def test_login_code_async_urls(rf, client, user):  # NOQA: F811
+    response = client.get(reverse('magiclink:login_sent'))
+    assert response.status_code == 200
+    assert reverse('magiclink:login_code') in response.content.decode()
+
+    magiclink = request_link(rf, client, user.email)
+    response = post_code(client, user.email, magiclink.code)
+    assert response.status_code == 302
+    assert response.url == magiclink.redirect_url
+
+
+def test_login_code_get(client):
+    response = client.get(reverse('magiclink:login_code'))
+    assert response.status_code == 405
+
+
+@pytest.mark.django_db
+def test_backend_authenticate_code(rf, user):  # NOQA: F811
+    request = rf.get('/')
+    magiclink = create_magiclink(user.email, request)
+    request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+
+    backend = MagicLinkBackend()
+    assert backend.authenticate(request, email=user.email, code='') is None
+    assert backend.authenticate(
+        request, email=user.email, code=magiclink.code,
+    ) == user
+    assert request.magiclink.pk == magiclink.pk
+
+
+@requires_async_orm
+@pytest.mark.django_db(transaction=True)
+def test_backend_aauthenticate_code(rf, user):  # NOQA: F811
+    request = rf.get('/')
+    magiclink = create_magiclink(user.email, request)
+    request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+
+    backend = MagicLinkBackend()
+    authenticated = async_to_sync(backend.aauthenticate)(
+        request, email=user.email, code=magiclink.code,
+    )
+    assert authenticated == user
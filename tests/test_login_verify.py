@@ -3,10 +3,15 @@ from urllib.parse import urlencode
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.http import HttpRequest
 from django.http.cookie import SimpleCookie
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from magiclink.models import MagicLink
+
 from .fixtures import magic_link, user  # NOQA: F401
 
 User = get_user_model()
@@ -20,7 +25,7 @@ def test_login_verify(client, settings, magic_link):  # NOQA: F811
     ml.ip_address = '127.0.0.0'  # This is a little hacky
     ml.save()
 
-    params = {'token': ml.token}
+    params = {'token': ml.url_token}
     params['email'] = ml.email
     query = urlencode(params)
     url = f'{url}?{query}'
@@ -95,7 +100,7 @@ def test_login_verify_failed_validation(client, settings, magic_link):  # NOQA:
     url = reverse('magiclink:login_verify')
     request = HttpRequest()
     ml = magic_link(request)
-    params = {'token': ml.token}
+    params = {'token': ml.url_token}
     params['email'] = ml.email
     query = urlencode(params)
     url = f'{url}?{query}'
@@ -150,3 +155,71 @@ def test_login_verify_custom_verify(client, settings, magic_link):  # NOQA: F811
     settings.MAGICLINK_LOGIN_VERIFY_URL = 'magiclink:login_verify'
     from magiclink import settings
     reload(settings)
+
+
+@pytest.mark.django_db
+def test_login_verify_stateless(client, settings, magic_link):  # NOQA: F811
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    cache.clear()
+
+    request = HttpRequest()
+    request.META['SERVER_NAME'] = '127.0.0.1'
+    request.META['SERVER_PORT'] = 80
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    ml = magic_link(request)
+    url = ml.generate_url(request)
+
+    cookie_name = ml.cookie_name
+    client.cookies = SimpleCookie({cookie_name: ml.cookie_value})
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response.url == reverse(settings.LOGIN_REDIRECT_URL)
+    assert client.cookies[cookie_name].value == ''
+    assert MagicLink.objects.count() == 0
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
+def magiclink_selects(queries):
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith('SELECT')
+        and 'FROM "magiclink_magiclink"' in query['sql']
+    ]
+
+
+@pytest.mark.django_db
+def test_login_verify_single_lookup(client, magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    ml.ip_address = '127.0.0.0'  # This is a little hacky
+    ml.save()
+
+    url = reverse('magiclink:login_verify')
+    query = urlencode({'token': ml.url_token, 'email': ml.email})
+    client.cookies = SimpleCookie({ml.cookie_name: ml.cookie_value})
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(f'{url}?{query}')
+    assert response.status_code == 302
+    assert len(magiclink_selects(queries.captured_queries)) == 1
+
+
+@pytest.mark.django_db
+def test_login_verify_failed_single_lookup(client, settings, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME = 'magiclink/login_failed.html'  # NOQA: E501
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    url = reverse('magiclink:login_verify')
+    query = urlencode({'token': ml.url_token, 'email': ml.email})
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(f'{url}?{query}')
+    assert response.status_code == 200
+    assert response.context_data['login_error'].startswith('IP address')
+    assert len(magiclink_selects(queries.captured_queries)) == 1
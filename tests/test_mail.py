@@ -0,0 +1,113 @@
+from importlib import reload
+
+import pytest
+from django.core.mail import EmailMessage
+from django.http import HttpRequest
+
+from magiclink.mail import PooledSMTPEmailBackend, get_mail_connection
+
+from .fixtures import magic_link, user  # NOQA: F401
+from .smtp_server import SMTPServer
+
+
+@pytest.fixture
+def smtp_server(settings):
+    server = SMTPServer().start()
+    settings.EMAIL_HOST = '127.0.0.1'
+    settings.EMAIL_PORT = server.port
+    yield server
+    server.stop()
+
+
+def send(count, **kwargs):
+    for index in range(count):
+        backend = PooledSMTPEmailBackend(**kwargs)
+        message = EmailMessage(
+            'Subject', 'Body', 'from@example.com', [f'to{index}@example.com'],
+            connection=backend,
+        )
+        assert message.send() == 1
+
+
+def pool():
+    return PooledSMTPEmailBackend().pool
+
+
+def test_pooled_backend_reuses_connection(smtp_server):
+    send(20)
+    assert smtp_server.messages == 20
+    assert smtp_server.connections == 1
+    assert pool().opened == 1
+    pool().clear()
+
+
+def test_pooled_backend_max_age(smtp_server):
+    send(3, max_age=0)
+    assert smtp_server.messages == 3
+    assert smtp_server.connections == 3
+
+
+def test_pooled_backend_pool_size(smtp_server):
+    first = PooledSMTPEmailBackend(pool_size=1)
+    second = PooledSMTPEmailBackend(pool_size=1)
+    first.open()
+    second.open()
+    first.close()
+    second.close()  # Pool is full so this connection is closed
+    assert len(first.pool.idle) == 1
+    assert smtp_server.connections == 2
+    pool().clear()
+
+
+def test_pooled_backend_keepalive_detects_dropped_connection(smtp_server):
+    send(1, keepalive=0)
+    smtp_server.drop_connections()
+    send(1, keepalive=0)
+    assert smtp_server.messages == 2
+    assert smtp_server.connections == 2
+    pool().clear()
+
+
+def test_pooled_backend_reconnects_when_send_fails(smtp_server):
+    send(1, keepalive=60)
+    smtp_server.drop_connections()
+    send(1, keepalive=60)
+    assert smtp_server.messages == 2
+    assert smtp_server.connections == 2
+    pool().clear()
+
+
+def test_get_mail_connection(settings):
+    settings.MAGICLINK_EMAIL_BACKEND = 'magiclink.mail.PooledSMTPEmailBackend'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    assert isinstance(get_mail_connection(), PooledSMTPEmailBackend)
+
+    settings.MAGICLINK_EMAIL_BACKEND = ''
+    reload(mlsettings)
+    assert not isinstance(get_mail_connection(), PooledSMTPEmailBackend)
+
+
+@pytest.mark.django_db
+def test_send_uses_magiclink_email_backend(settings, smtp_server, magic_link):  # NOQA: F811,E501
+    settings.MAGICLINK_EMAIL_BACKEND = 'magiclink.mail.PooledSMTPEmailBackend'
+    settings.MAGICLINK_RATE_LIMITER = ''
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    for index in range(3):
+        request = HttpRequest()
+        request.META['SERVER_NAME'] = '127.0.0.1'
+        request.META['SERVER_PORT'] = 80
+        ml = magic_link(request)
+        ml.send(request)
+        ml.delete()
+
+    assert smtp_server.messages == 3
+    assert smtp_server.connections == 1
+    pool().clear()
+
+    settings.MAGICLINK_EMAIL_BACKEND = ''
+    settings.MAGICLINK_RATE_LIMITER = 'magiclink.ratelimit.CacheRateLimiter'
+    reload(mlsettings)
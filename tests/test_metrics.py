@@ -0,0 +1,193 @@
+from importlib import reload
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.http import HttpRequest
+from django.urls import reverse
+
+from magiclink import metrics
+from magiclink.backends import MagicLinkBackend
+from magiclink.helpers import create_magiclink
+from magiclink.metrics import (
+    InMemoryMetrics, PrometheusMetrics, get_metrics, measure
+)
+from magiclink.models import MagicLinkError, MagicLinkUnsubscribe
+
+from .fixtures import magic_link, requires_async_orm, user  # NOQA: F401
+
+
+@pytest.fixture
+def sink(settings):
+    from magiclink import settings as mlsettings
+
+    def _sink(path='magiclink.metrics.InMemoryMetrics'):
+        settings.MAGICLINK_METRICS = path
+        reload(mlsettings)
+        return get_metrics()
+
+    metrics.load_metrics.cache_clear()
+    yield _sink
+    metrics.load_metrics.cache_clear()
+    settings.MAGICLINK_METRICS = ''
+    reload(mlsettings)
+
+
+def make_request():
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    request.META['SERVER_NAME'] = '127.0.0.1'
+    request.META['SERVER_PORT'] = 80
+    return request
+
+
+def test_metrics_disabled():
+    assert get_metrics() is None
+
+    @measure('test_seconds')
+    def func():
+        return 'result'
+
+    assert func() == 'result'
+
+
+@pytest.mark.django_db
+def test_metrics_links_created(sink):
+    in_memory = sink()
+    request = make_request()
+    create_magiclink('test@example.com', request)
+    assert in_memory.counter('links_created') == 1
+
+    with pytest.raises(MagicLinkError):
+        create_magiclink('test@example.com', request)
+    assert in_memory.counter('links_created') == 1
+    assert in_memory.counter('rate_limited') == 1
+
+
+@pytest.mark.django_db
+def test_metrics_send(sink, user, magic_link):  # NOQA: F811
+    in_memory = sink()
+    request = make_request()
+    ml = magic_link(request)
+    ml.send(request)
+    assert in_memory.histogram('send_seconds').count == 1
+    assert in_memory.counter('send_failures', reason='unsubscribed') == 0
+
+    MagicLinkUnsubscribe.objects.create(email=user.email)
+    with pytest.raises(MagicLinkError):
+        ml.send(make_request())
+    assert in_memory.histogram('send_seconds').count == 2
+    assert in_memory.counter('send_failures', reason='unsubscribed') == 1
+
+
+@pytest.mark.django_db
+def test_metrics_verify(sink, user, magic_link):  # NOQA: F811
+    in_memory = sink()
+    request = make_request()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+    backend = MagicLinkBackend()
+    token = ml.url_token
+
+    assert backend.authenticate(request, token=token, email=user.email)
+    assert in_memory.histogram('verify_seconds').count == 1
+
+    assert not backend.authenticate(request, token=token, email=user.email)
+    assert in_memory.counter('verify_failures', reason='disabled') == 1
+
+    assert not backend.authenticate(request, token='missing', email='a@b.c')
+    assert in_memory.counter('verify_failures', reason='not_found') == 1
+    assert in_memory.histogram('verify_seconds').count == 3
+
+
+@pytest.mark.django_db
+def test_metrics_verify_failure_reason(sink, user, magic_link, freezer):  # NOQA: F811,E501
+    in_memory = sink()
+    freezer.move_to('2000-01-01T00:00:00')
+    request = make_request()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+
+    freezer.move_to('2000-01-02T00:00:00')
+    user = MagicLinkBackend().authenticate(
+        request, token=ml.url_token, email=user.email,
+    )
+    assert user is None
+    assert in_memory.counter('verify_failures', reason='expired') == 1
+
+
+@requires_async_orm
+@pytest.mark.django_db
+def test_metrics_async(sink, user, magic_link):  # NOQA: F811
+    in_memory = sink()
+    request = make_request()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+    async_to_sync(ml.asend)(request)
+    assert in_memory.histogram('send_seconds').count == 1
+
+    async_to_sync(MagicLinkBackend().aauthenticate)(
+        request, token=ml.url_token, email=user.email,
+    )
+    assert in_memory.histogram('verify_seconds').count == 1
+
+
+def test_metrics_measure_failures(sink):
+    in_memory = sink()
+
+    @measure('test_seconds', failures='test_failures')
+    def func():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        func()
+    assert in_memory.counter('test_failures', reason='ValueError') == 1
+    assert in_memory.histogram('test_seconds').count == 1
+
+
+def test_metrics_histogram_buckets():
+    in_memory = InMemoryMetrics()
+    for value in (0.0005, 0.002, 0.002, 60):
+        in_memory.observe('test_seconds', value, {})
+
+    histogram = in_memory.histogram('test_seconds')
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(60.0045)
+    cumulative = histogram.cumulative_counts()
+    assert cumulative[0] == 1
+    assert cumulative[1] == 3
+    assert cumulative[-1] == 3
+
+
+def test_metrics_prometheus_render():
+    prometheus = PrometheusMetrics()
+    prometheus.increment('verify_failures', {'reason': 'expired'})
+    prometheus.increment('verify_failures', {'reason': 'say "hi"'})
+    prometheus.increment('links_created', {}, 3)
+    prometheus.observe('verify_seconds', 0.003, {})
+
+    lines = prometheus.render().splitlines()
+    assert '# TYPE magiclink_links_created_total counter' in lines
+    assert 'magiclink_links_created_total 3' in lines
+    assert '# TYPE magiclink_verify_failures_total counter' in lines
+    assert 'magiclink_verify_failures_total{reason="expired"} 1' in lines
+    assert 'magiclink_verify_failures_total{reason="say \\"hi\\""} 1' in lines
+    assert lines.count('# TYPE magiclink_verify_failures_total counter') == 1
+    assert '# TYPE magiclink_verify_seconds histogram' in lines
+    assert 'magiclink_verify_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'magiclink_verify_seconds_bucket{le="0.005"} 1' in lines
+    assert 'magiclink_verify_seconds_bucket{le="+Inf"} 1' in lines
+    assert 'magiclink_verify_seconds_sum 0.003' in lines
+    assert 'magiclink_verify_seconds_count 1' in lines
+
+
+def test_metrics_prometheus_view(client, sink):
+    url = reverse('metrics')
+    sink()
+    assert client.get(url).status_code == 404
+
+    prometheus = sink('magiclink.metrics.PrometheusMetrics')
+    prometheus.increment('links_created', {})
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain')
+    assert b'magiclink_links_created_total 1' in response.content
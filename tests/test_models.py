@@ -4,6 +4,7 @@ from urllib.parse import quote
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils import timezone
@@ -35,7 +36,8 @@ def test_generate_url(settings, magic_link):  # NOQA: F811
     request.META['SERVER_NAME'] = host
     request.META['SERVER_PORT'] = 80
     ml = magic_link(request)
-    url = f'http://{host}{login_url}?token={ml.token}&email={quote(ml.email)}'
+    query = f'token={ml.url_token}&email={quote(ml.email)}'
+    url = f'http://{host}{login_url}?{query}'
     assert ml.generate_url(request) == url
 
 
@@ -51,7 +53,8 @@ def test_generate_url_custom_verify(settings, magic_link):  # NOQA: F811
     request.META['SERVER_NAME'] = host
     request.META['SERVER_PORT'] = 80
     ml = magic_link(request)
-    url = f'http://{host}{login_url}?token={ml.token}&email={quote(ml.email)}'
+    query = f'token={ml.url_token}&email={quote(ml.email)}'
+    url = f'http://{host}{login_url}?{query}'
     assert ml.generate_url(request) == url
 
     settings.MAGICLINK_LOGIN_VERIFY_URL = 'magiclink:login_verify'
@@ -63,7 +66,9 @@ def test_generate_url_custom_verify(settings, magic_link):  # NOQA: F811
 def test_send_email(mocker, settings, magic_link):  # NOQA: F811
     from magiclink import settings as mlsettings
     send_mail = mocker.patch('magiclink.models.send_mail')
-    render_to_string = mocker.patch('magiclink.models.render_to_string')
+    render = mocker.patch(
+        'magiclink.emails.EmailRenderer.render', return_value=('plain', 'html')
+    )
 
     request = HttpRequest()
     request.META['SERVER_NAME'] = '127.0.0.1'
@@ -74,27 +79,20 @@ def test_send_email(mocker, settings, magic_link):  # NOQA: F811
 
     usr = User.objects.get(email=ml.email)
     context = {
-        'subject': mlsettings.EMAIL_SUBJECT,
         'user': usr,
         'magiclink': ml.generate_url(request),
         'expiry': ml.expiry,
         'ip_address': ml.ip_address,
         'created': ml.created,
-        'require_same_ip': mlsettings.REQUIRE_SAME_IP,
-        'require_same_browser': mlsettings.REQUIRE_SAME_BROWSER,
-        'token_uses': mlsettings.TOKEN_USES,
-        'style': mlsettings.EMAIL_STYLES,
     }
-    render_to_string.assert_has_calls([
-        mocker.call(mlsettings.EMAIL_TEMPLATE_NAME_TEXT, context),
-        mocker.call(mlsettings.EMAIL_TEMPLATE_NAME_HTML, context),
-    ])
+    render.assert_called_once_with(context)
     send_mail.assert_called_once_with(
         subject=mlsettings.EMAIL_SUBJECT,
-        message=mocker.ANY,
+        message='plain',
         recipient_list=[ml.email],
         from_email=settings.DEFAULT_FROM_EMAIL,
-        html_message=mocker.ANY,
+        html_message='html',
+        connection=mocker.ANY,
     )
 
 
@@ -132,6 +130,7 @@ def test_send_email_pass_email_in_unsubscribe(mocker, settings, magic_link):  #
         recipient_list=[ml.email],
         from_email=settings.DEFAULT_FROM_EMAIL,
         html_message=mocker.ANY,
+        connection=mocker.ANY,
     )
 
 
@@ -234,6 +233,26 @@ def test_validate_used_times(user, magic_link):  # NOQA: F811
     assert ml.disabled is True
 
 
+@pytest.mark.django_db
+def test_validate_inactive_user(settings, user, magic_link):  # NOQA: F811
+    settings.MAGICLINK_IGNORE_IS_ACTIVE_FLAG = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    request = HttpRequest()
+    ml = magic_link(request)
+    request.COOKIES[f'magiclink{ml.pk}'] = ml.cookie_value
+    user.is_active = False
+    user.save()
+    with pytest.raises(MagicLinkError) as error:
+        ml.validate(request=request, email=user.email)
+
+    error.match('This user has been deactivated')
+
+    ml = MagicLink.objects.get(token=ml.token)
+    assert ml.disabled is True
+
+
 @pytest.mark.django_db
 def test_validate_superuser(settings, user, magic_link):  # NOQA: F811
     settings.MAGICLINK_ALLOW_SUPERUSER_LOGIN = False
@@ -274,3 +293,181 @@ def test_validate_staff(settings, user, magic_link):  # NOQA: F811
     ml = MagicLink.objects.get(token=ml.token)
     assert ml.times_used == 1
     assert ml.disabled is True
+
+
+@pytest.mark.django_db
+def test_token_unique(magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    with pytest.raises(IntegrityError):
+        MagicLink.objects.create(
+            email='other@example.com',
+            token=ml.token,
+            expiry=ml.expiry,
+            redirect_url='',
+        )
+
+
+@pytest.mark.django_db
+def test_get_by_token(magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    assert MagicLink.objects.get_by_token(ml.url_token) == ml
+
+
+@pytest.mark.django_db
+def test_get_by_token_wrong_verifier(magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    with pytest.raises(MagicLink.DoesNotExist):
+        MagicLink.objects.get_by_token(f'{ml.token}.wrongverifier')
+
+
+@pytest.mark.django_db
+def test_get_by_token_selector_only(magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    with pytest.raises(MagicLink.DoesNotExist):
+        MagicLink.objects.get_by_token(ml.token)
+
+
+@pytest.mark.django_db
+def test_get_by_token_legacy(settings):
+    settings.MAGICLINK_ALLOW_LEGACY_TOKENS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    ml = MagicLink.objects.create(
+        email='test@example.com',
+        token='legacyplaintexttoken',
+        expiry=timezone.now(),
+        redirect_url='',
+    )
+    assert ml.url_token == ml.token
+    assert MagicLink.objects.get_by_token(ml.token) == ml
+
+
+@pytest.mark.django_db
+def test_get_by_token_legacy_disabled(settings):
+    settings.MAGICLINK_ALLOW_LEGACY_TOKENS = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    ml = MagicLink.objects.create(
+        email='test@example.com',
+        token='legacyplaintexttoken',
+        expiry=timezone.now(),
+        redirect_url='',
+    )
+    with pytest.raises(MagicLink.DoesNotExist):
+        MagicLink.objects.get_by_token(ml.token)
+
+    settings.MAGICLINK_ALLOW_LEGACY_TOKENS = True
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_url_token_not_stored(magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    ml = MagicLink.objects.get(pk=ml.pk)
+    with pytest.raises(MagicLinkError):
+        ml.url_token
+
+
+@pytest.mark.django_db
+def test_used(user, magic_link):  # NOQA: F811
+    ml = magic_link(HttpRequest())
+    ml.used()
+    assert ml.times_used == 1
+    assert ml.disabled is True
+
+    ml = MagicLink.objects.get(token=ml.token)
+    assert ml.times_used == 1
+    assert ml.disabled is True
+
+
+@pytest.mark.django_db
+def test_used_multiple_uses(settings, user, magic_link):  # NOQA: F811
+    settings.MAGICLINK_TOKEN_USES = 2
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    ml = magic_link(HttpRequest())
+    ml.used()
+    assert MagicLink.objects.get(token=ml.token).disabled is False
+    ml.used()
+    assert MagicLink.objects.get(token=ml.token).disabled is True
+    with pytest.raises(MagicLinkError):
+        ml.used()
+    assert MagicLink.objects.get(token=ml.token).times_used == 2
+
+    settings.MAGICLINK_TOKEN_USES = 1
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_used_disabled_or_expired(user, magic_link, freezer):  # NOQA: F811
+    freezer.move_to('2000-01-01T00:00:00')
+    ml = magic_link(HttpRequest())
+    MagicLink.objects.filter(pk=ml.pk).update(disabled=True)
+    with pytest.raises(MagicLinkError):
+        ml.used()
+
+    MagicLink.objects.filter(pk=ml.pk).update(disabled=False)
+    freezer.move_to('2000-01-01T00:15:00')
+    with pytest.raises(MagicLinkError):
+        ml.used()
+    assert MagicLink.objects.get(token=ml.token).times_used == 0
+
+
+def make_links(email, expiry):
+    return MagicLink.objects.bulk_create([
+        MagicLink(
+            email=email, token=f'{email}{index}', expiry=expiry,
+            redirect_url='', disabled=index == 0,
+        )
+        for index in range(3)
+    ])
+
+
+@pytest.mark.django_db
+def test_queryset_active_expired():
+    now = timezone.now()
+    make_links('live@example.com', now + timedelta(minutes=5))
+    make_links('dead@example.com', now - timedelta(days=8))
+
+    active = MagicLink.objects.active()
+    assert {ml.email for ml in active} == {'live@example.com'}
+    assert active.count() == 2
+
+    assert MagicLink.objects.expired().count() == 3
+    assert MagicLink.objects.expired(now - timedelta(days=9)).count() == 0
+
+
+@pytest.mark.django_db
+def test_queryset_disable_all():
+    expiry = timezone.now() + timedelta(minutes=5)
+    make_links('one@example.com', expiry)
+    make_links('two@example.com', expiry)
+
+    make_links('old@example.com', timezone.now() - timedelta(minutes=5))
+
+    magic_links = MagicLink.objects.for_email('one@example.com')
+    assert magic_links.count() == 3
+    assert magic_links.disable_all() == 2
+    assert not magic_links.active().exists()
+    assert MagicLink.objects.for_email('two@example.com').active().count() == 2
+
+    # Expired links are disabled as well so they leave the partial index
+    expired = MagicLink.objects.for_email('old@example.com')
+    assert expired.disable_all() == 2
+    assert not expired.filter(disabled=False).exists()
+
+
+@pytest.mark.django_db
+def test_queryset_active_uses_partial_index():
+    if connection.vendor != 'sqlite':  # pragma: no cover
+        pytest.skip('The query plan is checked on SQLite')
+    plan = MagicLink.objects.for_email('test@example.com').active().explain()
+    assert 'magiclink_active_idx' in plan
@@ -0,0 +1,234 @@
+"""
+Pin the number of queries, and the tables they touch, for each view and
+management command. A failure here means a change added (or removed)
+queries on a hot path; update the budget only if that was intended.
+"""
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+from importlib import reload
+from io import StringIO
+from urllib.parse import urlencode
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.http.cookie import SimpleCookie
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from magiclink.helpers import create_magiclink
+from magiclink.models import MagicLink
+
+from .fixtures import user  # NOQA: F401
+
+User = get_user_model()
+
+MAGICLINK = MagicLink._meta.db_table
+UNSUBSCRIBE = 'magiclink_magiclinkunsubscribe'
+CONSUMED = 'magiclink_magiclinkconsumed'
+USER = User._meta.db_table
+SESSION = 'django_session'
+
+TABLE = re.compile(r'(?:FROM|INTO|UPDATE|JOIN)\s+"(\w+)"')
+# Savepoints come from atomic blocks (e.g. saving the session), not queries
+SAVEPOINT = re.compile(r'^(RELEASE )?SAVEPOINT ')
+
+
+@pytest.fixture(autouse=True)
+def default_settings(mocker):
+    # Earlier tests can leave changed settings behind
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    mocker.patch('magiclink.models.send_mail')
+    yield
+    reload(mlsettings)
+
+
+@contextmanager
+def query_budget(count, tables):
+    with CaptureQueriesContext(connection) as context:
+        yield
+    queries = [
+        query['sql'] for query in context.captured_queries
+        if not SAVEPOINT.match(query['sql'])
+    ]
+    touched = {table for sql in queries for table in TABLE.findall(sql)}
+    assert len(queries) == count, '\n'.join(queries)
+    assert touched == set(tables), '\n'.join(queries)
+
+
+def verify_url(client, magiclink, email=None):
+    client.cookies = SimpleCookie({
+        magiclink.cookie_name: magiclink.cookie_value,
+    })
+    query = urlencode({
+        'token': magiclink.url_token,
+        'email': email or magiclink.email,
+    })
+    return f'{reverse("magiclink:login_verify")}?{query}'
+
+
+def request_link(rf, email):
+    request = rf.get('/')
+    return create_magiclink(email, request)
+
+
+@pytest.mark.django_db
+def test_login_get(client):
+    with query_budget(0, []):
+        response = client.get(reverse('magiclink:login'))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_login_post(client, user, django_capture_on_commit_callbacks):  # NOQA: F811,E501
+    # User and unsubscribe checks in the form, disabling earlier links,
+    # inserting the link and the unsubscribe check when sending
+    with query_budget(5, [USER, UNSUBSCRIBE, MAGICLINK]):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(
+                reverse('magiclink:login'), {'email': user.email},
+            )
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_login_post_invalid(client):
+    with query_budget(0, []):
+        response = client.post(reverse('magiclink:login'), {'email': 'bad'})
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('form_name,data,count', [
+    ('SignupFormEmailOnly', {}, 6),
+    ('SignupForm', {'name': 'First Last'}, 6),
+    # Checking the username is not taken
+    ('SignupFormWithUsername', {'username': 'new'}, 7),
+    ('SignupFormFull', {'username': 'new', 'name': 'First Last'}, 7),
+])
+def test_signup_post(client, django_capture_on_commit_callbacks, form_name, data, count):  # NOQA: E501
+    data = {'form_name': form_name, 'email': 'new@example.com', **data}
+    # Unsubscribe check in the form, looking up then creating the user,
+    # disabling earlier links, inserting the link and the unsubscribe check
+    # when sending
+    with query_budget(count, [USER, UNSUBSCRIBE, MAGICLINK]):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(reverse('magiclink:signup'), data)
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_login_verify(client, rf, user):  # NOQA: F811
+    magiclink = request_link(rf, user.email)
+    url = verify_url(client, magiclink)
+    # The link, the user and recording the use, then Django's login: creating
+    # the session, updating last_login and saving the session
+    with query_budget(7, [MAGICLINK, USER, SESSION]):
+        response = client.get(url)
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_login_code(settings, client, rf, user):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_CODE = True
+    magiclink = request_link(rf, user.email)
+    verify_url(client, magiclink)
+    # One lookup on the (email, code_hash) index, then the same queries as
+    # following the link
+    with query_budget(7, [MAGICLINK, USER, SESSION]):
+        response = client.post(reverse('magiclink:login_code'), {
+            'email': user.email, 'code': magiclink.code,
+        })
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('reason', [
+    'not_found', 'email_mismatch', 'expired', 'ip_address', 'browser',
+    'disabled', 'inactive', 'superuser', 'staff',
+])
+def test_login_verify_failed(settings, client, rf, user, reason):  # NOQA: F811,E501
+    settings.MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME = 'magiclink/login_failed.html'  # NOQA: E501
+    settings.MAGICLINK_ALLOW_SUPERUSER_LOGIN = False
+    settings.MAGICLINK_ALLOW_STAFF_LOGIN = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    magiclink = request_link(rf, user.email)
+    url = verify_url(client, magiclink)
+    if reason == 'not_found':
+        url = f'{reverse("magiclink:login_verify")}?token=missing&email=a@b.c'
+    elif reason == 'email_mismatch':
+        url = verify_url(client, magiclink, email='other@example.com')
+    elif reason == 'expired':
+        magiclink.expiry = timezone.now() - timedelta(seconds=1)
+        magiclink.save()
+    elif reason == 'ip_address':
+        magiclink.ip_address = '10.0.0.0'
+        magiclink.save()
+    elif reason == 'browser':
+        client.cookies = SimpleCookie()
+    elif reason == 'disabled':
+        magiclink.disabled = True
+        magiclink.save()
+    elif reason == 'inactive':
+        User.objects.filter(pk=user.pk).update(is_active=False)
+    elif reason == 'superuser':
+        User.objects.filter(pk=user.pk).update(is_superuser=True)
+    elif reason == 'staff':
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+
+    with query_budget(*BUDGETS[reason]):
+        response = client.get(url)
+    assert response.status_code == 200
+    assert 'login_error' in response.context_data or reason == 'disabled'
+
+
+# Failed logins look up the link and (if the request can use it) the user,
+# then disable the link. LoginVerify reuses the link authenticate found
+BUDGETS = {
+    'not_found': (1, [MAGICLINK]),
+    'email_mismatch': (1, [MAGICLINK]),
+    'expired': (2, [MAGICLINK]),
+    'ip_address': (2, [MAGICLINK]),
+    'browser': (2, [MAGICLINK]),
+    # LoginVerify validates the disabled link to find the error
+    'disabled': (2, [MAGICLINK, USER]),
+    'inactive': (3, [MAGICLINK, USER]),
+    'superuser': (3, [MAGICLINK, USER]),
+    'staff': (3, [MAGICLINK, USER]),
+}
+
+
+@pytest.mark.django_db
+def test_logout(client, user):  # NOQA: F811
+    client.force_login(user)
+    # Loading the session and user, then flushing the session
+    with query_budget(4, [SESSION, USER]):
+        response = client.get(reverse('magiclink:logout'))
+    assert response.status_code == 302
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', [10, 100, 1000])
+def test_clear_logins(size):
+    expiry = timezone.now() - timedelta(days=30)
+    MagicLink.objects.bulk_create([
+        MagicLink(
+            email='test@example.com', token=f'token{index}', expiry=expiry,
+            redirect_url='', disabled=index % 2 == 0,
+        )
+        for index in range(size)
+    ])
+
+    # The primary key range and one delete per batch for each model. The
+    # count depends on the number of batches, not rows
+    with query_budget(3, [MAGICLINK, CONSUMED]):
+        call_command(
+            'magiclink_clear_logins', batch_size=10000, stdout=StringIO(),
+        )
+    assert MagicLink.objects.count() == 0
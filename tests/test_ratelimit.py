@@ -0,0 +1,140 @@
+from importlib import reload
+
+import pytest
+from django.http import HttpRequest
+
+from magiclink.helpers import create_magiclink
+from magiclink.models import MagicLink, MagicLinkError
+from magiclink.ratelimit import (
+    CacheRateLimiter, check_rate_limit_cache, get_rate_limiter
+)
+
+
+def make_request(ip='127.0.0.1'):
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = ip
+    return request
+
+
+@pytest.fixture
+def limits(settings):
+    from magiclink import settings as mlsettings
+
+    def _set(**limits):
+        for name, value in limits.items():
+            setattr(settings, f'MAGICLINK_{name}', value)
+        reload(mlsettings)
+
+    yield _set
+    reload(mlsettings)
+
+
+def test_email_limit_sliding_window(limits, freezer):
+    freezer.move_to('2000-01-01T00:00:00')
+    limits(RATE_LIMIT_EMAIL=2, LOGIN_REQUEST_TIME_LIMIT=60)
+    limiter = CacheRateLimiter()
+    request = make_request()
+
+    assert limiter.allow('test@example.com', request)
+    freezer.move_to('2000-01-01T00:00:30')
+    assert limiter.allow('test@example.com', request)
+    assert not limiter.allow('test@example.com', request)
+    assert limiter.allow('other@example.com', request)
+
+    # The first request has left the window but the second has not
+    freezer.move_to('2000-01-01T00:01:01')
+    assert limiter.allow('test@example.com', request)
+    assert not limiter.allow('test@example.com', request)
+
+
+def test_rejected_requests_not_counted(limits, freezer):
+    freezer.move_to('2000-01-01T00:00:00')
+    limits(RATE_LIMIT_EMAIL=1, LOGIN_REQUEST_TIME_LIMIT=30)
+    limiter = CacheRateLimiter()
+    request = make_request()
+
+    assert limiter.allow('test@example.com', request)
+    freezer.move_to('2000-01-01T00:00:29')
+    assert not limiter.allow('test@example.com', request)
+    freezer.move_to('2000-01-01T00:00:31')
+    assert limiter.allow('test@example.com', request)
+
+
+def test_ip_limit(limits, freezer):
+    freezer.move_to('2000-01-01T00:00:00')
+    limits(RATE_LIMIT_IP=3, RATE_LIMIT_WINDOW=60)
+    limiter = CacheRateLimiter()
+
+    for index in range(3):
+        assert limiter.allow(f'test{index}@example.com', make_request())
+    assert not limiter.allow('test3@example.com', make_request())
+    assert limiter.allow('test3@example.com', make_request('127.0.0.2'))
+
+    freezer.move_to('2000-01-01T00:01:01')
+    assert limiter.allow('test4@example.com', make_request())
+
+
+def test_global_limit(limits, freezer):
+    freezer.move_to('2000-01-01T00:00:00')
+    limits(RATE_LIMIT_GLOBAL=2, RATE_LIMIT_WINDOW=60)
+    limiter = CacheRateLimiter()
+
+    assert limiter.allow('test1@example.com', make_request('127.0.0.1'))
+    assert limiter.allow('test2@example.com', make_request('127.0.0.2'))
+    assert not limiter.allow('test3@example.com', make_request('127.0.0.3'))
+
+
+def test_rejected_by_global_limit_not_counted_per_email(limits, freezer):
+    freezer.move_to('2000-01-01T00:00:00')
+    limits(
+        RATE_LIMIT_GLOBAL=1, RATE_LIMIT_WINDOW=10, LOGIN_REQUEST_TIME_LIMIT=30,
+    )
+    limiter = CacheRateLimiter()
+
+    assert limiter.allow('test1@example.com', make_request())
+    assert not limiter.allow('test2@example.com', make_request())
+
+    freezer.move_to('2000-01-01T00:00:11')
+    assert limiter.allow('test2@example.com', make_request())
+
+
+def test_get_rate_limiter_disabled(limits):
+    limits(RATE_LIMITER='')
+    assert get_rate_limiter() is None
+
+
+@pytest.mark.django_db
+def test_create_magiclink_rejected_without_queries(
+    limits, django_assert_num_queries,
+):
+    limits(RATE_LIMIT_IP=1)
+    create_magiclink('test1@example.com', make_request())
+
+    with django_assert_num_queries(0):
+        with pytest.raises(MagicLinkError):
+            create_magiclink('test2@example.com', make_request())
+    assert MagicLink.objects.count() == 1
+
+
+@pytest.mark.parametrize('backend, warned', [
+    ('django.core.cache.backends.locmem.LocMemCache', True),
+    ('django.core.cache.backends.dummy.DummyCache', True),
+    ('django.core.cache.backends.filebased.FileBasedCache', False),
+])
+def test_check_rate_limit_cache(settings, tmp_path, backend, warned):
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'ratelimit': {'BACKEND': backend, 'LOCATION': str(tmp_path)},
+    }
+    settings.MAGICLINK_RATE_LIMIT_CACHE = 'ratelimit'
+    errors = check_rate_limit_cache()
+    assert [error.id for error in errors] == (
+        ['magiclink.W001'] if warned else []
+    )
+
+
+def test_check_rate_limit_cache_disabled(settings):
+    settings.MAGICLINK_RATE_LIMITER = ''
+    assert check_rate_limit_cache() == []
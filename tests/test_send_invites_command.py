@@ -0,0 +1,164 @@
+from importlib import reload
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.http import HttpRequest
+
+from magiclink.helpers import create_magiclinks, send_magiclinks
+from magiclink.models import MagicLink, MagicLinkUnsubscribe
+
+User = get_user_model()
+
+
+def create_users(count):
+    return User.objects.bulk_create([
+        User(username=f'user{index}', email=f'user{index}@example.com')
+        for index in range(count)
+    ])
+
+
+@pytest.mark.django_db
+def test_create_magiclinks(django_assert_num_queries):
+    create_users(5)
+    MagicLinkUnsubscribe.objects.create(email='user4@example.com')
+    emails = [f'USER{index}@example.com' for index in range(6)]
+    emails.append('user0@example.com')  # Duplicate
+
+    request = HttpRequest()
+    # Users, unsubscribe list, ONE_TOKEN_PER_USER update and bulk insert
+    with django_assert_num_queries(4):
+        magic_links = create_magiclinks(emails, request, batch_size=10)
+
+    assert [ml.email for ml in magic_links] == [
+        f'user{index}@example.com' for index in range(4)
+    ]
+    assert MagicLink.objects.count() == 4
+    for magic_link in magic_links:
+        found = MagicLink.objects.get_by_token(magic_link.url_token)
+        assert found.email == magic_link.email
+
+
+@pytest.mark.django_db
+def test_create_magiclinks_one_token_per_user():
+    create_users(1)
+    request = HttpRequest()
+    old_link, = create_magiclinks(['user0@example.com'], request)
+    create_magiclinks(['user0@example.com'], request)
+
+    old_link.refresh_from_db()
+    assert old_link.disabled is True
+
+
+@pytest.mark.django_db
+def test_create_magiclinks_ignore_unsubscribe_if_user(settings):
+    settings.MAGICLINK_IGNORE_UNSUBSCRIBE_IF_USER = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    create_users(1)
+    MagicLinkUnsubscribe.objects.create(email='user0@example.com')
+    request = HttpRequest()
+    assert len(create_magiclinks(['user0@example.com'], request)) == 1
+
+    settings.MAGICLINK_IGNORE_UNSUBSCRIBE_IF_USER = False
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_send_magiclinks(mocker):
+    create_users(5)
+    request = HttpRequest()
+    request.META['SERVER_NAME'] = 'example.com'
+    request.META['SERVER_PORT'] = 80
+    emails = [f'user{index}@example.com' for index in range(5)]
+    magic_links = create_magiclinks(emails, request)
+
+    open_connection = mocker.spy(
+        mail.get_connection().__class__, 'open'
+    )
+    assert send_magiclinks(magic_links, request, batch_size=2) == 5
+
+    assert open_connection.call_count == 1
+    assert len(mail.outbox) == 5
+    message = mail.outbox[0]
+    assert message.to == ['user0@example.com']
+    assert magic_links[0].url_token in message.body
+    assert message.alternatives[0][1] == 'text/html'
+
+
+@pytest.mark.django_db
+def test_send_magiclinks_user_deleted():
+    create_users(3)
+    request = HttpRequest()
+    request.META['SERVER_NAME'] = 'example.com'
+    request.META['SERVER_PORT'] = 80
+    emails = [f'user{index}@example.com' for index in range(3)]
+    magic_links = create_magiclinks(emails, request)
+    User.objects.filter(email='user1@example.com').delete()
+    User.objects.filter(email='user2@example.com').update(
+        email='renamed@example.com',
+    )
+
+    assert send_magiclinks(magic_links, request) == 1
+    assert [message.to for message in mail.outbox] == [['user0@example.com']]
+
+
+@pytest.fixture
+def invites(settings):
+    settings.MAGICLINK_REQUIRE_SAME_IP = False
+    settings.MAGICLINK_REQUIRE_SAME_BROWSER = False
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('invites')
+def test_send_invites_command(tmp_path):
+    create_users(3)
+    path = tmp_path / 'emails.txt'
+    path.write_text(
+        '# Invites\nuser0@example.com\n\nuser1@example.com\n'
+        'user2@example.com\nmissing@example.com\n'
+    )
+
+    call_command(
+        'magiclink_send_invites', str(path), domain='example.com',
+        https=True, batch_size=2,
+    )
+
+    assert MagicLink.objects.count() == 3
+    assert len(mail.outbox) == 3
+    assert 'https://example.com/' in mail.outbox[0].body
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('setting', [
+    'MAGICLINK_REQUIRE_SAME_IP', 'MAGICLINK_REQUIRE_SAME_BROWSER',
+])
+def test_send_invites_command_requires_any_browser(settings, tmp_path, setting):  # NOQA: E501
+    create_users(1)
+    settings.MAGICLINK_REQUIRE_SAME_IP = False
+    settings.MAGICLINK_REQUIRE_SAME_BROWSER = False
+    setattr(settings, setting, True)
+    path = tmp_path / 'emails.txt'
+    path.write_text('user0@example.com\n')
+
+    with pytest.raises(CommandError):
+        call_command('magiclink_send_invites', str(path), domain='example.com')
+    assert not MagicLink.objects.exists()
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('invites')
+def test_send_invites_command_domain_over_site(mocker, tmp_path):
+    # With django.contrib.sites installed the current site would be used
+    site = mocker.patch('django.contrib.sites.shortcuts.get_current_site')
+    site.return_value.domain = 'site.example.com'
+    create_users(1)
+    path = tmp_path / 'emails.txt'
+    path.write_text('user0@example.com\n')
+
+    call_command('magiclink_send_invites', str(path), domain='example.com')
+    assert 'http://example.com/' in mail.outbox[0].body
+    site.assert_not_called()
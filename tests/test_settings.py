@@ -2,6 +2,8 @@ from importlib import reload
 
 import pytest
 from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from django.urls import reverse
 
 
 def test_login_sent_redirect(settings):
@@ -87,6 +89,16 @@ def test_token_length_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
+
+
+def test_token_length_too_long(settings):
+    settings.MAGICLINK_TOKEN_LENGTH = 256
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
 
 
 def test_token_length_low_value_warning(settings):
@@ -95,6 +107,42 @@ def test_token_length_low_value_warning(settings):
     with pytest.warns(RuntimeWarning):
         from magiclink import settings
         reload(settings)
+        settings.validate()
+
+
+def test_allow_legacy_tokens(settings):
+    settings.MAGICLINK_ALLOW_LEGACY_TOKENS = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.ALLOW_LEGACY_TOKENS == settings.MAGICLINK_ALLOW_LEGACY_TOKENS  # NOQA: E501
+
+
+def test_allow_legacy_tokens_bad_value(settings):
+    settings.MAGICLINK_ALLOW_LEGACY_TOKENS = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_stateless(settings):
+    settings.MAGICLINK_STATELESS = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.STATELESS == settings.MAGICLINK_STATELESS
+
+    settings.MAGICLINK_STATELESS = False
+    reload(mlsettings)
+
+
+def test_stateless_bad_value(settings):
+    settings.MAGICLINK_STATELESS = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
 
 
 def test_auth_timeout(settings):
@@ -110,6 +158,7 @@ def test_auth_timeout_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_token_uses(settings):
@@ -125,6 +174,7 @@ def test_token_uses_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_email_ignore_case(settings):
@@ -140,6 +190,7 @@ def test_email_ignore_case_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_require_signup(settings):
@@ -155,6 +206,7 @@ def test_require_signup_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_email_as_username(settings):
@@ -170,6 +222,7 @@ def test_email_as_username_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_allow_superuser_login(settings):
@@ -185,6 +238,7 @@ def test_allow_superuser_login_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_allow_staff_login(settings):
@@ -200,6 +254,7 @@ def test_allow_staff_login_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_ignore_active_flag_bad_value(settings):
@@ -208,6 +263,7 @@ def test_ignore_active_flag_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_verify_include_email(settings):
@@ -223,6 +279,7 @@ def test_verify_include_email_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_require_same_browser(settings):
@@ -238,6 +295,7 @@ def test_require_same_browser_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_require_same_ip(settings):
@@ -253,6 +311,7 @@ def test_require_same_ip_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_anonymize_ip(settings):
@@ -268,6 +327,7 @@ def test_anonymize_ip_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_one_token_per_user(settings):
@@ -283,6 +343,7 @@ def test_one_token_per_user_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_token_request_time_limit(settings):
@@ -298,6 +359,7 @@ def test_token_request_time_limit_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_email_styles(settings):
@@ -319,6 +381,170 @@ def test_email_styles_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
+
+
+def test_send_backend(settings):
+    settings.MAGICLINK_SEND_BACKEND = 'magiclink.dispatch.ThreadPoolSendBackend'  # NOQA: E501
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SEND_BACKEND == settings.MAGICLINK_SEND_BACKEND
+
+    settings.MAGICLINK_SEND_BACKEND = 'magiclink.dispatch.SyncSendBackend'
+    reload(mlsettings)
+
+
+def test_send_threads(settings):
+    settings.MAGICLINK_SEND_THREADS = 8
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SEND_THREADS == settings.MAGICLINK_SEND_THREADS
+
+
+def test_send_threads_bad_value(settings):
+    settings.MAGICLINK_SEND_THREADS = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_send_queue_size(settings):
+    settings.MAGICLINK_SEND_QUEUE_SIZE = 10
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SEND_QUEUE_SIZE == settings.MAGICLINK_SEND_QUEUE_SIZE
+
+
+def test_send_queue_size_bad_value(settings):
+    settings.MAGICLINK_SEND_QUEUE_SIZE = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_smtp_pool_size(settings):
+    settings.MAGICLINK_SMTP_POOL_SIZE = 2
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SMTP_POOL_SIZE == settings.MAGICLINK_SMTP_POOL_SIZE
+
+
+def test_smtp_pool_size_bad_value(settings):
+    settings.MAGICLINK_SMTP_POOL_SIZE = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_smtp_max_age(settings):
+    settings.MAGICLINK_SMTP_MAX_AGE = 60.0
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SMTP_MAX_AGE == settings.MAGICLINK_SMTP_MAX_AGE
+
+
+def test_smtp_max_age_bad_value(settings):
+    settings.MAGICLINK_SMTP_MAX_AGE = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_smtp_keepalive(settings):
+    settings.MAGICLINK_SMTP_KEEPALIVE = 10.0
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.SMTP_KEEPALIVE == settings.MAGICLINK_SMTP_KEEPALIVE
+
+
+def test_smtp_keepalive_bad_value(settings):
+    settings.MAGICLINK_SMTP_KEEPALIVE = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_rate_limiter(settings):
+    settings.MAGICLINK_RATE_LIMITER = ''
+    settings.MAGICLINK_RATE_LIMIT_CACHE = 'ratelimit'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.RATE_LIMITER == settings.MAGICLINK_RATE_LIMITER
+    assert mlsettings.RATE_LIMIT_CACHE == settings.MAGICLINK_RATE_LIMIT_CACHE
+
+
+def test_rate_limit_email(settings):
+    settings.MAGICLINK_RATE_LIMIT_EMAIL = 5
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.RATE_LIMIT_EMAIL == settings.MAGICLINK_RATE_LIMIT_EMAIL
+
+
+def test_rate_limit_email_bad_value(settings):
+    settings.MAGICLINK_RATE_LIMIT_EMAIL = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_rate_limit_ip(settings):
+    settings.MAGICLINK_RATE_LIMIT_IP = 5
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.RATE_LIMIT_IP == settings.MAGICLINK_RATE_LIMIT_IP
+
+
+def test_rate_limit_ip_bad_value(settings):
+    settings.MAGICLINK_RATE_LIMIT_IP = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_rate_limit_global(settings):
+    settings.MAGICLINK_RATE_LIMIT_GLOBAL = 5
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.RATE_LIMIT_GLOBAL == settings.MAGICLINK_RATE_LIMIT_GLOBAL
+
+
+def test_rate_limit_global_bad_value(settings):
+    settings.MAGICLINK_RATE_LIMIT_GLOBAL = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_rate_limit_window(settings):
+    settings.MAGICLINK_RATE_LIMIT_WINDOW = 5
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.RATE_LIMIT_WINDOW == settings.MAGICLINK_RATE_LIMIT_WINDOW
+
+
+def test_rate_limit_window_bad_value(settings):
+    settings.MAGICLINK_RATE_LIMIT_WINDOW = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
 
 
 def test_antispam_forms(settings):
@@ -334,6 +560,7 @@ def test_antispam_forms_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_antispam_form_submit_time(settings):
@@ -349,6 +576,7 @@ def test_antispam_form_submit_time_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
 
 
 def test_login_verify_url(settings):
@@ -371,3 +599,120 @@ def test_ignore_unsubscribe_if_user_bad_value(settings):
     with pytest.raises(ImproperlyConfigured):
         from magiclink import settings
         reload(settings)
+        settings.validate()
+
+
+def test_unsubscribe_filter(settings):
+    settings.MAGICLINK_UNSUBSCRIBE_FILTER = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.UNSUBSCRIBE_FILTER == settings.MAGICLINK_UNSUBSCRIBE_FILTER  # NOQA: E501
+
+
+def test_unsubscribe_filter_bad_value(settings):
+    settings.MAGICLINK_UNSUBSCRIBE_FILTER = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_user_cache_timeout(settings):
+    settings.MAGICLINK_USER_CACHE_TIMEOUT = 60
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.USER_CACHE_TIMEOUT == settings.MAGICLINK_USER_CACHE_TIMEOUT  # NOQA: E501
+
+
+def test_user_cache_timeout_bad_value(settings):
+    settings.MAGICLINK_USER_CACHE_TIMEOUT = 'Test'
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_metrics(settings):
+    settings.MAGICLINK_METRICS = 'magiclink.metrics.InMemoryMetrics'
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.METRICS == settings.MAGICLINK_METRICS
+
+
+def test_login_code(settings):
+    settings.MAGICLINK_LOGIN_CODE = True
+    settings.MAGICLINK_LOGIN_CODE_LENGTH = 8
+    settings.MAGICLINK_LOGIN_CODE_ATTEMPTS = 3
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.LOGIN_CODE is True
+    assert mlsettings.LOGIN_CODE_LENGTH == 8
+    assert mlsettings.LOGIN_CODE_ATTEMPTS == 3
+
+
+@pytest.mark.parametrize('name', [
+    'LOGIN_CODE', 'LOGIN_CODE_LENGTH', 'LOGIN_CODE_ATTEMPTS',
+])
+def test_login_code_bad_value(settings, name):
+    setattr(settings, f'MAGICLINK_{name}', 'Test')
+
+    with pytest.raises(ImproperlyConfigured):
+        from magiclink import settings
+        reload(settings)
+        settings.validate()
+
+
+def test_settings_are_read_lazily(settings):
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert 'TOKEN_LENGTH' not in vars(mlsettings)
+
+    assert mlsettings.TOKEN_LENGTH == 50
+    # Cached as a module attribute
+    assert vars(mlsettings)['TOKEN_LENGTH'] == 50
+
+
+def test_settings_changed_without_reload(settings):
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert mlsettings.TOKEN_LENGTH == 50
+
+    settings.MAGICLINK_TOKEN_LENGTH = 100
+    assert mlsettings.TOKEN_LENGTH == 100
+
+    with override_settings(MAGICLINK_TOKEN_LENGTH=60):
+        assert mlsettings.TOKEN_LENGTH == 60
+    assert mlsettings.TOKEN_LENGTH == 100
+
+
+@pytest.mark.parametrize('url, setting', [
+    ('magiclink:login', 'MAGICLINK_LOGIN_TEMPLATE_NAME'),
+    ('magiclink:login_sent', 'MAGICLINK_LOGIN_SENT_TEMPLATE_NAME'),
+    ('magiclink:login_verify', 'MAGICLINK_LOGIN_FAILED_TEMPLATE_NAME'),
+    ('magiclink:signup', 'MAGICLINK_SIGNUP_TEMPLATE_NAME'),
+])
+@pytest.mark.django_db
+def test_template_settings_changed_after_import(client, url, setting):
+    # The views are imported by the URLconf before the setting changes
+    template_name = 'magiclink/login_sent.html'
+    with override_settings(**{setting: template_name}):
+        response = client.get(reverse(url))
+    assert response.template_name == [template_name]
+
+
+def test_unknown_setting():
+    from magiclink import settings as mlsettings
+    with pytest.raises(AttributeError):
+        mlsettings.NOT_A_SETTING
+
+
+def test_check_settings(settings):
+    from magiclink import settings as mlsettings
+    assert mlsettings.check_settings() == []
+
+    settings.MAGICLINK_TOKEN_LENGTH = 'Test'
+    errors = mlsettings.check_settings()
+    assert [error.id for error in errors] == ['magiclink.E001']
+    assert 'MAGICLINK_TOKEN_LENGTH' in errors[0].msg
@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.http import HttpRequest
+from django.utils import timezone
+
+from magiclink.helpers import create_magiclink
+from magiclink.models import MagicLink, MagicLinkError, MagicLinkUnsubscribe
+from magiclink.signals import (
+    magiclink_consumed, magiclink_created, magiclink_failed, magiclink_sent,
+    magiclink_validated, send_signal
+)
+
+from .fixtures import magic_link, requires_async_orm, user  # NOQA: F401
+
+
+@pytest.fixture
+def receiver():
+    connected = []
+
+    def _connect(signal):
+        calls = []
+
+        def handler(**kwargs):
+            calls.append(kwargs)
+
+        signal.connect(handler, sender=MagicLink)
+        connected.append((signal, handler))
+        return calls
+
+    yield _connect
+    for signal, handler in connected:
+        signal.disconnect(handler, sender=MagicLink)
+
+
+def make_request():
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = '127.0.0.1'
+    request.META['SERVER_NAME'] = '127.0.0.1'
+    request.META['SERVER_PORT'] = 80
+    return request
+
+
+@pytest.mark.django_db
+def test_signal_created(receiver):
+    calls = receiver(magiclink_created)
+    request = make_request()
+    ml = create_magiclink('test@example.com', request)
+    assert len(calls) == 1
+    assert calls[0]['magiclink'] == ml
+    assert calls[0]['request'] == request
+    assert calls[0]['elapsed'] >= 0
+
+
+@pytest.mark.django_db
+def test_signal_sent(receiver, user, magic_link):  # NOQA: F811
+    sent = receiver(magiclink_sent)
+    failed = receiver(magiclink_failed)
+    request = make_request()
+    ml = magic_link(request)
+    ml.send(request)
+    assert len(sent) == 1
+    assert sent[0]['magiclink'] == ml
+
+    MagicLinkUnsubscribe.objects.create(email=user.email)
+    with pytest.raises(MagicLinkError):
+        ml.send(request)
+    assert len(sent) == 1
+    assert failed[0]['stage'] == 'send'
+    assert failed[0]['error'].reason == 'unsubscribed'
+
+
+@pytest.mark.django_db
+def test_signal_validated_and_consumed(receiver, user, magic_link):  # NOQA: F811,E501
+    validated = receiver(magiclink_validated)
+    consumed = receiver(magiclink_consumed)
+    request = make_request()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+
+    assert ml.validate(request, user.email) == user
+    assert validated[0]['user'] == user
+    assert validated[0]['request'] == request
+    assert validated[0]['elapsed'] >= 0
+    assert not consumed
+
+    ml.used(request)
+    assert len(consumed) == 1
+    assert consumed[0]['magiclink'] == ml
+
+
+@pytest.mark.django_db
+def test_signal_failed_validate(receiver, user, magic_link):  # NOQA: F811
+    failed = receiver(magiclink_failed)
+    validated = receiver(magiclink_validated)
+    request = make_request()
+    ml = magic_link(request)
+    ml.expiry = timezone.now() - timedelta(seconds=1)
+
+    with pytest.raises(MagicLinkError):
+        ml.validate(request, user.email)
+    assert not validated
+    assert failed[0]['stage'] == 'validate'
+    assert failed[0]['error'].reason == 'expired'
+
+
+@pytest.mark.django_db
+def test_signal_failed_used(receiver, user, magic_link):  # NOQA: F811
+    failed = receiver(magiclink_failed)
+    request = make_request()
+    ml = magic_link(request)
+    ml.used(request)
+
+    with pytest.raises(MagicLinkError):
+        ml.used(request)
+    assert failed[0]['stage'] == 'used'
+    assert failed[0]['error'].reason == 'used'
+
+
+@requires_async_orm
+@pytest.mark.django_db
+def test_signal_async(receiver, user, magic_link):  # NOQA: F811
+    validated = receiver(magiclink_validated)
+    consumed = receiver(magiclink_consumed)
+    request = make_request()
+    ml = magic_link(request)
+    request.COOKIES[ml.cookie_name] = ml.cookie_value
+
+    async_to_sync(ml.avalidate)(request, user.email)
+    async_to_sync(ml.aused)(request)
+    assert validated[0]['user'] == user
+    assert len(consumed) == 1
+
+
+def test_signal_no_receivers(mocker):
+    send = mocker.patch.object(magiclink_created, 'send')
+    send_signal(magiclink_created, MagicLink(), None, 0)
+    send.assert_not_called()
@@ -11,7 +11,7 @@ User = get_user_model()
 
 
 @pytest.mark.django_db
-def test_signup_end_to_end(mocker, settings, client):
+def test_signup_end_to_end(mocker, settings, client, django_capture_on_commit_callbacks):  # NOQA: E501
     from magiclink import settings as mlsettings
     spy = mocker.spy(MagicLink, 'generate_url')
 
@@ -24,7 +24,8 @@ def test_signup_end_to_end(mocker, settings, client):
         'email': email,
         'name': f'{first_name} {last_name}',
     }
-    client.post(login_url, data, follow=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(login_url, data, follow=True)
     verify_url = spy.spy_return
     response = client.get(verify_url, follow=True)
     assert response.status_code == 200
@@ -56,7 +57,7 @@ def test_signup_get(client):
 
 
 @pytest.mark.django_db
-def test_signup_post(mocker, client, settings):  # NOQA: F811
+def test_signup_post(mocker, client, settings, django_capture_on_commit_callbacks):  # NOQA: F811,E501
     from magiclink import settings as mlsettings
     send_mail = mocker.patch('magiclink.models.send_mail')
 
@@ -67,7 +68,8 @@ def test_signup_post(mocker, client, settings):  # NOQA: F811
         'email': email,
         'name': 'testname',
     }
-    response = client.post(url, data)
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(url, data)
     assert response.status_code == 302
     assert response.url == reverse('magiclink:login_sent')
 
@@ -85,6 +87,7 @@ def test_signup_post(mocker, client, settings):  # NOQA: F811
         recipient_list=[email],
         from_email=settings.DEFAULT_FROM_EMAIL,
         html_message=mocker.ANY,
+        connection=mocker.ANY,
     )
 
 
@@ -369,3 +372,20 @@ def test_signup_email_in_unsubscribe(client):
     assert response.status_code == 200
     form_errors = response.context[signup_form].errors
     assert form_errors['email'] == ['Email address is on the unsubscribe list']
+
+
+@pytest.mark.django_db
+def test_signup_rate_limited(settings, client):
+    settings.MAGICLINK_RATE_LIMIT_IP = 1
+    url = reverse('magiclink:signup')
+    data = {'form_name': 'SignupFormEmailOnly', 'email': 'one@example.com'}
+    response = client.post(url, data)
+    assert response.status_code == 302
+
+    data['email'] = 'two@example.com'
+    response = client.post(url, data)
+    assert response.status_code == 200
+    error = ['Too many magic login requests']
+    form = response.context_data['SignupFormEmailOnly']
+    assert form.errors['email'] == error
+    assert not MagicLink.objects.filter(email='two@example.com').exists()
@@ -0,0 +1,216 @@
+from datetime import timedelta
+from importlib import reload
+from urllib.parse import urlencode
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http.cookie import SimpleCookie
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from magiclink.backends import MagicLinkBackend
+from magiclink.helpers import create_magiclink, create_magiclinks
+from magiclink.models import MagicLink, MagicLinkError
+from magiclink.storage import (
+    CacheStorage, DatabaseStorage, get_storage, load_storage
+)
+
+from .fixtures import requires_async_orm, user  # NOQA: F401
+
+User = get_user_model()
+
+
+@pytest.fixture(params=['locmem', 'filebased'])
+def storage(request, settings, tmp_path):
+    backend = f'django.core.cache.backends.{request.param}'
+    cache = {'BACKEND': f'{backend}.LocMemCache'}
+    if request.param == 'filebased':
+        cache = {
+            'BACKEND': f'{backend}.FileBasedCache',
+            'LOCATION': str(tmp_path),
+        }
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'magiclinks': cache,
+    }
+    settings.MAGICLINK_STORAGE = 'magiclink.storage.CacheStorage'
+    settings.MAGICLINK_STORAGE_CACHE = 'magiclinks'
+    settings.MAGICLINK_RATE_LIMITER = ''
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    load_storage.cache_clear()
+    storage = get_storage()
+    storage.cache.clear()
+    yield storage
+    storage.cache.clear()
+    load_storage.cache_clear()
+
+
+def verify_url(client, magiclink):
+    client.cookies = SimpleCookie({
+        magiclink.cookie_name: magiclink.cookie_value,
+    })
+    query = urlencode({
+        'token': magiclink.url_token, 'email': magiclink.email,
+    })
+    return f'{reverse("magiclink:login_verify")}?{query}'
+
+
+def test_default_storage():
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    assert isinstance(get_storage(), DatabaseStorage)
+
+
+@pytest.mark.django_db
+def test_create_magiclink(rf, user, storage):  # NOQA: F811
+    assert isinstance(storage, CacheStorage)
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    assert magiclink.pk is None
+    assert not MagicLink.objects.exists()
+
+    stored = storage.get_by_token(magiclink.url_token)
+    assert stored.email == user.email
+    assert stored.expiry == magiclink.expiry
+    assert stored.times_used == 0
+    assert not stored.disabled
+    assert stored.cookie_name == magiclink.cookie_name
+
+
+@pytest.mark.django_db
+def test_get_by_token_not_found(rf, user, storage):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    selector, _ = magiclink.url_token.split('.')
+
+    with pytest.raises(MagicLink.DoesNotExist):
+        storage.get_by_token(f'{selector}.wrong')
+    with pytest.raises(MagicLink.DoesNotExist):
+        storage.get_by_token('missing.token')
+    with pytest.raises(MagicLink.DoesNotExist):
+        storage.get_by_token(selector)
+    with pytest.raises(MagicLink.DoesNotExist):
+        storage.get_by_token('')
+
+
+@pytest.mark.django_db
+def test_use(settings, rf, user, storage):  # NOQA: F811
+    settings.MAGICLINK_TOKEN_USES = 2
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    assert storage.use(magiclink)
+    assert storage.use(magiclink)
+    assert not storage.use(magiclink)
+
+    stored = storage.get_by_token(magiclink.url_token)
+    assert stored.disabled
+
+
+@pytest.mark.django_db
+def test_used(rf, user, storage):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    magiclink.used()
+    assert magiclink.disabled
+
+    with pytest.raises(MagicLinkError) as error:
+        magiclink.used()
+    assert error.value.reason == 'used'
+
+
+@pytest.mark.django_db
+def test_expired(rf, user, storage, freezer):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    freezer.tick(timedelta(seconds=301))
+    assert not storage.use(magiclink)
+    # The link expires from the cache along with the magic link
+    freezer.tick(timedelta(seconds=2))
+    with pytest.raises(MagicLink.DoesNotExist):
+        storage.get_by_token(magiclink.url_token)
+
+
+@pytest.mark.django_db
+def test_one_token_per_user(rf, user, storage):  # NOQA: F811
+    first = create_magiclink(user.email, rf.get('/'))
+    second = create_magiclink(user.email, rf.get('/'))
+    assert storage.get_by_token(first.url_token).disabled
+    assert not storage.get_by_token(second.url_token).disabled
+
+
+@pytest.mark.django_db
+def test_one_token_per_user_disabled(settings, rf, user, storage):  # NOQA: F811,E501
+    settings.MAGICLINK_ONE_TOKEN_PER_USER = False
+    first = create_magiclink(user.email, rf.get('/'))
+    create_magiclink(user.email, rf.get('/'))
+    assert not storage.get_by_token(first.url_token).disabled
+
+
+@pytest.mark.django_db
+def test_login_verify(client, rf, user, storage):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    url = verify_url(client, magiclink)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 302
+    assert response.url == magiclink.redirect_url
+    assert client.get(reverse('needs_login')).status_code == 200
+    # Only the user and Django's session are queried
+    assert not any(
+        MagicLink._meta.db_table in query['sql']
+        for query in queries.captured_queries
+    )
+    assert storage.get_by_token(magiclink.url_token).disabled
+
+
+@pytest.mark.django_db
+def test_login_verify_failed(client, rf, user, storage):  # NOQA: F811
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    url = verify_url(client, magiclink)
+    client.cookies = SimpleCookie()
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.context_data['login_error'] == (
+        'Browser is different from the browser used to request the magic '
+        'link'
+    )
+    # The failed attempt disabled the magic link
+    assert storage.get_by_token(magiclink.url_token).disabled
+
+
+@pytest.mark.django_db
+def test_login_code(settings, client, rf, user, storage):  # NOQA: F811
+    settings.MAGICLINK_LOGIN_CODE = True
+    magiclink = create_magiclink(user.email, rf.get('/'))
+    verify_url(client, magiclink)
+
+    response = client.post(reverse('magiclink:login_code'), {
+        'email': user.email, 'code': magiclink.code,
+    })
+    assert response.status_code == 302
+    assert storage.get_by_token(magiclink.url_token).disabled
+
+
+@requires_async_orm
+@pytest.mark.django_db(transaction=True)
+def test_aauthenticate(rf, user, storage):  # NOQA: F811
+    request = rf.get('/')
+    magiclink = create_magiclink(user.email, request)
+    request.COOKIES[magiclink.cookie_name] = magiclink.cookie_value
+
+    backend = MagicLinkBackend()
+    authenticated = async_to_sync(backend.aauthenticate)(
+        request, token=magiclink.url_token, email=user.email,
+    )
+    assert authenticated == user
+    assert storage.get_by_token(magiclink.url_token).disabled
+
+
+@pytest.mark.django_db
+def test_create_magiclinks(rf, user, storage):  # NOQA: F811
+    magiclinks = create_magiclinks([user.email], rf.get('/'))
+    assert len(magiclinks) == 1
+    assert not MagicLink.objects.exists()
+    assert storage.get_by_token(magiclinks[0].url_token).email == user.email
@@ -0,0 +1,103 @@
+from importlib import reload
+
+import pytest
+from django.core.cache import cache
+
+from magiclink.models import MagicLinkUnsubscribe, unsubscribe_filter
+from magiclink.unsubscribe import BloomFilter
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(1000)
+    emails = [f'user{index}@example.com' for index in range(1000)]
+    for email in emails:
+        bloom_filter.add(email)
+
+    assert all(email in bloom_filter for email in emails)
+    false_positives = sum(
+        f'other{index}@example.com' in bloom_filter for index in range(10000)
+    )
+    assert false_positives < 300  # Sized for a 1% error rate
+
+
+def test_bloom_filter_empty():
+    assert 'test@example.com' not in BloomFilter(0)
+
+
+@pytest.fixture
+def unsubscribe_filter_enabled(settings):
+    settings.MAGICLINK_UNSUBSCRIBE_FILTER = True
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+    yield
+    settings.MAGICLINK_UNSUBSCRIBE_FILTER = False
+    reload(mlsettings)
+
+
+@pytest.mark.django_db
+def test_is_unsubscribed():
+    MagicLinkUnsubscribe.objects.create(email='test@example.com')
+    assert MagicLinkUnsubscribe.objects.is_unsubscribed('test@example.com')
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+
+
+@pytest.mark.django_db
+def test_is_unsubscribed_filter(unsubscribe_filter_enabled, django_assert_num_queries):  # NOQA: E501
+    MagicLinkUnsubscribe.objects.create(email='test@example.com')
+
+    # Build the filter
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+
+    with django_assert_num_queries(0):
+        for index in range(10):
+            email = f'user{index}@example.com'
+            assert not MagicLinkUnsubscribe.objects.is_unsubscribed(email)
+
+    # Possible matches are checked against the database
+    with django_assert_num_queries(1):
+        assert MagicLinkUnsubscribe.objects.is_unsubscribed('test@example.com')
+
+
+@pytest.mark.django_db
+def test_is_unsubscribed_filter_invalidated(unsubscribe_filter_enabled, django_capture_on_commit_callbacks):  # NOQA: E501
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        unsubscribe = MagicLinkUnsubscribe.objects.create(
+            email='a@example.com',
+        )
+    assert MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        unsubscribe.delete()
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+
+
+@pytest.mark.django_db
+def test_is_unsubscribed_filter_invalidated_on_commit(unsubscribe_filter_enabled, django_capture_on_commit_callbacks):  # NOQA: E501
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+    version = cache.get(unsubscribe_filter.version_key)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        MagicLinkUnsubscribe.objects.create(email='a@example.com')
+        # Not until the transaction commits, otherwise another process could
+        # rebuild its filter without the new row
+        assert cache.get(unsubscribe_filter.version_key) == version
+
+    assert callbacks == [unsubscribe_filter.invalidate]
+    callbacks[0]()
+    assert cache.get(unsubscribe_filter.version_key) != version
+
+
+@pytest.mark.django_db
+def test_is_unsubscribed_filter_version_evicted(unsubscribe_filter_enabled):
+    assert not MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+    version = unsubscribe_filter.version
+
+    # Losing the version key from the cache forces a rebuild
+    MagicLinkUnsubscribe.objects.bulk_create([
+        MagicLinkUnsubscribe(email='a@example.com'),
+    ])
+    cache.clear()
+    assert MagicLinkUnsubscribe.objects.is_unsubscribed('a@example.com')
+    assert unsubscribe_filter.version != version
@@ -0,0 +1,135 @@
+import io
+import json
+from importlib import reload
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from magiclink.models import MagicLinkUnsubscribe
+
+
+def import_file(tmp_path, name, content, *args):
+    path = tmp_path / name
+    path.write_text(content)
+    out = io.StringIO()
+    call_command('magiclink_import_unsubscribes', str(path), *args, stdout=out)
+    return out.getvalue()
+
+
+def unsubscribed():
+    return list(
+        MagicLinkUnsubscribe.objects.order_by('email')
+        .values_list('email', flat=True)
+    )
+
+
+@pytest.mark.django_db
+def test_import_csv_with_header(tmp_path):
+    MagicLinkUnsubscribe.objects.create(email='b@example.com')
+    content = 'name,email\nA,a@example.com\nB,b@example.com\nA,A@example.com\n'
+    out = import_file(tmp_path, 'list.csv', content, '--batch-size', '2')
+    assert unsubscribed() == ['a@example.com', 'b@example.com']
+    assert 'Read 3 rows and imported 1 new email addresses' in out
+    assert 'rows/s' in out
+
+
+@pytest.mark.django_db
+def test_import_invalid_emails(tmp_path):
+    content = 'a@example.com\nnot an email\nb@\nb@example.com\n'
+    out = import_file(tmp_path, 'list.csv', content)
+    assert unsubscribed() == ['a@example.com', 'b@example.com']
+    assert 'imported 2 new email addresses' in out
+    assert 'Skipped 2 invalid email addresses' in out
+
+
+@pytest.mark.django_db
+def test_import_csv_without_header(tmp_path):
+    import_file(tmp_path, 'list.csv', 'a@example.com\n\nb@example.com,x\n')
+    assert unsubscribed() == ['a@example.com', 'b@example.com']
+
+
+@pytest.mark.django_db
+def test_import_ndjson(tmp_path):
+    content = '{"email": "a@example.com"}\n\n{"email": "b@example.com"}\n'
+    import_file(tmp_path, 'list.ndjson', content)
+    assert unsubscribed() == ['a@example.com', 'b@example.com']
+
+
+@pytest.mark.django_db
+def test_import_ndjson_invalid(tmp_path):
+    with pytest.raises(CommandError):
+        import_file(tmp_path, 'list.ndjson', '{"email": "a@example.com"}\nx\n')
+
+
+@pytest.mark.django_db
+def test_import_keep_case(settings, tmp_path):
+    settings.MAGICLINK_EMAIL_IGNORE_CASE = False
+    from magiclink import settings as mlsettings
+    reload(mlsettings)
+
+    import_file(tmp_path, 'list.csv', 'A@example.com\na@example.com\n')
+    assert unsubscribed() == ['A@example.com', 'a@example.com']
+
+    settings.MAGICLINK_EMAIL_IGNORE_CASE = True
+    reload(mlsettings)
+
+
+def test_import_unknown_format(tmp_path):
+    with pytest.raises(CommandError):
+        import_file(tmp_path, 'list.txt', 'a@example.com\n')
+
+
+@pytest.mark.django_db
+def test_import_format_option(tmp_path):
+    import_file(tmp_path, 'list.txt', 'a@example.com\n', '--format', 'csv')
+    assert unsubscribed() == ['a@example.com']
+
+
+@pytest.mark.django_db
+def test_export_csv(tmp_path):
+    MagicLinkUnsubscribe.objects.bulk_create([
+        MagicLinkUnsubscribe(email=f'user{index}@example.com')
+        for index in range(5)
+    ])
+    path = tmp_path / 'list.csv'
+    out = io.StringIO()
+    call_command(
+        'magiclink_export_unsubscribes', str(path), '--chunk-size', '2',
+        stdout=out,
+    )
+    lines = path.read_text().splitlines()
+    assert lines[0] == 'email'
+    assert lines[1:] == [f'user{index}@example.com' for index in range(5)]
+    assert 'Exported 5 email addresses' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_export_ndjson_stdout():
+    MagicLinkUnsubscribe.objects.create(email='a@example.com')
+    out = io.StringIO()
+    err = io.StringIO()
+    call_command(
+        'magiclink_export_unsubscribes', '-', '--format', 'ndjson',
+        stdout=out, stderr=err,
+    )
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+        {'email': 'a@example.com'},
+    ]
+    assert 'Exported 1 email addresses' in err.getvalue()
+
+
+@pytest.mark.django_db
+def test_export_import_round_trip(tmp_path):
+    MagicLinkUnsubscribe.objects.create(email='a@example.com')
+    MagicLinkUnsubscribe.objects.create(email='b@example.com')
+    path = tmp_path / 'list.ndjson'
+    call_command(
+        'magiclink_export_unsubscribes', str(path), stdout=io.StringIO(),
+    )
+    MagicLinkUnsubscribe.objects.all().delete()
+
+    call_command(
+        'magiclink_import_unsubscribes', str(path), stdout=io.StringIO(),
+    )
+    assert unsubscribed() == ['a@example.com', 'b@example.com']
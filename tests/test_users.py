@@ -0,0 +1,44 @@
+import pytest
+from django.http import HttpRequest
+
+from magiclink.helpers import get_or_create_user
+from magiclink.users import get_user, remember_user
+
+from .fixtures import user  # NOQA: F401
+
+
+@pytest.mark.django_db
+def test_get_user(user):  # NOQA: F811
+    assert get_user(user.email) == user
+    assert get_user('missing@example.com') is None
+
+
+@pytest.mark.django_db
+def test_get_user_cached_on_request(user, django_assert_num_queries):  # NOQA: F811,E501
+    request = HttpRequest()
+    with django_assert_num_queries(2):
+        assert get_user(user.email, request) == user
+        assert get_user(user.email, request) == user
+        assert get_user('missing@example.com', request) is None
+        assert get_user('missing@example.com', request) is None
+
+    with django_assert_num_queries(1):
+        assert get_user(user.email, HttpRequest()) == user
+
+
+@pytest.mark.django_db
+def test_remember_user(user, django_assert_num_queries):  # NOQA: F811
+    request = HttpRequest()
+    remember_user(user, request)
+    with django_assert_num_queries(0):
+        assert get_user(user.email, request) is user
+    remember_user(user)  # Without a request nothing is stored
+
+
+@pytest.mark.django_db
+def test_get_or_create_user_remembers_new_user(django_assert_num_queries):
+    request = HttpRequest()
+    assert get_user('new@example.com', request) is None
+    created = get_or_create_user('new@example.com', request=request)
+    with django_assert_num_queries(0):
+        assert get_user('new@example.com', request) is created
@@ -1,7 +1,9 @@
+import django
 from django.contrib.auth.decorators import login_required
 from django.http.response import HttpResponse, HttpResponseRedirect
 from django.urls import include, path, reverse
 
+from magiclink.metrics import prometheus_view
 from magiclink.views import LoginVerify
 
 
@@ -24,6 +26,12 @@ class CustomLoginVerify(LoginVerify):
 urlpatterns = [
     path('no-login/', no_login, name='no_login'),
     path('needs-login/', needs_login, name='needs_login'),
+    path('metrics/', prometheus_view, name='metrics'),
     path('custom-login-verify/', CustomLoginVerify.as_view(), name='custom_login_verify'),  # NOQA: E501
     path('auth/', include('magiclink.urls', namespace='magiclink')),
 ]
+
+if django.VERSION >= (4, 2):
+    urlpatterns += [
+        path('async-auth/', include('magiclink.async_urls', namespace='magiclink_async')),  # NOQA: E501
+    ]